@@ -79,6 +79,8 @@ class DrawingService {
       // Добавляем deviceId вместо session_id
       final deviceId = await getDeviceId();
       request.fields['device_id'] = deviceId;
+      // Картинку результата забираем отдельным запросом, а не base64 в JSON
+      request.fields['transport'] = 'binary';
       request.files.add(http.MultipartFile.fromBytes(
         'file',
         imageBytes,
@@ -98,8 +100,22 @@ class DrawingService {
         throw Exception('Processing failed: ${data['error']}');
       }
 
+      Uint8List processedImage;
+      if (data['image_url'] != null) {
+        // PNG, чтобы изображение можно было вставить в отчет без перекодирования
+        final imageResponse = await http.get(
+          Uri.parse('$baseUrl${data['image_url']}?format=png'),
+        );
+        if (imageResponse.statusCode != 200) {
+          throw Exception('Image download error: ${imageResponse.statusCode}');
+        }
+        processedImage = imageResponse.bodyBytes;
+      } else {
+        processedImage = base64.decode(data['image_base64']);
+      }
+
       return {
-        'processed_image': base64.decode(data['image_base64']),
+        'processed_image': processedImage,
         'text': data['text'],
         'number': data['number'] ?? 1,
       };
@@ -0,0 +1,85 @@
+import threading
+import time
+
+
+class Overloaded(Exception):
+    """Нет свободного места ни среди выполняемых запросов, ни в очереди"""
+
+
+class AdmissionLimiter:
+    """
+    Ограничение числа одновременных тяжелых запросов в процессе.
+    Сверх max_concurrent запросы ждут в очереди до max_queue мест,
+    остальные сразу получают отказ (чтобы клиент повторил позже,
+    а не висел в очереди сервера).
+    """
+
+    def __init__(self, max_concurrent=4, max_queue=8, queue_timeout=30.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._closed = False
+
+        # Статистика
+        self._admitted = 0
+        self._rejected = 0
+
+    def acquire(self):
+        """Занимает место или бросает Overloaded"""
+        with self._cond:
+            if self._closed:
+                self._rejected += 1
+                raise Overloaded("Сервер останавливается")
+            if self._active >= self.max_concurrent and self._waiting >= self.max_queue:
+                self._rejected += 1
+                raise Overloaded("Сервер перегружен, повторите запрос позже")
+
+            self._waiting += 1
+            deadline = time.monotonic() + self.queue_timeout
+            try:
+                while self._active >= self.max_concurrent and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or not self._cond.wait(remaining):
+                        if self._active >= self.max_concurrent:
+                            self._rejected += 1
+                            raise Overloaded("Сервер перегружен, повторите запрос позже")
+                if self._closed:
+                    self._rejected += 1
+                    raise Overloaded("Сервер останавливается")
+            finally:
+                self._waiting -= 1
+
+            self._active += 1
+            self._admitted += 1
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def close(self):
+        """Перестает принимать новые запросы (уже принятые дорабатывают)"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def drain(self, timeout=None):
+        """Ждет завершения принятых запросов. Возвращает True, если все завершились"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._active == 0, timeout)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'active': self._active,
+                'waiting': self._waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'admitted': self._admitted,
+                'rejected': self._rejected,
+                'closed': self._closed,
+            }
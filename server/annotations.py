@@ -0,0 +1,170 @@
+import json
+from xml.sax.saxutils import escape
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+def _point(p):
+    return [float(p[0]), float(p[1])]
+
+
+def _color(color):
+    """Цвет как имя или #rrggbb (кортежи RGB переводятся, чтобы разметка сериализовалась в JSON/SVG)"""
+    if isinstance(color, (tuple, list)):
+        return '#{:02x}{:02x}{:02x}'.format(*color[:3])
+    return color
+
+
+def _num(value):
+    return f"{value:.1f}".rstrip('0').rstrip('.')
+
+
+class AnnotationLayer:
+    """
+    Разметка чертежа как список векторных примитивов.
+    Этапы только добавляют примитивы, а растеризация выполняется
+    один раз в конце - без промежуточных копий страницы.
+    """
+
+    def __init__(self, items=None):
+        self.items = list(items or [])
+
+    def rect(self, box, color, width=3, kind=None, label=None, centered=False, message=None):
+        """
+        Прямоугольник по боксу (x0, y0, x1, y1).
+        centered=True - линия толщиной width по центру границы (как cv2.rectangle),
+        иначе - внутрь бокса (как ImageDraw.rectangle).
+        message - текст нарушения (для векторной разметки у клиента)
+        """
+        self.items.append({
+            'type': 'rect',
+            'box': [float(v) for v in box[:4]],
+            'color': _color(color),
+            'width': width,
+            'centered': centered,
+            'kind': kind,
+            'label': label,
+            'message': message,
+        })
+
+    def line(self, start, end, color, width=2, kind=None, label=None, message=None):
+        self.items.append({
+            'type': 'line',
+            'points': [_point(start), _point(end)],
+            'color': _color(color),
+            'width': width,
+            'kind': kind,
+            'label': label,
+            'message': message,
+        })
+
+    def text(self, xy, text, color, kind=None):
+        self.items.append({
+            'type': 'text',
+            'xy': _point(xy),
+            'text': text,
+            'color': color,
+            'kind': kind,
+        })
+
+    def extend(self, other):
+        self.items.extend(other.items)
+        return self
+
+    def scaled(self, scale):
+        """Копия слоя с координатами, умноженными на scale (толщина линий прежняя)"""
+        items = []
+        for item in self.items:
+            item = dict(item)
+            if 'box' in item:
+                item['box'] = [v * scale for v in item['box']]
+            if 'points' in item:
+                item['points'] = [[v * scale for v in point] for point in item['points']]
+            if 'xy' in item:
+                item['xy'] = [v * scale for v in item['xy']]
+            items.append(item)
+        return AnnotationLayer(items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def draw(self, draw: ImageDraw.ImageDraw):
+        """Рисует все примитивы на готовом ImageDraw"""
+        for item in self.items:
+            if item['type'] == 'rect':
+                x0, y0, x1, y1 = item['box']
+                width = item['width']
+                if item['centered']:
+                    half = width // 2
+                    x0, y0, x1, y1 = x0 - half, y0 - half, x1 + half, y1 + half
+                    width = 2 * half + 1
+                draw.rectangle([x0, y0, x1, y1], outline=item['color'], width=width)
+            elif item['type'] == 'line':
+                draw.line([tuple(p) for p in item['points']], fill=item['color'], width=item['width'])
+            elif item['type'] == 'text':
+                draw.text(tuple(item['xy']), item['text'], fill=item['color'])
+
+    def to_json(self):
+        """Примитивы без текстовых подписей на холсте - клиент рисует их сам (координаты до 0.1 px)"""
+        result = []
+        for item in self.items:
+            if item['type'] == 'text':
+                continue
+            item = dict(item)
+            if 'box' in item:
+                item['box'] = [round(v, 1) for v in item['box']]
+            if 'points' in item:
+                item['points'] = [[round(v, 1) for v in point] for point in item['points']]
+            result.append(item)
+        return result
+
+    def to_bytes(self):
+        """Все примитивы (с подписями, без округления) для хранения - обратно через from_bytes"""
+        return json.dumps(self.items, ensure_ascii=False).encode('utf-8')
+
+    @classmethod
+    def from_bytes(cls, data):
+        items = json.loads(data)
+        for item in items:
+            if isinstance(item.get('color'), list):
+                # Кортеж RGB подписи после JSON - список, ImageDraw его не примет
+                item['color'] = tuple(item['color'])
+        return cls(items)
+
+    def to_svg(self, width, height):
+        """Компактный SVG-слой поверх исходного изображения (тот же размер в px)"""
+        parts = [f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+                 f'viewBox="0 0 {width} {height}" fill="none">']
+        for item in self.to_json():
+            title = f"<title>{escape(item['message'])}</title>" if item.get('message') else ''
+            kind = f' class="{escape(item["kind"])}"' if item.get('kind') else ''
+            if item['type'] == 'rect':
+                x0, y0, x1, y1 = item['box']
+                parts.append(f'<rect{kind} x="{_num(x0)}" y="{_num(y0)}" width="{_num(x1 - x0)}" '
+                             f'height="{_num(y1 - y0)}" stroke="{item["color"]}" '
+                             f'stroke-width="{item["width"]}">{title}</rect>')
+            else:
+                (x0, y0), (x1, y1) = item['points']
+                parts.append(f'<line{kind} x1="{_num(x0)}" y1="{_num(y0)}" x2="{_num(x1)}" y2="{_num(y1)}" '
+                             f'stroke="{item["color"]}" stroke-width="{item["width"]}">{title}</line>')
+        parts.append('</svg>')
+        return ''.join(parts)
+
+    def rasterize(self, image):
+        """
+        Одна копия страницы + все примитивы.
+        image - RGB-массив (в том числе только для чтения) или PIL-изображение.
+        """
+        if isinstance(image, np.ndarray):
+            canvas = Image.fromarray(image)
+        else:
+            canvas = image.copy()
+        if self.items:
+            self.draw(ImageDraw.Draw(canvas))
+        return canvas
+
+
+def layer_output(image, layer, render):
+    """Совместимость: render=True - картинка с разметкой (как раньше), иначе сам слой"""
+    return layer.rasterize(image) if render else layer
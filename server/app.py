@@ -1,160 +1,1259 @@
-from flask import Flask, request, jsonify
-import io
+import time
+
+# Начало импорта сервиса: от него считается время до готовности
+APP_STARTED = time.perf_counter()
+
+from flask import Flask, Request, request, jsonify, Response, make_response, g, send_file
+import functools
+import json
+import os
+import queue
+import shutil
+import socket
+import tempfile
 import uuid
 from flask_cors import CORS
-from process_image import get_image_from_request, create_final_image_with_all_annotations
-from process_arrow_heads import process_arrow_heads
-from process_arrow_distances import process_arrow_distances
-from process_text import process_text
-from process_borders import process_borders
+from werkzeug.exceptions import RequestEntityTooLarge
+from PIL import Image
+from large_image import open_image, ImageTooLarge, LargeImage
+from detections import DEFAULT_IMGSZ
+from pipeline import run_pipeline, encode_png_base64, violation_counts, STAGES
+from inference_scheduler import InferenceScheduler
+from result_cache import ResultCache, file_fingerprint, rules_fingerprint, image_key, data_key
+from jobs import JobManager, QueueFullError, CANCELLED, DONE
+from job_store import JobStore
+from stage_graph import StageGraph, StageFailed, Cancelled
+from image_transport import ResultImageStore, encode_image, negotiate_format, clamp_quality, FORMATS
+from batch_sources import iter_sheets
+from incremental import IncrementalDetector, SessionVersions
 import base64
-from ultralytics import YOLO
+from inference_backends import load_backend, default_model_path, warmup
+from model_loader import ModelLoader
+from admission import AdmissionLimiter, Overloaded
+from shadow import ShadowEvaluator
+from memory_usage import ProcessRSSMonitor
+from result_store import ResultStore, ORIGINAL, IMAGE, OVERLAY, thumbnail_kind
+import config
+import metrics
+
+
+
+class SpooledRequest(Request):
+    """Файлы запроса до UPLOAD_SPOOL_BYTES - в памяти, больше - во временном файле на диске"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=config.UPLOAD_SPOOL_BYTES,
+                                             dir=config.LARGE_IMAGE_DIR or None)
 
-from generate_report import generate_word_report
 
 app = Flask(__name__)
+app.request_class = SpooledRequest
+app.config['MAX_CONTENT_LENGTH'] = config.MAX_UPLOAD_BYTES or None
 CORS(app)
 
-model = YOLO("best.pt")
-model2 = YOLO("best.pt")
+# Своя проверка размера - в open_image, защита PIL от "бомб" - по тому же пределу
+Image.MAX_IMAGE_PIXELS = config.MAX_IMAGE_PIXELS or None
+
+# Образец листа для прогрева (поставляется рядом с сервисом)
+WARMUP_SHEET = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'warmup_sheet.png')
+
+# Отпечаток весов для ключей кеша - считается вместе с загрузкой модели
+model_fingerprint = None
+
+
+def _load_model():
+    """Модель в выбранной среде выполнения (PyTorch, ONNX Runtime или OpenVINO)"""
+    global model_fingerprint
+    loaded = load_backend(
+        config.INFERENCE_BACKEND,
+        config.MODEL_PATH,
+        int8=config.INFERENCE_INT8,
+        intra_op_threads=config.INFERENCE_INTRA_OP_THREADS,
+        inter_op_threads=config.INFERENCE_INTER_OP_THREADS,
+        path=config.INFERENCE_BACKEND_PATH or None,
+    )
+    model_fingerprint = data_key(config.INFERENCE_BACKEND, file_fingerprint(loaded.weights_path))
+    return loaded
+
+
+# Веса загружаются один раз на процесс, в фоне (см. start_model); до этого - 503
+model = ModelLoader(
+    _load_model,
+    weights_path=config.INFERENCE_BACKEND_PATH or default_model_path(
+        config.INFERENCE_BACKEND, config.MODEL_PATH, config.INFERENCE_INT8),
+    started=APP_STARTED,
+)
+
+# Модель-кандидат для теневой проверки (только если задана)
+shadow_model = None
+if config.SHADOW_MODEL_PATH:
+    shadow_model = ModelLoader(lambda: load_backend(
+        config.SHADOW_BACKEND,
+        config.SHADOW_MODEL_PATH,
+        intra_op_threads=config.INFERENCE_INTRA_OP_THREADS,
+        inter_op_threads=config.INFERENCE_INTER_OP_THREADS,
+    ), weights_path=config.SHADOW_MODEL_PATH, started=APP_STARTED)
+
+# При preload веса загружаются в мастер-процессе до fork: воркеры делят их память
+if config.SERVER_PRELOAD:
+    model.load()
+    if shadow_model is not None:
+        shadow_model.load()
+
+warmup_ms = {}
+
+
+def _warmup_sheet():
+    """Образец листа как RGB-массив (None - прогрев на пустом листе)"""
+    try:
+        with open(config.INFERENCE_WARMUP_IMAGE or WARMUP_SHEET, 'rb') as f:
+            return open_image(f)
+    except Exception as e:
+        print(f"Образец для прогрева не прочитан: {str(e)}")
+        return None
+
+
+def warm_up_model():
+    """
+    Прогрев до готовности: прогоны модели на образце листа (и под размер плиток
+    и окон каскада, если они включены), затем одна полная проверка образца - первый запрос
+    не платит за ленивую инициализацию среды выполнения, OpenCV и пулов потоков.
+    """
+    sheet = _warmup_sheet()
+    warmup_ms[DEFAULT_IMGSZ] = warmup(model, config.INFERENCE_WARMUP_RUNS, image=sheet)
+    if config.TILED_INFERENCE:
+        warmup_ms[config.TILE_SIZE] = warmup(model, config.INFERENCE_WARMUP_RUNS, imgsz=config.TILE_SIZE,
+                                             image=sheet)
+    if config.CASCADE_INFERENCE:
+        warmup_ms[config.CASCADE_CROP_SIZE] = warmup(model, config.INFERENCE_WARMUP_RUNS,
+                                                     imgsz=config.CASCADE_CROP_SIZE, image=sheet)
+    if sheet is not None:
+        started = time.perf_counter()
+        run_pipeline(sheet, scheduler, graph=stage_graph)
+        warmup_ms['pipeline'] = [round((time.perf_counter() - started) * 1000.0, 1)]
+    print(f"Модель {config.INFERENCE_BACKEND}: {model.weights_path}, прогрев (мс): {warmup_ms}")
+
+
+def warm_up_shadow():
+    shadow_warmup = warmup(shadow_model, config.INFERENCE_WARMUP_RUNS, image=_warmup_sheet())
+    print(f"Кандидат {config.SHADOW_BACKEND}: {shadow_model.weights_path}, прогрев (мс): {shadow_warmup}")
+
+
+def start_model():
+    """
+    Загрузка (если еще не загружена) и прогрев модели в фоне; /readyz - 200 после прогрева.
+    Кандидат теневой проверки прогревается следом и на готовность не влияет.
+    При preload вызывается в каждом воркере после fork (см. gunicorn.conf.py).
+    """
+    on_ready = None
+    if shadow_model is not None:
+        def on_ready():
+            shadow_model.start(warmup=warm_up_shadow)
+    return model.start(warmup=warm_up_model, on_ready=on_ready)
+
+
+# Все запросы к модели идут через планировщик, который собирает их в батчи
+scheduler = InferenceScheduler(
+    model,
+    max_batch_size=config.INFERENCE_MAX_BATCH_SIZE,
+    max_wait_ms=config.INFERENCE_MAX_WAIT_MS,
+    on_batch=metrics.observe_batch,
+)
+
+# Теневая проверка кандидата: в своем потоке, при нехватке места образцы отбрасываются
+shadow = None
+if shadow_model is not None:
+    shadow = ShadowEvaluator(
+        shadow_model,
+        sample_rate=config.SHADOW_SAMPLE_RATE,
+        max_pending=config.SHADOW_MAX_PENDING,
+        iou_threshold=config.SHADOW_IOU,
+        on_sample=metrics.observe_shadow,
+    )
+
+# Кеш результатов: ключ зависит от пикселей, весов модели и констант правил
+result_cache = ResultCache(
+    max_bytes=config.RESULT_CACHE_MAX_BYTES,
+    disk_dir=config.RESULT_CACHE_DIR or None,
+    disk_max_bytes=config.RESULT_CACHE_DISK_MAX_BYTES,
+)
+rules_key = rules_fingerprint()
+
+# Задачи /jobs видны всем воркерам: опрос, поток событий и отмена могут прийти в любой
+job_store = JobStore(config.RESULT_STORE_DIR, max_finished=config.JOB_MAX_FINISHED) if config.JOB_STORE else None
+
+# Пул фоновых проверок, общий для /jobs и синхронного /upload
+jobs = JobManager(
+    max_workers=config.JOB_WORKERS,
+    max_pending=config.JOB_MAX_PENDING,
+    max_finished=config.JOB_MAX_FINISHED,
+    store=job_store,
+    cancel_poll_s=config.DISCONNECT_POLL_S,
+)
+
+# Пул этапов проверки: поиск рамки и детекция одного чертежа идут параллельно
+stage_graph = StageGraph(max_workers=config.PIPELINE_STAGE_WORKERS)
+
+# Аннотированные изображения для бинарной отдачи (/results/<id>/image)
+result_images = ResultImageStore(max_bytes=config.RESULT_IMAGES_MAX_BYTES)
+
+# Результаты проверок и история по session_id: общие для всех воркеров, переживают перезапуск
+result_store = None
+if config.RESULT_STORE:
+    result_store = ResultStore(
+        config.RESULT_STORE_DIR,
+        max_bytes=config.RESULT_STORE_MAX_BYTES,
+        max_age_s=config.RESULT_STORE_MAX_AGE_DAYS * 24 * 60 * 60,
+        thumbnail_sizes=config.RESULT_STORE_THUMBNAIL_SIZES,
+        thumbnail_format=config.RESULT_STORE_THUMBNAIL_FORMAT,
+        image_format=config.RESULT_STORE_IMAGE_FORMAT,
+        max_pending=config.RESULT_STORE_MAX_PENDING,
+    )
+
+# Пик RSS процесса за время запроса: один поток опроса на процесс
+rss_monitor = None
+if config.RSS_SAMPLE_INTERVAL_MS > 0:
+    rss_monitor = ProcessRSSMonitor(config.RSS_SAMPLE_INTERVAL_MS / 1000.0)
+
+# Последние версии листов по session_id для инкрементальной перепроверки
+session_versions = SessionVersions(max_bytes=config.INCREMENTAL_SESSIONS_MAX_BYTES)
+
+# Ограничение одновременных тяжелых запросов (на процесс / воркер)
+admission = AdmissionLimiter(
+    max_concurrent=config.SERVER_MAX_CONCURRENT,
+    max_queue=config.SERVER_MAX_QUEUE,
+    queue_timeout=config.SERVER_QUEUE_TIMEOUT_S,
+)
+
+
+# Состояние очередей и кешей - в момент выдачи /metrics
+metrics.Gauge('gostguard_jobs', 'Задачи /jobs и /upload по статусу', jobs.stats, ('status',))
+metrics.Gauge('gostguard_inference_queue_depth', 'Изображений в очереди планировщика',
+              lambda: scheduler.stats()['queue_depth'])
+metrics.Gauge('gostguard_admission_active', 'Выполняемых тяжелых запросов', lambda: admission.stats()['active'])
+metrics.Gauge('gostguard_admission_waiting', 'Тяжелых запросов в очереди', lambda: admission.stats()['waiting'])
+metrics.Gauge('gostguard_result_cache_bytes', 'Объем кеша результатов в памяти', lambda: result_cache.stats()['bytes'])
+if result_store is not None:
+    metrics.Gauge('gostguard_result_store_bytes', 'Объем блобов в хранилище результатов',
+                  lambda: result_store.stats()['bytes'])
+metrics.Gauge('gostguard_model_ready', 'Модель загружена и прогрета (1) или нет (0)', lambda: int(model.ready))
+metrics.Gauge('gostguard_startup_seconds', 'Время запуска по фазам: импорт, загрузка, прогрев, до готовности',
+              lambda: {phase: ms / 1000.0 for phase, ms in startup_ms().items()}, ('phase',))
+
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _count_request(response):
+    # Метка - шаблон маршрута, а не путь: id в пути не раздувают число рядов
+    endpoint = request.url_rule.rule if request.url_rule else 'unknown'
+    metrics.REQUESTS.labels(endpoint, request.method, response.status_code).inc()
+    started = g.get('request_started')
+    if started is not None:
+        metrics.REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+    return response
+
+
+@app.errorhandler(413)
+def _too_large(error):
+    limit = request.max_content_length
+    return jsonify({'error': f'Слишком большой запрос (допускается не больше {limit / 2 ** 20:.1f} МБ)'}), 413
+
+
+def _open_image(file):
+    """Декодирование загрузки с пределами по пикселям (крупные сканы - с ограниченной памятью)"""
+    return open_image(
+        file,
+        max_pixels=config.MAX_IMAGE_PIXELS,
+        large_pixels=config.LARGE_IMAGE_PIXELS,
+        work_max_side=config.LARGE_IMAGE_WORK_SIDE,
+        tmp_dir=config.LARGE_IMAGE_DIR or None,
+    )
+
+
+def _client_disconnected():
+    """
+    Клиент закрыл соединение, не дождавшись ответа: сокет без чтения
+    (MSG_PEEK) сообщает о конце потока. Если сервер не дает сокет - False.
+    """
+    sock = request.environ.get('gunicorn.socket') or request.environ.get('werkzeug.socket')
+    if sock is None:
+        return False
+    try:
+        return sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT) == b''
+    except BlockingIOError:
+        return False
+    except OSError:
+        return True
+
+
+def _overloaded(message):
+    return jsonify({'error': message}), 503, {'Retry-After': str(config.SERVER_RETRY_AFTER_S)}
+
+
+def needs_model(view):
+    """Эндпоинт с проверкой чертежа: пока модель не загружена и не прогрета - 503 с Retry-After"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not model.ready:
+            if model.error is not None:
+                return jsonify({'error': f"Модель не загружена: {model.error}"}), 503
+            return _overloaded("Модель загружается, повторите запрос позже")
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def admitted(view):
+    """
+    Тяжелый эндпоинт: не больше SERVER_MAX_CONCURRENT одновременно,
+    сверх очереди - сразу 503 с Retry-After.
+    Место освобождается, когда ответ отдан целиком (в том числе потоковый).
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            admission.acquire()
+        except Overloaded as e:
+            return _overloaded(str(e))
+        try:
+            response = make_response(view(*args, **kwargs))
+        except BaseException:
+            admission.release()
+            raise
+        response.call_on_close(admission.release)
+        return response
+
+    return wrapper
+
+
+def begin_drain():
+    """
+    Начало остановки, не ждет: /readyz отвечает 503, новые проверки и задачи
+    получают 503, принятые дорабатывают. Вызывается по сигналу остановки воркера,
+    пока он еще обслуживает запросы (см. gunicorn.conf.py).
+    """
+    admission.close()
+    jobs.close()
+
+
+def shutdown(timeout=None):
+    """
+    Плавная остановка: новые запросы получают 503, принятые запросы
+    и фоновые задачи дорабатывают (не дольше timeout на каждый этап).
+    """
+    begin_drain()
+    drained = admission.drain(timeout)
+    drained = jobs.shutdown(timeout) and drained
+    scheduler.close()
+    if shadow is not None:
+        shadow.close()
+    if result_store is not None:
+        # Проверки из очереди записи попадают в историю
+        drained = result_store.close(timeout) and drained
+    return drained
+
+
+def _tiling_options():
+    """Параметры нарезанного инференса: по конфигу или по полю формы tiled=1/0"""
+    tiled = request.form.get('tiled')
+    enabled = config.TILED_INFERENCE if tiled is None else tiled.lower() in ('1', 'true', 'yes')
+    if not enabled:
+        return None
+    return {
+        'tile_size': config.TILE_SIZE,
+        'overlap': config.TILE_OVERLAP,
+        'merge': config.TILE_MERGE,
+    }
+
+
+def _cascade_options(tiling):
+    """
+    Каскадная перепроверка пограничных детекций: по конфигу или по полю формы cascade=1/0.
+    При нарезанном инференсе не нужна - он и так идет в родном разрешении.
+    """
+    cascade = request.form.get('cascade')
+    enabled = config.CASCADE_INFERENCE if cascade is None else cascade.lower() in ('1', 'true', 'yes')
+    if not enabled or tiling:
+        return None
+    return {
+        'margin_mm': config.CASCADE_MARGIN_MM,
+        'crop_size': config.CASCADE_CROP_SIZE,
+        'match_iou': config.CASCADE_MATCH_IOU,
+    }
+
+
+def _transport_mode():
+    """
+    base64 - картинка внутри JSON (как раньше), binary - только result_id и ссылки,
+    overlay - без картинки, только векторная разметка нарушений (overlay_svg=1 - еще и SVG)
+    """
+    transport = request.form.get('transport', config.TRANSPORT_MODE).lower()
+    if transport == 'overlay' and request.form.get('overlay_svg', '').lower() in ('1', 'true', 'yes'):
+        return 'overlay+svg'
+    return transport if transport in ('base64', 'binary', 'overlay') else 'base64'
+
+
+def _incremental_enabled():
+    """Перепроверка по изменениям: только для явно переданной сессии, поле incremental=1/0"""
+    if 'session_id' not in request.form:
+        return False
+    incremental = request.form.get('incremental')
+    return config.INCREMENTAL_CHECK if incremental is None else incremental.lower() in ('1', 'true', 'yes')
+
+
+def _check_drawing(job, image_np, session_id, tiling=None, transport='base64', timings=None,
+                   incremental=False, shadowed=False, cascade=None, filename=None, original=None):
+    """
+    Задача проверки чертежа: результат из кеша или полный прогон с отчетом по этапам.
+    filename и original (загрузка, скопированная в хранилище) - для истории результатов.
+    """
+    timings = timings or metrics.StageTimings()
+    # Пока задача стояла в очереди, RSS не опрашивался
+    timings.resume()
+    log = {'session_id': session_id, 'job_id': job.id, 'transport': transport, 'tiled': bool(tiling),
+           'cascade': bool(cascade), 'width': image_np.shape[1], 'height': image_np.shape[0]}
+    if isinstance(image_np, LargeImage):
+        log['large_image_factor'] = image_np.factor
+    try:
+        payload, cache_hit, image = _run_check(job, image_np, tiling, transport, timings,
+                                               session_id if incremental else None, shadowed, cascade)
+    except Cancelled:
+        # Клиент ушел или задачу отменили: оставшиеся этапы не запускались
+        metrics.CHECK_ERRORS.labels('cancelled').inc()
+        ResultStore.discard(original)
+        memory = timings.close()
+        if config.REQUEST_LOG:
+            metrics.log_request('check', status='cancelled', stages_ms=timings.as_ms(),
+                                total_ms=timings.total_ms(), **memory, **log)
+        raise
+    except Exception as e:
+        # Этапы идут параллельно, поэтому упавший этап берется из ошибки графа
+        failed_stage = e.stage if isinstance(e, StageFailed) else timings.current
+        metrics.CHECK_ERRORS.labels(failed_stage or 'unknown').inc()
+        ResultStore.discard(original)
+        memory = timings.close()
+        if config.REQUEST_LOG:
+            metrics.log_request('check', status='error', error=str(e), failed_stage=failed_stage,
+                                stages_ms=timings.as_ms(), total_ms=timings.total_ms(), **memory, **log)
+        raise
+
+    metrics.CACHE_HITS.labels('hit' if cache_hit else 'miss').inc()
+    if result_store is not None:
+        # Картинки кодируются и пишутся в фоне, ответ их не ждет
+        try:
+            with timings.stage('store'):
+                stored = result_store.submit(payload['result_id'], session_id, payload['text'],
+                                             payload['full_report'], violation_counts(payload['full_report']),
+                                             image=image, pixels=image_np, original=original, filename=filename)
+            # Очередь записи полна - результат не сохранен, ссылки на него нет
+            if stored:
+                payload = dict(payload, result_url=f"/results/{payload['result_id']}")
+        except Exception as e:
+            # Проверка уже готова - без записи в историю клиент все равно получает результат
+            print(f"Ошибка сохранения результата: {str(e)}")
+            ResultStore.discard(original)
+    memory = timings.close()
+    if config.REQUEST_LOG:
+        summary = payload['full_report']['summary']
+        metrics.log_request('check', status='ok', result_id=payload['result_id'], cache_hit=cache_hit,
+                            violations=summary['total_violations'], stages_ms=timings.as_ms(),
+                            total_ms=timings.total_ms(), **memory, **log)
+    return dict(payload, session_id=session_id)
+
+
+def _run_check(job, image_np, tiling, transport, timings, session_id=None, shadowed=False, cascade=None):
+    """
+    Возвращает (payload, взят ли результат из кеша, аннотированное изображение или слой разметки).
+    session_id - перепроверить относительно предыдущей версии листа в этой сессии.
+    shadowed - проверка может попасть в выборку теневой проверки кандидата.
+    cascade - параметры каскадной перепроверки пограничных детекций (None - без нее).
+    """
+    # id результата адресуется по содержимому: тот же чертеж → тот же id
+    key_parts = [model_fingerprint, rules_key, json.dumps(tiling, sort_keys=True)]
+    if cascade:
+        key_parts.append(json.dumps(cascade, sort_keys=True))
+    pixels = image_np
+    if isinstance(image_np, LargeImage):
+        # Результат крупного скана зависит и от рабочего уменьшения
+        pixels = image_np.full
+        key_parts.append(f"large:{image_np.factor}")
+        # Версия листа хранила бы серую копию полного разрешения - проверяем целиком
+        session_id = None
+    content_key = image_key(pixels, *key_parts)
+    result_id = content_key
+
+    detector = None
+    if session_id is not None:
+        previous = session_versions.get(session_id)
+        if previous is not None and previous.content_key == content_key:
+            # Тот же лист еще раз - тот же результат
+            result_id, previous = previous.result_id, None
+        elif previous is not None:
+            # Детекции зависят от предыдущей версии, поэтому и id результата тоже
+            result_id = data_key(content_key, 'incremental', previous.result_id)
+        detector = IncrementalDetector(
+            scheduler, previous, tiling=tiling,
+            cell_size=config.INCREMENTAL_CELL_SIZE,
+            pixel_threshold=config.INCREMENTAL_PIXEL_THRESHOLD,
+            context_px=config.INCREMENTAL_CONTEXT_PX,
+            max_changed=config.INCREMENTAL_MAX_CHANGED,
+            max_regions=config.INCREMENTAL_MAX_REGIONS,
+        )
+
+    # Повторная загрузка того же чертежа отдается из кеша
+    cache_key = f"upload:{transport}:{result_id}"
+    payload = result_cache.get_json(cache_key)
+
+    # В binary-режиме картинка должна быть еще в памяти или в хранилище результатов
+    if payload is not None and transport == 'binary' and result_id not in result_images \
+            and not (result_store is not None and result_store.has_blob(result_id, IMAGE)):
+        payload = None
+
+    if payload is not None:
+        for stage, section in STAGES:
+            job.report_stage(stage, payload['full_report'][section] if section else {})
+        return payload, True, result_images.get(result_id)
+
+    def on_detections(detections, detection_report):
+        # Время основной модели сравнимо с кандидатом, только если лист детектировался целиком
+        stages = timings.as_ms()
+        primary_ms = stages.get('detection', 0.0) + stages.get('cascade', 0.0) \
+            if detection_report['mode'] != 'incremental' else None
+        shadow.submit(image_np, detections, tiling=tiling, cascade=cascade, primary_ms=primary_ms)
+
+    overlay = transport.startswith('overlay')
+    final_image, combined_text, full_report = run_pipeline(
+        image_np, scheduler, on_stage=job.report_stage, tiling=tiling, timings=timings, detect_fn=detector,
+        render=not overlay, graph=stage_graph, cancel=job.cancel_event, timeouts=config.STAGE_TIMEOUTS,
+        on_detections=on_detections if shadowed and shadow is not None else None, cascade=cascade)
+    if detector is not None:
+        session_versions.put(session_id, detector.version(result_id, content_key))
+    payload = {
+        'success': True,
+        'result_id': result_id,
+        'text': combined_text,
+        'full_report': full_report
+    }
+    if overlay:
+        # Клиент рисует разметку поверх своего изображения: страница не растеризуется и не кодируется
+        height, width = image_np.shape[:2]
+        payload['overlay'] = {'width': width, 'height': height, 'items': final_image.to_json()}
+        if transport == 'overlay+svg':
+            payload['overlay_svg'] = final_image.to_svg(width, height)
+        result_cache.put_json(cache_key, payload)
+        return payload, False, final_image
+
+    with timings.stage('encode'):
+        # Картинка остается на сервере: для бинарной отдачи и отчетов по result_id
+        result_images.put(result_id, final_image)
+        if transport == 'binary':
+            # Картинку клиент заберет отдельным запросом в нужном формате
+            payload['image_url'] = f'/results/{result_id}/image'
+            payload['preview_url'] = f'/results/{result_id}/preview'
+        else:
+            payload['image_base64'] = encode_png_base64(final_image)
+    result_cache.put_json(cache_key, payload)
+    return payload, False, final_image
+
+
+def _submit_check(shared=False):
+    """
+    Общая часть /upload и /jobs: разбор запроса и постановка задачи.
+    shared - задачу будут опрашивать по id (/jobs), возможно через другой воркер.
+    """
+    try:
+        files = request.files
+    except RequestEntityTooLarge as e:
+        return None, _too_large(e)
+    if 'file' not in files:
+        return None, (jsonify({'error': 'No file part'}), 400)
+
+    file = files['file']
+    session_id = request.form.get('session_id', str(uuid.uuid4()))
+
+    if file.filename == '':
+        return None, (jsonify({'error': 'No selected file'}), 400)
+
+    # Декодируем изображение один раз, дальше все этапы работают с этим массивом
+    timings = metrics.StageTimings(rss_monitor=rss_monitor)
+    try:
+        with timings.stage('decode'):
+            image_np = _open_image(file)
+    except ImageTooLarge as e:
+        timings.close()
+        return None, (jsonify({'error': str(e)}), 413)
+    except Exception:
+        timings.close()
+        raise
+    metrics.observe_image(image_np)
+
+    # Исходный файл - в хранилище результатов, пока поток запроса открыт (/jobs отвечает сразу)
+    original = None
+    if result_store is not None:
+        with timings.stage('store'):
+            file.stream.seek(0)
+            original = result_store.stage(file.stream)
+
+    # Опрос RSS продолжится, когда задача начнет выполняться (ее могут отменить прямо в очереди)
+    timings.suspend()
+    tiling = _tiling_options()
+    try:
+        submit = jobs.submit_shared if shared else jobs.submit
+        job = submit(_check_drawing, image_np, session_id,
+                     tiling=tiling, transport=_transport_mode(), timings=timings,
+                     incremental=_incremental_enabled(), shadowed=True, cascade=_cascade_options(tiling),
+                     filename=file.filename, original=original)
+    except QueueFullError as e:
+        ResultStore.discard(original)
+        timings.close()
+        return None, _overloaded(str(e))
+    # Задачу, отмененную до запуска, _check_drawing не закроет
+    job.add_done_callback(lambda j: timings.close())
+    if original is not None:
+        # ...и загрузку из staging не заберет: без результата она больше не нужна
+        job.add_done_callback(lambda j: ResultStore.discard(original) if j.status != DONE else None)
+    return job, None
+
 
 @app.route('/upload', methods=['POST'])
+@needs_model
+@admitted
 def upload_image():
+    try:
+        job, error_response = _submit_check()
+        if error_response is not None:
+            return error_response
+
+        # Синхронный режим - ждем ту же задачу, что и /jobs.
+        # Если клиент не дождался ответа, проверка отменяется
+        while not job.wait(config.DISCONNECT_POLL_S):
+            if _client_disconnected():
+                job.cancel()
+                return jsonify({'error': 'Клиент отключился'}), 499
+        if job.status == CANCELLED:
+            return jsonify({'error': job.error}), 409
+        if job.error is not None:
+            return jsonify({'error': job.error}), 500
+        return jsonify(job.result)
+
+    except Exception as e:
+        print(f"Ошибка в /upload: {str(e)}")
+        import traceback
+        print(f"Трассировка: {traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/upload_batch', methods=['POST'])
+@needs_model
+@admitted
+def upload_batch():
+    """
+    Проверка набора листов (ZIP, многостраничный TIFF, PDF).
+    Ответ - поток NDJSON: строка на каждый лист по мере готовности
+    (result - то же, что вернул бы /upload), в конце сводка по набору.
+    """
+    # Наборы листов больше одиночной загрузки - свой предел на тело запроса
+    request.max_content_length = config.MAX_BATCH_UPLOAD_BYTES or None
     if 'file' not in request.files:
         return jsonify({'error': 'No file part'}), 400
 
     file = request.files['file']
-    session_id = request.form.get('session_id', str(uuid.uuid4()))
-
     if file.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
+    session_id = request.form.get('session_id', str(uuid.uuid4()))
+    tiling = _tiling_options()
+    cascade = _cascade_options(tiling)
+    transport = _transport_mode()
+
+    # Ответ живет дольше запроса, поэтому набор переносится во временный файл
+    # (копирование потоковое, целиком в память набор не читается)
+    spool = tempfile.NamedTemporaryFile()
+    shutil.copyfileobj(file.stream, spool)
+    spool.flush()
+    spool.seek(0)
+
     try:
-        # Читаем изображение один раз
-        original_image, image_np, file_stream = get_image_from_request(file)
-
-        # 1. ПРОВЕРКА РАМКИ
-        processed_image, frame_text = process_borders(original_image)
-
-        # 2. ПРОВЕРКА НАКОНЕЧНИКОВ СТРЕЛОК
-        arrow_heads_violations, arrow_heads_stats, arrow_heads_text, _ = process_arrow_heads(image_np, model)
-
-        # 3. ПРОВЕРКА РАССТОЯНИЙ
-        arrow_distances_violations, arrow_distances_stats, arrow_distances_text, _ = process_arrow_distances(image_np,
-                                                                                                             model)
-
-        # 4. ПРОВЕРКА ТЕКСТА
-        text_violations, text_warnings, text_stats, text_text, _ = process_text(image_np, model)
-
-        # финальное изображение все со всем
-        final_image = create_final_image_with_all_annotations(
-            original_image=original_image,
-            processed_image=processed_image,
-            arrow_heads_violations_data=arrow_heads_violations,
-            arrow_distances_violations_data=arrow_distances_violations,
-            text_violations_data=text_violations,
-            model=model
-        )
+        sheets = iter_sheets(spool, pdf_dpi=config.BATCH_PDF_DPI, decode=_open_image,
+                             max_pixels=config.MAX_IMAGE_PIXELS)
+    except ValueError as e:
+        spool.close()
+        return jsonify({'error': str(e)}), 400
+
+    submitted = []
+
+    def stream():
+        try:
+            yield from _stream_batch(sheets, session_id, tiling, transport, submitted, cascade)
+        finally:
+            # Клиент отключился посреди набора - незавершенные листы не проверяем
+            for job in submitted:
+                job.cancel()
+            spool.close()
 
-        # ОБЪЕДИНЯЕМ ВСЕ РЕЗУЛЬТАТЫ
-        all_violations = (arrow_heads_violations + arrow_distances_violations + text_violations)
+    return Response(stream(), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-        # Формируем общий текст результата
-        combined_text = f"""📐 ПРОВЕРКА РАМКИ:
-{frame_text}
 
-🎯 ПРОВЕРКА НАКОНЕЧНИКОВ СТРЕЛОК (ГОСТ 2.307-68):
-{arrow_heads_text}
+def _stream_batch(sheets, session_id, tiling, transport, submitted=None, cascade=None):
+    """
+    Строки NDJSON для /upload_batch: лист за листом, в конце сводка.
+    submitted - список, куда добавляются поставленные задачи (чтобы их можно было отменить)
+    """
+    submitted = submitted if submitted is not None else []
+    finished = queue.Queue()
+    in_flight = 0
+    total = 0
+    failed = 0
+    violations = {}
+    exhausted = False
 
-📏 ПРОВЕРКА РАССТОЯНИЙ (ГОСТ 2.307-68):
-{arrow_distances_text}
+    def sheet_line(index, name, result=None, error=None):
+        line = {'type': 'sheet', 'index': index, 'name': name}
+        if error is not None:
+            line['error'] = error
+        else:
+            line['result'] = result
+        return json.dumps(line, ensure_ascii=False) + '\n'
 
-📝 ПРОВЕРКА ТЕКСТА (ГОСТ 2.304-81):
-{text_text}"""
+    while not exhausted or in_flight:
+        # Листы читаются только по мере освобождения места,
+        # в памяти не больше BATCH_MAX_IN_FLIGHT страниц
+        while not exhausted and in_flight < config.BATCH_MAX_IN_FLIGHT:
+            try:
+                name, image_np, error = next(sheets)
+            except StopIteration:
+                exhausted = True
+                break
+            except Exception as e:
+                print(f"Ошибка чтения набора: {str(e)}")
+                yield json.dumps({'type': 'error', 'error': str(e)}, ensure_ascii=False) + '\n'
+                exhausted = True
+                break
 
-        # Конвертируем финальное изображение
-        buffered = io.BytesIO()
-        final_image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode('utf-8')
+            index = total
+            total += 1
+            if error is not None:
+                failed += 1
+                yield sheet_line(index, name, error=error)
+                continue
+
+            metrics.observe_image(image_np)
+            timings = metrics.StageTimings(rss_monitor=rss_monitor, suspended=True)
+            try:
+                # Очередь общая с /upload: ждем места не дольше, чем запрос в очереди допуска
+                job = jobs.submit_wait(config.SERVER_QUEUE_TIMEOUT_S, _check_drawing, image_np, session_id,
+                                       tiling=tiling, transport=transport, timings=timings, cascade=cascade,
+                                       filename=name)
+            except QueueFullError as e:
+                timings.close()
+                failed += 1
+                # Строка листа заодно проверяет, что клиент еще на связи
+                yield sheet_line(index, name, error=str(e))
+                continue
+            submitted.append(job)
+            job.add_done_callback(lambda j, t=timings: t.close())
+            job.add_done_callback(lambda j, i=index, n=name: finished.put((i, n, j)))
+            in_flight += 1
+
+        if not in_flight:
+            continue
+
+        # Результаты отдаются в порядке готовности, а не в порядке листов
+        index, name, job = finished.get()
+        in_flight -= 1
+        if job.error is not None:
+            failed += 1
+            yield sheet_line(index, name, error=job.error)
+            continue
+        for check, count in violation_counts(job.result['full_report']).items():
+            violations[check] = violations.get(check, 0) + count
+        yield sheet_line(index, name, result=job.result)
+
+    yield json.dumps({
+        'type': 'summary',
+        'session_id': session_id,
+        'sheets': total,
+        'failed': failed,
+        'violations': violations,
+        'total_violations': sum(violations.values()),
+    }, ensure_ascii=False) + '\n'
+
+
+@app.route('/jobs', methods=['POST'])
+@needs_model
+@admitted
+def create_job():
+    try:
+        job, error_response = _submit_check(shared=True)
+        if error_response is not None:
+            return error_response
 
         return jsonify({
-            'success': True,
-            'image_base64': img_str,
-            'text': combined_text,
-            'session_id': session_id,
-            'full_report': {
-                'frame_check': {
-                    'result': frame_text,
-                },
-                'arrow_heads_check': {
-                    'result': arrow_heads_text,
-                    'violations': arrow_heads_violations,
-                    'statistics': arrow_heads_stats,
-                    'gost_standard': 'ГОСТ 2.307-68'
-                },
-                'arrow_distances_check': {
-                    'result': arrow_distances_text,
-                    'violations': arrow_distances_violations,
-                    'statistics': arrow_distances_stats,
-                    'gost_standard': 'ГОСТ 2.307-68'
-                },
-                'text_check': {
-                    'result': text_text,
-                    'violations': text_violations,
-                    'warnings': text_warnings,
-                    'statistics': text_stats,
-                    'gost_standard': 'ГОСТ 2.304-81'
-                },
-                'summary': {
-                    'total_violations': len(all_violations),
-                    'has_violations': len(all_violations) > 0
-                }
-            }
-        })
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': f'/jobs/{job.id}',
+            'events_url': f'/jobs/{job.id}/events'
+        }), 202
 
     except Exception as e:
-        print(f"Ошибка в /upload: {str(e)}")
-        import traceback
-        print(f"Трассировка: {traceback.format_exc()}")
+        print(f"Ошибка в /jobs: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = jobs.get(job_id)
+    if job is not None:
+        return jsonify(job.to_dict())
+    # Задачу принял другой воркер
+    data = job_store.get(job_id) if job_store is not None else None
+    if data is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(data)
+
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """Отмена задачи: не начатые этапы не запускаются"""
+    job = jobs.get(job_id)
+    if job is not None:
+        job.cancel()
+        return jsonify({'job_id': job.id, 'status': job.status, 'cancel_requested': True}), 202
+    # Задача другого воркера: он увидит флаг отмены при следующем опросе
+    status = job_store.request_cancel(job_id) if job_store is not None else None
+    if status is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify({'job_id': job_id, 'status': status, 'cancel_requested': True}), 202
+
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Поток событий (Server-Sent Events): статус и результат каждого этапа"""
+    job = jobs.get(job_id)
+    if job is not None:
+        iter_events = job.iter_events
+    elif job_store is not None and job_store.get(job_id) is not None:
+        # Задачу выполняет другой воркер - события из общей базы
+        iter_events = functools.partial(job_store.iter_events, job_id)
+    else:
+        return jsonify({'error': 'Job not found'}), 404
+
+    # Клиент может продолжить поток после переподключения
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    if last_event_id is None:
+        last_event_id = request.args.get('from', -1, type=int)
+    start = last_event_id + 1
+
+    def stream():
+        for item in iter_events(start=start):
+            if item is None:
+                yield ': keep-alive\n\n'
+                continue
+            index, (event, data) = item
+            yield f"id: {index}\nevent: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def _render_stored_overlay(result_id):
+    """Overlay-результат хранится слоем: картинка рисуется поверх сохраненного исходника"""
+    layer = result_store.layer(result_id)
+    found = result_store.blob(result_id, ORIGINAL) if layer is not None else None
+    if found is None:
+        return None
+    try:
+        with open(found[0], 'rb') as f:
+            page = _open_image(f)
+    except (OSError, ImageTooLarge):
+        return None
+    with metrics.STAGE_SECONDS.labels('final_image').time():
+        if isinstance(page, LargeImage):
+            # Как в конвейере: разметка в разрешении рабочей копии
+            return layer.scaled(1.0 / page.factor).rasterize(page.preview)
+        return layer.rasterize(page)
+
+
+def _result_image(result_id):
+    """Аннотированное изображение: из памяти воркера, иначе из хранилища результатов"""
+    image = result_images.get(result_id)
+    if image is None and result_store is not None:
+        image = result_store.image(result_id)
+        if image is None:
+            image = _render_stored_overlay(result_id)
+        if image is not None:
+            result_images.put(result_id, image)
+    return image
+
+
+def _result_exists(result_id):
+    """Есть ли картинка результата (без декодирования): 304 отдается только для существующих"""
+    if result_id in result_images:
+        return True
+    if result_store is None:
+        return False
+    if result_store.blob(result_id, IMAGE) is not None:
+        return True
+    return result_store.has_blob(result_id, OVERLAY) and result_store.has_blob(result_id, ORIGINAL)
+
+
+def _send_result_image(result_id, max_side=None):
+    """Отдает картинку результата сырыми байтами с HTTP-кешированием"""
+    fmt = negotiate_format(request.args.get('format'), request.headers.get('Accept'),
+                           default=config.TRANSPORT_DEFAULT_FORMAT)
+    # Одно качество - один вариант в кеше и один ETag, сколько бы значений вне пределов ни присылали
+    quality = clamp_quality(fmt, request.args.get('quality', type=int))
+
+    # Результат адресуется по содержимому, поэтому ETag не меняется
+    etag = data_key('image', result_id, fmt, quality, max_side)
+    if request.if_none_match.contains(etag):
+        if not _result_exists(result_id):
+            return jsonify({'error': 'Result not found'}), 404
+        response = Response(status=304)
+    else:
+        variant_key = f"variant:{etag}"
+        image_bytes = result_cache.get(variant_key)
+        if image_bytes is None:
+            image = _result_image(result_id)
+            if image is None:
+                return jsonify({'error': 'Result not found'}), 404
+            with metrics.STAGE_SECONDS.labels('image_encode').time():
+                image_bytes, _ = encode_image(image, fmt, quality=quality, max_side=max_side)
+            result_cache.put(variant_key, image_bytes)
+        response = Response(image_bytes, mimetype=FORMATS[fmt][1])
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'private, max-age={config.TRANSPORT_CACHE_MAX_AGE}, immutable'
+    response.headers['Vary'] = 'Accept'
+    return response
+
+
+@app.route('/results/<result_id>/image', methods=['GET'])
+def result_image(result_id):
+    return _send_result_image(result_id)
+
+
+@app.route('/results/<result_id>/preview', methods=['GET'])
+def result_preview(result_id):
+    max_side = request.args.get('size', config.PREVIEW_MAX_SIDE, type=int)
+    if max_side <= 0:
+        return jsonify({'error': 'size must be a positive integer'}), 400
+    # Больше PREVIEW_MAX_SIDE превью не бывает: иначе каждый размер - свое перекодирование и запись в кеше
+    return _send_result_image(result_id, max_side=min(max_side, config.PREVIEW_MAX_SIDE))
+
+
+def _send_stored_blob(result_id, kind):
+    """Блоб из хранилища результатов как есть: байты не перекодируются"""
+    found = result_store.blob(result_id, kind) if result_store is not None else None
+    if found is None:
+        return jsonify({'error': 'Result not found'}), 404
+    path, mimetype, digest = found
+    try:
+        # Блоб адресуется по содержимому, поэтому ETag - его хеш
+        response = send_file(path, mimetype=mimetype, etag=digest, conditional=True,
+                             max_age=config.TRANSPORT_CACHE_MAX_AGE)
+    except FileNotFoundError:
+        # Успели вытеснить
+        return jsonify({'error': 'Result not found'}), 404
+    response.headers['Cache-Control'] = f'private, max-age={config.TRANSPORT_CACHE_MAX_AGE}, immutable'
+    return response
+
+
+def _stored_urls(result_id, kinds):
+    """
+    Ссылки на картинки сохраненного результата (миниатюры - от меньшей к большей).
+    Overlay-результат с исходником отдает те же ссылки: картинки рисуются при первом запросе.
+    """
+    urls = {}
+    rendered = OVERLAY in kinds and ORIGINAL in kinds
+    if IMAGE in kinds or rendered:
+        urls['image_url'] = f'/results/{result_id}/image'
+        urls['preview_url'] = f'/results/{result_id}/preview'
+    if ORIGINAL in kinds:
+        urls['original_url'] = f'/results/{result_id}/original'
+    if OVERLAY in kinds:
+        urls['overlay_url'] = f'/results/{result_id}/overlay'
+    thumbnails = {size: f'/results/{result_id}/thumbnail?size={size}'
+                  for size in sorted(config.RESULT_STORE_THUMBNAIL_SIZES)
+                  if thumbnail_kind(size) in kinds or rendered}
+    if thumbnails:
+        urls['thumbnail_url'] = next(iter(thumbnails.values()))
+        urls['thumbnail_urls'] = {str(size): url for size, url in thumbnails.items()}
+    return urls
+
+
+@app.route('/results/<result_id>', methods=['GET'])
+def get_result(result_id):
+    """Сохраненный результат: отчет и текст проверки, ссылки на картинки (без base64)"""
+    stored = result_store.get(result_id) if result_store is not None else None
+    if stored is None:
+        return jsonify({'error': 'Result not found'}), 404
+    blobs = stored.pop('blobs')
+    return jsonify(dict(stored, **_stored_urls(result_id, blobs)))
+
+
+@app.route('/results/<result_id>/thumbnail', methods=['GET'])
+def result_thumbnail(result_id):
+    """
+    Миниатюра (?size= - одна из RESULT_STORE_THUMBNAIL_SIZES, по умолчанию меньшая): заранее посчитанная,
+    а у overlay-результатов - уменьшенная картинка, нарисованная при первом запросе.
+    """
+    size = request.args.get('size', min(config.RESULT_STORE_THUMBNAIL_SIZES, default=0), type=int)
+    if result_store is not None and size in config.RESULT_STORE_THUMBNAIL_SIZES \
+            and result_store.blob(result_id, thumbnail_kind(size)) is None \
+            and result_store.has_blob(result_id, OVERLAY):
+        return _send_result_image(result_id, max_side=size)
+    return _send_stored_blob(result_id, thumbnail_kind(size))
+
+
+@app.route('/results/<result_id>/overlay', methods=['GET'])
+def result_overlay(result_id):
+    """Слой разметки overlay-результата в том же виде, что в ответе /upload (?format=svg - SVG)"""
+    stored = result_store.get(result_id) if result_store is not None else None
+    layer = result_store.layer(result_id) if stored is not None else None
+    if layer is None:
+        return jsonify({'error': 'Result not found'}), 404
+    width, height = stored['width'], stored['height']
+    if request.args.get('format') == 'svg':
+        return Response(layer.to_svg(width, height), mimetype='image/svg+xml')
+    return jsonify({'width': width, 'height': height, 'items': layer.to_json()})
+
+
+@app.route('/results/<result_id>/original', methods=['GET'])
+def result_original(result_id):
+    """Исходное изображение проверки в том виде, в котором оно было загружено"""
+    return _send_stored_blob(result_id, ORIGINAL)
+
+
+@app.route('/sessions/<session_id>/results', methods=['GET'])
+def session_results(session_id):
+    """
+    История проверок сессии, новые первыми: ?limit= и ?before= (курсор next из предыдущей страницы).
+    Для карточек - сводка и миниатюры, отчет целиком - по /results/<id>.
+    """
+    if result_store is None:
+        return jsonify({'error': 'Result store is disabled'}), 404
+    limit = request.args.get('limit', 20, type=int)
+    before = request.args.get('before', type=int)
+    items, next_cursor = result_store.history(session_id, limit=limit, before=before)
+    for item in items:
+        kinds = {thumbnail_kind(size) for size in item.pop('thumbnail_sizes')}
+        if item.pop('has_image'):
+            kinds.add(IMAGE)
+        if item.pop('has_original'):
+            kinds.add(ORIGINAL)
+        if item.pop('has_overlay'):
+            kinds.add(OVERLAY)
+        item.update(_stored_urls(item['result_id'], kinds))
+    return jsonify({'session_id': session_id, 'items': items, 'next': next_cursor})
+
+
+def _report_source(data):
+    """
+    Данные одного чертежа для отчета: изображение по result_id (уже на сервере)
+    или image_base64 от клиента. Возвращает (drawing, error).
+    """
+    drawing = {
+        'drawing_id': data.get('drawing_id'),
+        'filename': data.get('filename'),
+        'check_result': data.get('check_result'),
+        'created_at': data.get('created_at'),
+    }
+    result_id = data.get('result_id')
+
+    if result_id:
+        drawing['image'] = _result_image(result_id)
+        if drawing['image'] is None:
+            return None, 'Result not found'
+        if not drawing['check_result']:
+            # Текст проверки тоже есть на сервере: в кеше или в хранилище результатов
+            for transport in ('binary', 'base64'):
+                payload = result_cache.get_json(f"upload:{transport}:{result_id}")
+                if payload is not None:
+                    drawing['check_result'] = payload['text']
+                    break
+            else:
+                if result_store is not None:
+                    drawing['check_result'] = result_store.text(result_id)
+        image_part = f"result:{result_id}"
+    else:
+        drawing['image_base64'] = data.get('image_base64')
+        image_part = drawing['image_base64']
+
+    if not all([drawing['drawing_id'], drawing['filename'], drawing['check_result'], image_part]):
+        return None, 'Missing required data'
+
+    drawing['cache_part'] = data_key(drawing['drawing_id'], drawing['filename'],
+                                     drawing['check_result'], image_part, drawing['created_at'])
+    return drawing, None
+
+
 @app.route('/generate_report', methods=['POST'])
+@admitted
 def generate_report():
     try:
         data = request.get_json()
 
-        drawing_id = data.get('drawing_id')
-        filename = data.get('filename')
-        check_result = data.get('check_result')
-        image_base64 = data.get('image_base64')
-        created_at = data.get('created_at')
+        drawing, error = _report_source(data)
+        if error is not None:
+            return jsonify({'error': error}), 404 if error == 'Result not found' else 400
 
-        if not all([drawing_id, filename, check_result, image_base64]):
-            return jsonify({'error': 'Missing required data'}), 400
+        cache_key = data_key('report', drawing.pop('cache_part'), config.REPORT_IMAGE_DPI)
+        doc_bytes = result_cache.get(cache_key)
 
-        # Генерируем Word отчет
-        doc_buffer = generate_word_report(
-            drawing_id=drawing_id,
-            filename=filename,
-            check_result=check_result,
-            image_base64=image_base64,
-            created_at=created_at
-        )
+        if doc_bytes is None:
+            # Генерируем Word отчет
+            # python-docx нужен только для отчетов - не импортируется при старте сервиса
+            from generate_report import generate_word_report
+
+            with metrics.STAGE_SECONDS.labels('report').time():
+                doc_buffer = generate_word_report(**drawing, image_dpi=config.REPORT_IMAGE_DPI)
+            doc_bytes = doc_buffer.getvalue()
+            result_cache.put(cache_key, doc_bytes)
 
         # Кодируем Word в base64 для отправки
-        doc_base64 = base64.b64encode(doc_buffer.getvalue()).decode('utf-8')
+        doc_base64 = base64.b64encode(doc_bytes).decode('utf-8')
 
         return jsonify({
             'success': True,
             'doc_base64': doc_base64,
-            'filename': f'report_{drawing_id}.docx'
+            'filename': f'report_{drawing["drawing_id"]}.docx'
         })
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/generate_report_bulk', methods=['POST'])
+@admitted
+def generate_report_bulk():
+    """Один отчет на набор чертежей: {"drawings": [...], "filename": ...}"""
+    try:
+        data = request.get_json()
+        items = data.get('drawings') or []
+        if not items:
+            return jsonify({'error': 'Missing required data'}), 400
+
+        drawings = []
+        for item in items:
+            drawing, error = _report_source(item)
+            if error is not None:
+                return jsonify({'error': error, 'drawing_id': item.get('drawing_id')}), \
+                    404 if error == 'Result not found' else 400
+            drawings.append(drawing)
+
+        cache_key = data_key('report_bulk', *[d.pop('cache_part') for d in drawings],
+                             config.REPORT_IMAGE_DPI)
+        doc_bytes = result_cache.get(cache_key)
+
+        if doc_bytes is None:
+            from generate_report import generate_bulk_word_report
+
+            with metrics.STAGE_SECONDS.labels('report_bulk').time():
+                doc_bytes = generate_bulk_word_report(drawings, image_dpi=config.REPORT_IMAGE_DPI).getvalue()
+            result_cache.put(cache_key, doc_bytes)
+
+        return jsonify({
+            'success': True,
+            'doc_base64': base64.b64encode(doc_bytes).decode('utf-8'),
+            'filename': data.get('filename') or 'report_set.docx'
+        })
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/stats/inference', methods=['GET'])
+def inference_stats():
+    return jsonify(dict(
+        scheduler.stats(),
+        backend=config.INFERENCE_BACKEND,
+        weights=model.weights_path,
+        phase=model.phase,
+        startup_ms=startup_ms(),
+        warmup_ms={str(imgsz): runs for imgsz, runs in warmup_ms.items()},
+    ))
+
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Живость процесса: отвечает сразу после импорта, 503 - только если модель не загрузилась"""
+    if model.error is not None:
+        return jsonify({'status': 'failed', 'error': model.error}), 503
+    return jsonify({'status': 'ok'})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Готовность принимать проверки: модель загружена и прогрета, сервер не останавливается"""
+    ready = model.ready and not admission.stats()['closed']
+    status = 'ready' if ready else ('draining' if model.ready else model.phase)
+    return jsonify({'status': status, 'startup_ms': startup_ms()}), 200 if ready else 503
+
+
+@app.route('/stats/shadow', methods=['GET'])
+def shadow_stats():
+    """Сравнение модели-кандидата с основной на выборке трафика (для решения о замене весов)"""
+    if shadow is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(
+        shadow.stats(),
+        enabled=True,
+        primary={'backend': config.INFERENCE_BACKEND, 'weights': model.weights_path},
+        candidate={'backend': config.SHADOW_BACKEND, 'weights': shadow_model.weights_path},
+    ))
+
+
+@app.route('/stats/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(result_cache.stats())
+
+
+@app.route('/stats/jobs', methods=['GET'])
+def job_stats():
+    return jsonify(jobs.stats())
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/stats/sessions', methods=['GET'])
+def session_stats():
+    return jsonify(session_versions.stats())
+
+
+@app.route('/stats/store', methods=['GET'])
+def store_stats():
+    if result_store is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(result_store.stats(), enabled=True))
+
+
+@app.route('/stats/admission', methods=['GET'])
+def admission_stats():
+    return jsonify(admission.stats())
+
+
+# Время импорта сервиса (без загрузки модели - она идет в фоне)
+IMPORT_MS = round((time.perf_counter() - APP_STARTED) * 1000.0, 1)
+
+
+def startup_ms():
+    """Фазы запуска процесса, мс: import, load, warmup и ready (от начала импорта)"""
+    return dict(model.timings_ms, **{'import': IMPORT_MS})
+
+
+if not config.SERVER_PRELOAD:
+    start_model()
+
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    # Встроенный сервер - только для разработки, в production: gunicorn -c gunicorn.conf.py app:app
+    host, port = config.SERVER_BIND.rsplit(':', 1)
+    app.run(host=host, port=int(port), debug=config.DEBUG, threaded=True)
\ No newline at end of file
@@ -0,0 +1,145 @@
+import math
+import os
+import zipfile
+
+import numpy as np
+from PIL import Image
+
+from large_image import ImageTooLarge
+from process_image import load_image
+
+# Расширения листов внутри ZIP
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp'}
+
+# Ниже этого разрешения страницу PDF не растеризуем, а отдаем ошибку листа
+PDF_MIN_DPI = 72
+
+
+def _fitz():
+    """PyMuPDF нужен только для PDF: импортируется при первом PDF, а не при старте сервиса"""
+    try:
+        import pymupdf as fitz
+    except ImportError:
+        try:
+            import fitz  # старые версии PyMuPDF
+        except ImportError:
+            raise ValueError("Для обработки PDF нужен пакет PyMuPDF (pip install pymupdf)")
+    return fitz
+
+
+def detect_container(stream):
+    """Тип набора по сигнатуре: zip, pdf, tiff или None"""
+    head = stream.read(8)
+    stream.seek(0)
+    if head.startswith(b'PK\x03\x04'):
+        return 'zip'
+    if head.startswith(b'%PDF'):
+        return 'pdf'
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    return None
+
+
+def _iter_zip(stream, decode=load_image):
+    with zipfile.ZipFile(stream) as archive:
+        names = sorted(
+            info.filename for info in archive.infolist()
+            if not info.is_dir()
+            and os.path.splitext(info.filename)[1].lower() in IMAGE_EXTENSIONS
+            and not os.path.basename(info.filename).startswith('.')
+        )
+        for name in names:
+            # Каждый лист распаковывается только когда до него дошла очередь
+            try:
+                with archive.open(name) as member:
+                    image_np = decode(member)
+            except Exception as e:
+                # Битый лист не прерывает весь набор
+                yield name, None, str(e)
+                continue
+            yield name, image_np, None
+
+
+def _check_pixels(w, h, max_pixels):
+    """Тот же предел, что у одиночной загрузки (large_image.open_image)"""
+    if max_pixels and w * h > max_pixels:
+        raise ImageTooLarge(f"Изображение слишком большое: {w}x{h} px, допускается не больше "
+                            f"{max_pixels / 1e6:.0f} Мп")
+
+
+def _iter_tiff(stream, max_pixels=0):
+    try:
+        image = Image.open(stream)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(f"Изображение слишком большое: {str(e)}")
+    with image:
+        for index in range(getattr(image, 'n_frames', 1)):
+            name = f"page_{index + 1}"
+            try:
+                image.seek(index)
+                # Защита PIL от "бомб" проверяет только первый кадр - размер каждого сверяем сами
+                _check_pixels(*image.size, max_pixels)
+                frame = image.convert("RGB") if image.mode != "RGB" else image.copy()
+            except Exception as e:
+                yield name, None, str(e)
+                continue
+            image_np = np.asarray(frame)
+            image_np.flags.writeable = False
+            yield name, image_np, None
+
+
+def _page_dpi(page, dpi, max_pixels):
+    """Разрешение растеризации страницы: dpi, уменьшенное так, чтобы уложиться в max_pixels"""
+    # Размер страницы - в пунктах (1/72 дюйма)
+    w, h = page.rect.width * dpi / 72, page.rect.height * dpi / 72
+    if not max_pixels or w * h <= max_pixels:
+        return dpi
+    page_dpi = int(dpi * math.sqrt(max_pixels / (w * h)))
+    if page_dpi < PDF_MIN_DPI:
+        _check_pixels(math.ceil(w), math.ceil(h), max_pixels)
+    return page_dpi
+
+
+def _open_pdf(stream, fitz):
+    # Набор уже во временном файле на диске - PyMuPDF читает его оттуда, а не из копии в памяти
+    path = getattr(stream, 'name', None)
+    if isinstance(path, str) and os.path.isfile(path):
+        stream.flush()
+        return fitz.open(path, filetype='pdf')
+    return fitz.open(stream=stream.read(), filetype='pdf')
+
+
+def _iter_pdf(stream, dpi, fitz, max_pixels=0):
+    with _open_pdf(stream, fitz) as document:
+        for index, page in enumerate(document):
+            name = f"page_{index + 1}"
+            try:
+                # Растеризуем по одной странице
+                pixmap = page.get_pixmap(dpi=_page_dpi(page, dpi, max_pixels), alpha=False)
+            except Exception as e:
+                yield name, None, str(e)
+                continue
+            image_np = np.frombuffer(pixmap.samples, dtype=np.uint8).reshape(
+                pixmap.height, pixmap.width, pixmap.n)
+            image_np.flags.writeable = False
+            yield name, image_np, None
+
+
+def iter_sheets(file, pdf_dpi=200, decode=load_image, max_pixels=0):
+    """
+    Листы набора по одному: (имя, RGB-массив только для чтения, ошибка).
+    Поддерживаются ZIP с изображениями, многостраничный TIFF и PDF.
+    Формат проверяется сразу, сами листы читаются лениво.
+    decode(файл) - декодирование листа из ZIP (например, large_image.open_image с пределами)
+    max_pixels - предел пикселей кадра TIFF; страница PDF растеризуется с меньшим dpi,
+    чтобы в него уложиться (0 - без предела)
+    """
+    stream = getattr(file, 'stream', file)
+    container = detect_container(stream)
+    if container == 'zip':
+        return _iter_zip(stream, decode)
+    if container == 'tiff':
+        return _iter_tiff(stream, max_pixels)
+    if container == 'pdf':
+        return _iter_pdf(stream, pdf_dpi, _fitz(), max_pixels)
+    raise ValueError("Поддерживаются только ZIP, многостраничный TIFF и PDF")
@@ -0,0 +1,152 @@
+"""
+Сверка детекций разных сред выполнения модели на образцах чертежей.
+
+    python benchmarks/backend_parity.py --backends onnx openvino
+    python benchmarks/backend_parity.py --backends onnx --int8 --min-agreement 0.9
+
+Эталон (по умолчанию ultralytics) и каждая среда прогоняются по всем
+образцам из ../application/image. Боксы сопоставляются внутри класса по IoU,
+дополнительно сравнивается число нарушений в проверках ГОСТ.
+Код возврата 1, если доля совпавших боксов ниже порога.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+DEFAULT_IMAGE_DIR = os.path.join(SERVER_DIR, '..', 'application', 'image')
+
+# Порог IoU, при котором боксы считаются одной и той же детекцией
+MATCH_IOU = 0.5
+
+
+def _iou_matrix(a, b):
+    ix0 = np.maximum(a[:, None, 0], b[None, :, 0])
+    iy0 = np.maximum(a[:, None, 1], b[None, :, 1])
+    ix1 = np.minimum(a[:, None, 2], b[None, :, 2])
+    iy1 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(ix1 - ix0, 0, None) * np.clip(iy1 - iy0, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def match_detections(reference, candidate):
+    """Жадное сопоставление боксов одного класса по убыванию IoU"""
+    matched, ious = 0, []
+    for cls_id in np.union1d(reference.classes, candidate.classes):
+        ref = reference.of_class(cls_id)
+        cand = candidate.of_class(cls_id)
+        if not len(ref) or not len(cand):
+            continue
+        iou = _iou_matrix(ref, cand)
+        while True:
+            i, j = np.unravel_index(np.argmax(iou), iou.shape)
+            if iou[i, j] < MATCH_IOU:
+                break
+            matched += 1
+            ious.append(float(iou[i, j]))
+            iou[i, :] = -1
+            iou[:, j] = -1
+    total = max(len(reference), len(candidate))
+    return {
+        'reference': len(reference),
+        'candidate': len(candidate),
+        'matched': matched,
+        'agreement': matched / total if total else 1.0,
+        'mean_iou': float(np.mean(ious)) if ious else None,
+    }
+
+
+def violation_summary(image, detections):
+    """Число нарушений по проверкам, посчитанное по этим детекциям"""
+    from process_arrow_heads import process_arrow_heads
+    from process_arrow_distances import process_arrow_distances
+    from process_text import process_text
+
+    return {
+        'arrow_heads': len(process_arrow_heads(image, detections=detections, render=False)[0]),
+        'arrow_distances': len(process_arrow_distances(image, detections=detections, render=False)[0]),
+        'text': len(process_text(image, detections=detections, render=False)[0]),
+    }
+
+
+def run_backend(model, images):
+    from detections import detect
+
+    detections, timings = {}, []
+    for name, image in images.items():
+        started = time.perf_counter()
+        detections[name] = detect(image, model)
+        timings.append((time.perf_counter() - started) * 1000.0)
+    return detections, float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--reference', default='ultralytics')
+    parser.add_argument('--backends', nargs='+', required=True)
+    parser.add_argument('--int8', action='store_true', help='сравнивать INT8-веса кандидатов')
+    parser.add_argument('--images', default=DEFAULT_IMAGE_DIR)
+    parser.add_argument('--min-agreement', type=float, default=0.95,
+                        help='минимальная доля совпавших боксов на каждом образце')
+    parser.add_argument('--json', help='сохранить отчет в файл')
+    args = parser.parse_args()
+
+    from PIL import Image
+
+    import config
+    from inference_backends import load_backend, warmup
+
+    paths = sorted(glob.glob(os.path.join(args.images, '*.png')) + glob.glob(os.path.join(args.images, '*.jpg')))
+    images = {os.path.basename(p): np.asarray(Image.open(p).convert("RGB")) for p in paths}
+
+    def load(backend, int8):
+        model = load_backend(backend, config.MODEL_PATH, int8=int8,
+                             intra_op_threads=config.INFERENCE_INTRA_OP_THREADS,
+                             inter_op_threads=config.INFERENCE_INTER_OP_THREADS)
+        warmup(model, runs=1)
+        return model
+
+    reference, reference_ms = run_backend(load(args.reference, False), images)
+    report = {'reference': args.reference, 'reference_median_ms': round(reference_ms, 1), 'backends': {}}
+    failed = False
+
+    for backend in args.backends:
+        candidate, candidate_ms = run_backend(load(backend, args.int8), images)
+        per_image = {}
+        for name, image in images.items():
+            row = match_detections(reference[name], candidate[name])
+            row['violations_reference'] = violation_summary(image, reference[name])
+            row['violations_candidate'] = violation_summary(image, candidate[name])
+            row['violations_equal'] = row['violations_reference'] == row['violations_candidate']
+            failed |= row['agreement'] < args.min_agreement
+            per_image[name] = row
+            print(f"{backend:<10} {name:<22} совпало {row['matched']}/{max(row['reference'], row['candidate'])} "
+                  f"({row['agreement']:.1%}), нарушения {'совпадают' if row['violations_equal'] else 'отличаются'}")
+
+        report['backends'][backend] = {
+            'int8': args.int8,
+            'median_ms': round(candidate_ms, 1),
+            'speedup': round(reference_ms / candidate_ms, 2) if candidate_ms else None,
+            'min_agreement': min(row['agreement'] for row in per_image.values()),
+            'images': per_image,
+        }
+        print(f"{backend}: медиана {candidate_ms:.1f} мс против {reference_ms:.1f} мс у {args.reference}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+Замер холодного старта сервиса.
+
+    python benchmarks/cold_start.py --json cold.json
+    python benchmarks/cold_start.py --compare cold.json --threshold 0.2
+
+Разделы замера (каждый запуск - новый процесс, медиана из --repeat):
+  import  - импорт app (модель грузится в фоне и в это время не входит)
+            и самые долгие импорты верхнего уровня по python -X importtime;
+  server  - встроенный сервер: до первого ответа /healthz, до готовности /readyz
+            (загрузка и прогрев модели), первая проверка /upload после готовности
+            и время от запуска процесса до ее результата.
+
+Модель - из config (GOSTGUARD_MODEL_PATH и др.), как в сервисе.
+Формат JSON и сравнение - как у pipeline_bench.py.
+"""
+import argparse
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pipeline_bench import Results, _summary, print_comparison, DEFAULT_THRESHOLD, DEFAULT_MIN_MS  # noqa: E402
+
+DEFAULT_IMAGE = os.path.join(SERVER_DIR, 'warmup_sheet.png')
+
+# Сколько ждать готовности сервера, с
+READY_TIMEOUT_S = 300.0
+POLL_INTERVAL_S = 0.005
+
+IMPORT_SNIPPET = (
+    "import json, time; started = time.perf_counter(); import app; "
+    "print(json.dumps({'import_ms': (time.perf_counter() - started) * 1000.0}))"
+)
+
+
+def _env(**extra):
+    env = dict(os.environ, GOSTGUARD_PRELOAD='0', GOSTGUARD_DEBUG='0', GOSTGUARD_REQUEST_LOG='0')
+    env.update(extra)
+    return env
+
+
+def measure_import():
+    output = subprocess.run([sys.executable, '-c', IMPORT_SNIPPET], cwd=SERVER_DIR, env=_env(),
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])['import_ms']
+
+
+def top_imports(limit):
+    """Самые долгие импорты верхнего уровня (включая вложенные), мс"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=SERVER_DIR,
+                            env=_env(), capture_output=True, text=True, check=True).stderr
+    modules = {}
+    for line in stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)', line)
+        # Отступ в три пробела - модули, которые импортирует сам app
+        if match and len(match.group(2)) == 3:
+            modules[match.group(3)] = int(match.group(1)) / 1000.0
+    return dict(sorted(modules.items(), key=lambda item: -item[1])[:limit])
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _get(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read() or b'{}')
+    except (urllib.error.URLError, ConnectionError):
+        return None, None
+
+
+def _wait(url, deadline, ok=lambda status: status is not None):
+    while time.perf_counter() < deadline:
+        status, body = _get(url)
+        if ok(status):
+            return body
+        time.sleep(POLL_INTERVAL_S)
+    raise TimeoutError(f"Нет ответа от {url}")
+
+
+def _upload(url, image_path):
+    boundary = uuid.uuid4().hex
+    with open(image_path, 'rb') as f:
+        data = f.read()
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; '
+            f'filename="{os.path.basename(image_path)}"\r\nContent-Type: application/octet-stream\r\n\r\n'
+            ).encode('utf-8') + data + f'\r\n--{boundary}--\r\n'.encode('utf-8')
+    request = urllib.request.Request(url, data=body, method='POST',
+                                     headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+    with urllib.request.urlopen(request, timeout=READY_TIMEOUT_S) as response:
+        response.read()
+        return response.status
+
+
+def measure_server(image_path):
+    """Один запуск сервера: {метрика: мс} и фазы запуска из /readyz"""
+    port = _free_port()
+    base = f'http://127.0.0.1:{port}'
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd=SERVER_DIR,
+                               env=_env(GOSTGUARD_BIND=f'127.0.0.1:{port}'),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = started + READY_TIMEOUT_S
+        _wait(f'{base}/healthz', deadline)
+        healthz_ms = (time.perf_counter() - started) * 1000.0
+        ready = _wait(f'{base}/readyz', deadline, ok=lambda status: status == 200)
+        ready_ms = (time.perf_counter() - started) * 1000.0
+
+        check_started = time.perf_counter()
+        status = _upload(f'{base}/upload', image_path)
+        if status != 200:
+            raise RuntimeError(f"/upload вернул {status}")
+        done = time.perf_counter()
+        return {
+            'healthz': healthz_ms,
+            'ready': ready_ms,
+            'first_check': (done - check_started) * 1000.0,
+            'first_result': (done - started) * 1000.0,
+        }, ready['startup_ms']
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def run(args):
+    meta = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'backend': os.environ.get('GOSTGUARD_INFERENCE_BACKEND', 'ultralytics'),
+        'image': os.path.basename(args.image),
+        'repeat': args.repeat,
+    }
+    results = Results(meta)
+    sections = set(args.sections)
+
+    if 'import' in sections:
+        summary = _summary([measure_import() for _ in range(args.repeat)])
+        results.add('import/app', summary['median'])
+        results.details['import'] = {'app_ms': summary, 'top_ms': top_imports(args.top)}
+
+    if 'server' in sections:
+        runs, phases = [], []
+        for _ in range(args.repeat):
+            timings, startup = measure_server(args.image)
+            runs.append(timings)
+            phases.append(startup)
+        for name in runs[0]:
+            results.add(f'server/{name}', _summary([run[name] for run in runs])['median'])
+        for phase in ('load', 'warmup'):
+            values = [startup[phase] for startup in phases if phase in startup]
+            if values:
+                results.add(f'server/model_{phase}', _summary(values)['median'])
+        results.details['server'] = {'runs': runs, 'startup_ms': phases}
+
+    report = results.as_dict()
+    for key, metric in report['metrics'].items():
+        print(f"{key:<28} {metric['value']:>10.1f} {metric['unit']}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты: {args.json}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        sys.exit(1 if print_comparison(baseline, report, args.threshold, args.min_ms) else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sections', nargs='+', default=['import', 'server'], choices=('import', 'server'))
+    parser.add_argument('--repeat', type=int, default=3, help='запусков на раздел')
+    parser.add_argument('--image', default=DEFAULT_IMAGE, help='чертеж для первой проверки')
+    parser.add_argument('--top', type=int, default=10, help='сколько самых долгих импортов сохранить')
+    parser.add_argument('--json', help='сохранить результаты в файл')
+    parser.add_argument('--compare', help='сравнить с сохраненным замером')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    parser.add_argument('--min-ms', type=float, default=DEFAULT_MIN_MS)
+    run(parser.parse_args())
+
+
+if __name__ == '__main__':
+    main()
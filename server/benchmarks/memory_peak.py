@@ -0,0 +1,82 @@
+"""
+Пиковая память на один запрос /upload (декодирование, все проверки,
+разметка и PNG/base64), без весов модели - со StubDetector.
+
+    python benchmarks/memory_peak.py ../application/image/gost14034_3.png --side 3000 6000
+    python benchmarks/memory_peak.py ../application/image/gost14034_3.png --side 12000 --large-pixels 40000000
+
+Каждый размер меряется в отдельном процессе, чтобы кучи не влияли друг на друга.
+"""
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(image_path, side, large_pixels=0, gray=False):
+    from PIL import Image
+    from werkzeug.datastructures import FileStorage
+
+    from memory_usage import PeakRSSSampler
+    from pipeline import run_pipeline, encode_png_base64
+    from large_image import open_image
+    from stub_detector import StubDetector
+
+    # Увеличиваем образец до нужной длинной стороны, как будто это крупный скан
+    src = Image.open(image_path).convert("L" if gray else "RGB")
+    k = side / max(src.size)
+    src = src.resize((round(src.width * k), round(src.height * k)))
+    buffered = io.BytesIO()
+    src.save(buffered, format="PNG")
+    data = buffered.getvalue()
+    del src
+
+    model = StubDetector()
+    with PeakRSSSampler() as sampler:
+        # large_pixels=0 - прежнее декодирование целиком в RGB-массив
+        image_np = open_image(FileStorage(io.BytesIO(data), filename='sheet.png'),
+                              max_pixels=0, large_pixels=large_pixels)
+        final_image, _, _ = run_pipeline(image_np, model)
+        encode_png_base64(final_image)
+
+    h, w = image_np.shape[:2]
+    return {
+        'image': os.path.basename(image_path),
+        'width': w,
+        'height': h,
+        'large_image': bool(large_pixels and w * h > large_pixels),
+        'peak_delta_mb': round(sampler.peak_delta_bytes / 2 ** 20, 1),
+        'bytes_per_pixel': round(sampler.peak_delta_bytes / (w * h), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('image')
+    parser.add_argument('--side', type=int, nargs='+', default=[3000, 6000],
+                        help='длинная сторона изображения, px')
+    parser.add_argument('--large-pixels', type=int, default=0,
+                        help='порог режима крупного скана (как GOSTGUARD_LARGE_IMAGE_PIXELS), 0 - выключен')
+    parser.add_argument('--gray', action='store_true', help='скан в оттенках серого (PNG в режиме L)')
+    parser.add_argument('--single', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(measure(args.image, args.side[0], args.large_pixels, args.gray), ensure_ascii=False))
+        return
+
+    for side in args.side:
+        subprocess.run([sys.executable, os.path.abspath(__file__), args.image,
+                        '--side', str(side), '--large-pixels', str(args.large_pixels), '--single']
+                       + (['--gray'] if args.gray else []),
+                       check=True)
+
+
+if __name__ == '__main__':
+    main()
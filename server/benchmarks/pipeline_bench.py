@@ -0,0 +1,438 @@
+"""
+Замеры скорости конвейера проверки на образцах чертежей из ../application/image.
+
+    python benchmarks/pipeline_bench.py record                      # записать боксы реальной модели
+    python benchmarks/pipeline_bench.py run --json baseline.json    # без весов, на записанных боксах
+    python benchmarks/pipeline_bench.py run --detector model --json model.json
+    python benchmarks/pipeline_bench.py run --compare baseline.json --threshold 0.15
+    python benchmarks/pipeline_bench.py compare baseline.json current.json
+
+Разделы замера:
+  stages      - каждый этап /upload по каждому образцу (декодирование, рамка,
+                детекция, стрелки, расстояния, текст, разметка, PNG/JSON)
+                и generate_word_report, медиана из --repeat прогонов;
+  sweep       - весь /upload на увеличенных копиях листа (крупные сканы);
+  latency     - одиночные запросы через планировщик инференса, как в сервере;
+  throughput  - параллельные запросы: изображений в секунду при разной конкурентности.
+
+Детектор: recorded - записанные боксы реальной модели (benchmarks/recorded_boxes.json,
+без записи - синтетические боксы StubDetector), synthetic - только StubDetector,
+model - настоящая модель из config. HTTP и Flask в замер не входят.
+
+compare сравнивает два JSON и завершается с кодом 1, если какая-то метрика
+ухудшилась больше чем на --threshold (и больше чем на --min-ms для времени).
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+DEFAULT_IMAGE_DIR = os.path.join(SERVER_DIR, '..', 'application', 'image')
+DEFAULT_RECORDINGS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recorded_boxes.json')
+
+# Порог регрессии по умолчанию и минимальная разница во времени, которую считаем не шумом
+DEFAULT_THRESHOLD = 0.15
+DEFAULT_MIN_MS = 2.0
+
+# Метрики, у которых больше - лучше
+HIGHER_IS_BETTER = ('img/s',)
+
+
+def load_samples(image_dir):
+    """{имя: байты файла} - образцы в исходном формате (PNG/JPG)"""
+    paths = sorted(glob.glob(os.path.join(image_dir, '*.png')) + glob.glob(os.path.join(image_dir, '*.jpg')))
+    samples = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            samples[os.path.basename(path)] = f.read()
+    return samples
+
+
+def decode(data, filename='sheet.png'):
+    from werkzeug.datastructures import FileStorage
+
+    from process_image import load_image
+
+    return load_image(FileStorage(io.BytesIO(data), filename=filename))
+
+
+def upscale(data, side):
+    """PNG-копия образца с длинной стороной side, как будто это крупный скан"""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(data)) as src:
+        src = src.convert("RGB")
+        k = side / max(src.size)
+        src = src.resize((round(src.width * k), round(src.height * k)), Image.BILINEAR)
+        buffered = io.BytesIO()
+        src.save(buffered, format="PNG")
+    return buffered.getvalue()
+
+
+def check_once(data, filename, model):
+    """
+    То же, что /upload делает с одним чертежом (без HTTP):
+    декодирование, все проверки, разметка, PNG/base64 и JSON ответа.
+    """
+    from metrics import StageTimings
+    from pipeline import run_pipeline, encode_png_base64
+
+    timings = StageTimings()
+    with timings.stage('decode'):
+        image_np = decode(data, filename)
+    final_image, combined_text, full_report = run_pipeline(image_np, model, timings=timings)
+    with timings.stage('encode'):
+        json.dumps({'text': combined_text, 'full_report': full_report,
+                    'image_base64': encode_png_base64(final_image)}, ensure_ascii=False)
+    return timings, final_image, combined_text
+
+
+def _ms(seconds):
+    return seconds * 1000.0
+
+
+def _summary(values):
+    values = np.asarray(values, dtype=np.float64)
+    return {
+        'median': float(np.median(values)),
+        'p95': float(np.percentile(values, 95)),
+        'mean': float(values.mean()),
+    }
+
+
+class Results:
+    """Плоский набор метрик {ключ: {value, unit}} плюс подробности по разделам"""
+
+    def __init__(self, meta):
+        self.meta = meta
+        self.metrics = {}
+        self.details = {}
+
+    def add(self, key, value, unit='ms'):
+        self.metrics[key] = {'value': round(float(value), 3), 'unit': unit}
+
+    def as_dict(self):
+        return {'meta': self.meta, 'metrics': self.metrics, 'details': self.details}
+
+
+def bench_stages(results, samples, model, repeat):
+    from generate_report import generate_word_report
+
+    import config
+
+    per_image = {}
+    for name, data in samples.items():
+        stage_ms = {}
+        for run in range(repeat + 1):
+            timings, final_image, combined_text = check_once(data, name, model)
+            started = time.perf_counter()
+            generate_word_report('bench', name, combined_text, image=final_image,
+                                 image_dpi=config.REPORT_IMAGE_DPI)
+            report_seconds = time.perf_counter() - started
+            if run == 0:
+                # Первый прогон - прогрев (кеш шаблона отчета, ленивые импорты)
+                continue
+            for stage, seconds in timings.stages.items():
+                stage_ms.setdefault(stage, []).append(_ms(seconds))
+            stage_ms.setdefault('upload', []).append(_ms(sum(timings.stages.values())))
+            stage_ms.setdefault('report', []).append(_ms(report_seconds))
+
+        medians = {stage: float(np.median(values)) for stage, values in stage_ms.items()}
+        for stage, value in medians.items():
+            results.add(f"stages/{name}/{stage}", value)
+        per_image[name] = {stage: round(value, 2) for stage, value in medians.items()}
+        print(f"{name:<18} " + ' '.join(f"{stage} {value:.1f}" for stage, value in medians.items()))
+
+    # Сумма медиан по всем образцам - одна цифра на этап
+    stages = {stage for medians in per_image.values() for stage in medians}
+    for stage in sorted(stages):
+        results.add(f"stages/all/{stage}", sum(medians.get(stage, 0.0) for medians in per_image.values()))
+    results.details['stages'] = per_image
+
+
+def bench_sweep(results, samples, model, image_name, sides, repeat, register=None):
+    rows = []
+    for side in sides:
+        data = upscale(samples[image_name], side)
+        image_np = decode(data)
+        if register is not None:
+            register(image_np, image_name)
+        h, w = image_np.shape[:2]
+        del image_np
+
+        timings_ms = []
+        for _ in range(repeat):
+            timings, _, _ = check_once(data, image_name, model)
+            timings_ms.append(_ms(sum(timings.stages.values())))
+        value = float(np.median(timings_ms))
+        megapixels = w * h / 1e6
+        results.add(f"sweep/{image_name}@{side}", value)
+        results.add(f"sweep/{image_name}@{side}/per_mp", value / megapixels, 'ms/MP')
+        rows.append({'side': side, 'width': w, 'height': h, 'median_ms': round(value, 1),
+                     'ms_per_mp': round(value / megapixels, 1), 'stages_ms': timings.as_ms()})
+        print(f"{image_name} {w}x{h}: {value:.0f} мс ({value / megapixels:.1f} мс/Мп)")
+    results.details['sweep'] = rows
+
+
+def _scheduler(model):
+    import config
+    from inference_scheduler import InferenceScheduler
+
+    return InferenceScheduler(model, max_batch_size=config.INFERENCE_MAX_BATCH_SIZE,
+                              max_wait_ms=config.INFERENCE_MAX_WAIT_MS)
+
+
+def bench_latency(results, samples, model, repeat):
+    scheduler = _scheduler(model)
+    latencies = []
+    try:
+        for _ in range(repeat):
+            for name, data in samples.items():
+                started = time.perf_counter()
+                check_once(data, name, scheduler)
+                latencies.append(_ms(time.perf_counter() - started))
+    finally:
+        scheduler.close()
+
+    summary = _summary(latencies)
+    results.add('latency/median', summary['median'])
+    results.add('latency/p95', summary['p95'])
+    results.details['latency'] = {key: round(value, 2) for key, value in summary.items()}
+    print(f"одиночный запрос: медиана {summary['median']:.1f} мс, p95 {summary['p95']:.1f} мс")
+
+
+def bench_throughput(results, samples, model, levels, requests):
+    items = list(samples.items())
+    rows = []
+    for concurrency in levels:
+        scheduler = _scheduler(model)
+        total = max(requests, concurrency * 2)
+        work = [items[i % len(items)] for i in range(total)]
+
+        def one(item):
+            started = time.perf_counter()
+            check_once(item[1], item[0], scheduler)
+            return _ms(time.perf_counter() - started)
+
+        try:
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                latencies = list(pool.map(one, work))
+            elapsed = time.perf_counter() - started
+            batching = scheduler.stats()
+        finally:
+            scheduler.close()
+
+        summary = _summary(latencies)
+        rate = total / elapsed
+        results.add(f"throughput/c{concurrency}", rate, 'img/s')
+        results.add(f"throughput/c{concurrency}/p95", summary['p95'])
+        rows.append({'concurrency': concurrency, 'requests': total, 'images_per_s': round(rate, 2),
+                     'latency_ms': {key: round(value, 1) for key, value in summary.items()},
+                     'avg_batch_size': round(batching['avg_batch_size'], 2)})
+        print(f"конкурентность {concurrency}: {rate:.2f} изобр/с, p95 {summary['p95']:.0f} мс, "
+              f"средний батч {batching['avg_batch_size']:.2f}")
+    results.details['throughput'] = rows
+
+
+def build_detector(kind, recordings_path):
+    """(модель с интерфейсом predict, функция регистрации образца или None, описание)"""
+    from stub_detector import RecordedDetector, StubDetector
+
+    if kind == 'synthetic':
+        return StubDetector(), None, {'detector': 'synthetic'}
+
+    if kind == 'recorded':
+        recordings = {}
+        if os.path.isfile(recordings_path):
+            with open(recordings_path, encoding='utf-8') as f:
+                recordings = json.load(f)
+        else:
+            print(f"Нет записи боксов {recordings_path}: для всех образцов синтетические боксы")
+        detector = RecordedDetector(recordings)
+        return detector, detector.register, {'detector': 'recorded', 'recorded_samples': sorted(recordings)}
+
+    import config
+    from inference_backends import load_backend, warmup
+
+    model = load_backend(config.INFERENCE_BACKEND, config.MODEL_PATH, int8=config.INFERENCE_INT8,
+                         intra_op_threads=config.INFERENCE_INTRA_OP_THREADS,
+                         inter_op_threads=config.INFERENCE_INTER_OP_THREADS,
+                         path=config.INFERENCE_BACKEND_PATH or None)
+    warmup(model, runs=config.INFERENCE_WARMUP_RUNS)
+    return model, None, {'detector': 'model', 'backend': config.INFERENCE_BACKEND,
+                         'weights': os.path.basename(model.weights_path), 'int8': config.INFERENCE_INT8}
+
+
+def run(args):
+    samples = load_samples(args.images)
+    if not samples:
+        sys.exit(f"В {args.images} нет образцов")
+    if args.sweep_image not in samples:
+        sys.exit(f"Нет образца {args.sweep_image} для замера крупных сканов")
+
+    model, register, detector_meta = build_detector(args.detector, args.recordings)
+    if register is not None:
+        for name, data in samples.items():
+            register(decode(data, name), name)
+
+    # Листы, на которых проверка падает (например, без рамки), в замер не входят
+    skipped = {}
+    for name, data in list(samples.items()):
+        try:
+            check_once(data, name, model)
+        except Exception as e:
+            skipped[name] = str(e)
+            del samples[name]
+    for name, error in skipped.items():
+        print(f"Пропущен {name}: {error}")
+    if args.sweep_image not in samples:
+        sys.exit(f"Образец {args.sweep_image} не проходит проверку, выберите другой --sweep-image")
+
+    meta = dict(detector_meta)
+    meta.update({
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'samples': sorted(samples),
+        'skipped': skipped,
+        'repeat': args.repeat,
+    })
+    results = Results(meta)
+
+    sections = set(args.sections)
+    if 'stages' in sections:
+        bench_stages(results, samples, model, args.repeat)
+    if 'sweep' in sections:
+        bench_sweep(results, samples, model, args.sweep_image, args.sides, max(1, args.repeat // 2), register)
+    if 'latency' in sections:
+        bench_latency(results, samples, model, max(1, args.repeat // 2))
+    if 'throughput' in sections:
+        bench_throughput(results, samples, model, args.concurrency, args.requests)
+
+    report = results.as_dict()
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результаты: {args.json}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        sys.exit(1 if print_comparison(baseline, report, args.threshold, args.min_ms) else 0)
+
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD, min_ms=DEFAULT_MIN_MS):
+    """
+    Строки сравнения по общим метрикам: (ключ, было, стало, единица, изменение, регрессия).
+    Изменение - во сколько раз хуже (>0) или лучше (<0), с учетом направления метрики.
+    """
+    rows = []
+    for key, base in baseline['metrics'].items():
+        cur = current['metrics'].get(key)
+        if cur is None or not base['value']:
+            continue
+        before, after, unit = base['value'], cur['value'], cur['unit']
+        if unit in HIGHER_IS_BETTER:
+            change = before / after - 1.0 if after else float('inf')
+            regression = change > threshold
+        else:
+            change = after / before - 1.0
+            # Для времени отсекаем шум на быстрых этапах
+            regression = change > threshold and (unit != 'ms' or after - before > min_ms)
+        rows.append((key, before, after, unit, change, regression))
+    return rows
+
+
+def print_comparison(baseline, current, threshold=DEFAULT_THRESHOLD, min_ms=DEFAULT_MIN_MS):
+    """Печатает сравнение, возвращает True, если есть регрессии"""
+    for field in ('detector', 'cpu_count', 'backend'):
+        if baseline['meta'].get(field) != current['meta'].get(field):
+            print(f"Внимание: {field} отличается ({baseline['meta'].get(field)} → {current['meta'].get(field)}), "
+                  f"сравнение может быть некорректным")
+
+    rows = compare_results(baseline, current, threshold, min_ms)
+    regressions = [row for row in rows if row[5]]
+    for key, before, after, unit, change, regression in rows:
+        # Ухудшения в пределах шума (--min-ms) не печатаем
+        if regression or change < -threshold:
+            mark = 'РЕГРЕССИЯ' if regression else 'лучше'
+            print(f"{mark:<10} {key:<48} {before:>10.2f} → {after:>10.2f} {unit} ({change:+.0%})")
+
+    missing = sorted(set(baseline['metrics']) - set(current['metrics']))
+    if missing:
+        print(f"Нет в текущем замере: {', '.join(missing)}")
+    print(f"Метрик сравнено: {len(rows)}, регрессий: {len(regressions)} (порог {threshold:.0%})")
+    return bool(regressions)
+
+
+def record(args):
+    samples = load_samples(args.images)
+    model, _, detector_meta = build_detector('model', None)
+
+    from stub_detector import record_detections
+
+    recordings = record_detections(model, {name: decode(data, name) for name, data in samples.items()})
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(recordings, f)
+    print(f"Записаны боксы {detector_meta['weights']} по {len(recordings)} образцам: {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='замер')
+    run_parser.add_argument('--detector', choices=('recorded', 'synthetic', 'model'), default='recorded')
+    run_parser.add_argument('--recordings', default=DEFAULT_RECORDINGS, help='JSON с записанными боксами')
+    run_parser.add_argument('--images', default=DEFAULT_IMAGE_DIR)
+    run_parser.add_argument('--sections', nargs='+', default=['stages', 'sweep', 'latency', 'throughput'],
+                            choices=('stages', 'sweep', 'latency', 'throughput'))
+    run_parser.add_argument('--repeat', type=int, default=5, help='прогонов на образец')
+    run_parser.add_argument('--sweep-image', default='gost14034_3.png')
+    run_parser.add_argument('--sides', type=int, nargs='+', default=[3000, 6000, 9000],
+                            help='длинная сторона увеличенных копий, px')
+    run_parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    run_parser.add_argument('--requests', type=int, default=34, help='запросов на уровень конкурентности')
+    run_parser.add_argument('--json', help='сохранить результаты в файл')
+    run_parser.add_argument('--compare', help='сравнить с сохраненным замером')
+    run_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    run_parser.add_argument('--min-ms', type=float, default=DEFAULT_MIN_MS)
+
+    record_parser = commands.add_parser('record', help='записать боксы реальной модели')
+    record_parser.add_argument('--images', default=DEFAULT_IMAGE_DIR)
+    record_parser.add_argument('--output', default=DEFAULT_RECORDINGS)
+
+    compare_parser = commands.add_parser('compare', help='сравнить два замера')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD)
+    compare_parser.add_argument('--min-ms', type=float, default=DEFAULT_MIN_MS)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'record':
+        record(args)
+    else:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.current, encoding='utf-8') as f:
+            current = json.load(f)
+        sys.exit(1 if print_comparison(baseline, current, args.threshold, args.min_ms) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+"""
+Каскадный инференс: дешевый проход по всей странице, затем перепроверка
+в родном разрешении только пограничных детекций.
+
+Допуски правил узкие (наконечник 4±1 мм, расстояния 10±2 / 7±2 мм, текст
+3.5±0.5 мм), а бокс из прохода в 640 px ошибается на пиксель-другой. Строки,
+у которых значение хотя бы одного правила ближе margin_mm к границе допуска,
+переизмеряются: вокруг бокса вырезается окно в родном разрешении, все окна
+прогоняются одним батчем, и бокс заменяется совпавшей детекцией из окна.
+Явные нормы и явные нарушения остаются с результатом дешевого прохода.
+"""
+import time
+
+import numpy as np
+
+from detections import Detections, CLS_ARROW, CLS_OBJECT, DEFAULT_IMGSZ
+from geometry import box_iou
+from gost_rules import evaluate_detections, RULES, PX_TO_MM
+
+# Параметры по умолчанию (в сервисе задаются в config.py);
+# margin_mm=None - запас по погрешности дешевого прохода (COARSE_ERROR_PX его пикселей)
+DEFAULT_MARGIN_MM = None
+COARSE_ERROR_PX = 1.0
+DEFAULT_CROP_SIZE = 256
+DEFAULT_MATCH_IOU = 0.3
+
+# Поля вокруг бокса в окне, доля стороны бокса с каждой стороны
+CROP_CONTEXT = 0.5
+# Вход модели кратен шагу сетки YOLO
+IMGSZ_STRIDE = 32
+
+
+def _near_bounds(evaluation, margin_mm):
+    """Матрица правила × строки: значение применимого правила в пределах margin_mm от границы допуска"""
+    lo = np.array([rule.lo for rule in evaluation.rules], dtype=np.float64)[:, None]
+    hi = np.array([rule.hi for rule in evaluation.rules], dtype=np.float64)[:, None]
+    values = evaluation.values
+    with np.errstate(invalid='ignore'):
+        near = (np.abs(values - lo) <= margin_mm) | (np.abs(values - hi) <= margin_mm)
+    return evaluation.applicable & near
+
+
+def borderline_rows(evaluation, margin_mm):
+    """Строки, у которых хотя бы одно правило близко к границе допуска"""
+    return np.flatnonzero(_near_bounds(evaluation, margin_mm).any(axis=0))
+
+
+def _rows_to_recheck(detections, evaluation, margin_mm):
+    """
+    Детекции для перепроверки: сами пограничные строки, а для пограничных расстояний -
+    еще и объект, к которому привязана стрелка (расстояние зависит от обоих боксов).
+    """
+    near = _near_bounds(evaluation, margin_mm)
+    needed = set(np.flatnonzero(near.any(axis=0)).tolist())
+
+    distance = np.array([rule.metric == 'distance_mm' for rule in evaluation.rules])
+    matches = evaluation.table.matches
+    if matches is None or not distance.any():
+        return sorted(needed)
+    arrow_rows = np.flatnonzero(detections.classes == CLS_ARROW)
+    object_rows = np.flatnonzero(detections.classes == CLS_OBJECT)
+    for i, row in enumerate(arrow_rows):
+        if matches.object_idx[i] >= 0 and near[distance, row].any():
+            needed.add(int(object_rows[matches.object_idx[i]]))
+    return sorted(needed)
+
+
+def _crop_window(box, width, height, crop_size):
+    """Окно (x0, y0, x1, y1) вокруг бокса: не меньше crop_size и с полями CROP_CONTEXT"""
+    x0, y0, x1, y1 = box
+    side = max(crop_size, int(np.ceil(max(x1 - x0, y1 - y0) * (1 + 2 * CROP_CONTEXT))))
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    wx0 = int(np.clip(round(cx - side / 2), 0, max(0, width - side)))
+    wy0 = int(np.clip(round(cy - side / 2), 0, max(0, height - side)))
+    return wx0, wy0, min(width, wx0 + side), min(height, wy0 + side)
+
+
+def _crop_imgsz(window):
+    """Вход модели для окна: его длинная сторона, округленная вверх до IMGSZ_STRIDE (без уменьшения)"""
+    x0, y0, x1, y1 = window
+    return -(-max(x1 - x0, y1 - y0) // IMGSZ_STRIDE) * IMGSZ_STRIDE
+
+
+def refine_borderline(image, detections, model, margin_mm=DEFAULT_MARGIN_MM, crop_size=DEFAULT_CROP_SIZE,
+                      match_iou=DEFAULT_MATCH_IOU, coarse_imgsz=DEFAULT_IMGSZ, rules=RULES, px_to_mm=PX_TO_MM,
+                      cancel=None):
+    """
+    Уточняет боксы пограничных детекций по окнам в родном разрешении.
+    image - RGB-массив страницы (в том числе поверх mmap крупного скана: читаются только окна),
+    model - модель или планировщик. Окно крупного бокса больше crop_size, поэтому каждое
+    окно идет в модель в своем размере (кратном IMGSZ_STRIDE), а окна одного размера -
+    одним вызовом predict.
+    Возвращает (Detections, отчет): детекции в том же порядке, у перепроверенных - новые боксы.
+    coarse_imgsz - вход дешевого прохода: страница не больше него уже видна модели целиком.
+    margin_mm=None - запас равен погрешности дешевого прохода: пиксель входа модели
+    на странице в factor раз крупнее, и размер бокса ошибается примерно на такой пиксель.
+    cancel - флаг отмены этапа для ожидания в InferenceScheduler (как в detect).
+    """
+    started = time.perf_counter()
+    height, width = image.shape[:2]
+    factor = max(height, width) / coarse_imgsz
+    if margin_mm is None:
+        margin_mm = round(COARSE_ERROR_PX * factor * px_to_mm, 3)
+    if factor <= 1:
+        return detections, {'margin_mm': margin_mm, 'crop_size': crop_size, 'detections': len(detections),
+                            'rechecked': 0, 'skipped': 'страница не больше входа модели'}
+
+    evaluation = evaluate_detections(detections, rules, px_to_mm)
+    rows = _rows_to_recheck(detections, evaluation, margin_mm)
+    report = {
+        'margin_mm': margin_mm,
+        'crop_size': crop_size,
+        'detections': len(detections),
+        'rechecked': len(rows),
+        'refined': 0,
+        'changed_verdicts': 0,
+    }
+    if not rows:
+        report['recheck_ms'] = round((time.perf_counter() - started) * 1000.0, 2)
+        return detections, report
+
+    windows = [_crop_window(detections.boxes[row], width, height, crop_size) for row in rows]
+    sizes = [_crop_imgsz(window) for window in windows]
+    results = [None] * len(windows)
+    kwargs = {'cancel': cancel} if cancel is not None else {}
+    for imgsz in sorted(set(sizes)):
+        group = [i for i, size in enumerate(sizes) if size == imgsz]
+        crops = [np.ascontiguousarray(image[y0:y1, x0:x1]) for x0, y0, x1, y1 in (windows[i] for i in group)]
+        for i, result in zip(group, model.predict(crops, imgsz=imgsz, **kwargs)):
+            results[i] = result
+    report['crop_imgsz'] = {str(imgsz): sizes.count(imgsz) for imgsz in sorted(set(sizes))}
+
+    boxes = detections.boxes.copy()
+    refined = 0
+    for row, (x0, y0, _, _), result in zip(rows, windows, results):
+        found = Detections.from_results([result])
+        offset = np.array([x0, y0, x0, y0], dtype=np.float32)
+        candidates = found.boxes[found.classes == detections.classes[row]] + offset
+        if len(candidates) == 0:
+            continue
+        iou = box_iou(detections.boxes[row], candidates)[0]
+        best = int(np.argmax(iou))
+        if iou[best] >= match_iou:
+            boxes[row] = candidates[best]
+            refined += 1
+
+    result = Detections(boxes, detections.classes, detections.confidences)
+    # Сколько строк сменили вердикт после уточнения
+    after = evaluate_detections(result, rules, px_to_mm)
+    violated_before = (evaluation.applicable & ~evaluation.ok).any(axis=0)
+    violated_after = (after.applicable & ~after.ok).any(axis=0)
+    report['refined'] = refined
+    report['changed_verdicts'] = int((violated_before != violated_after).sum())
+    report['recheck_ms'] = round((time.perf_counter() - started) * 1000.0, 2)
+    return result, report
@@ -0,0 +1,137 @@
+import os
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_float(name, default):
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+def _env_str(name, default):
+    value = os.environ.get(name)
+    return value if value not in (None, "") else default
+
+
+# Модель
+MODEL_PATH = _env_str("GOSTGUARD_MODEL_PATH", "best.pt")
+
+# Среда выполнения модели: ultralytics (PyTorch), onnx или openvino
+INFERENCE_BACKEND = _env_str("GOSTGUARD_INFERENCE_BACKEND", "ultralytics")
+INFERENCE_BACKEND_PATH = _env_str("GOSTGUARD_INFERENCE_BACKEND_PATH", "")  # пусто - рядом с MODEL_PATH
+INFERENCE_INT8 = _env_str("GOSTGUARD_INFERENCE_INT8", "0").lower() in ("1", "true", "yes")
+INFERENCE_INTRA_OP_THREADS = _env_int("GOSTGUARD_INTRA_OP_THREADS", 0)  # 0 - по умолчанию среды
+INFERENCE_INTER_OP_THREADS = _env_int("GOSTGUARD_INTER_OP_THREADS", 0)
+INFERENCE_WARMUP_RUNS = _env_int("GOSTGUARD_WARMUP_RUNS", 2)
+INFERENCE_WARMUP_IMAGE = _env_str("GOSTGUARD_WARMUP_IMAGE", "")  # пусто - warmup_sheet.png рядом с app.py
+
+# Планировщик инференса (микробатчи)
+INFERENCE_MAX_BATCH_SIZE = _env_int("GOSTGUARD_MAX_BATCH_SIZE", 8)
+INFERENCE_MAX_WAIT_MS = _env_float("GOSTGUARD_MAX_WAIT_MS", 10.0)
+
+# Кеш результатов
+RESULT_CACHE_MAX_BYTES = _env_int("GOSTGUARD_CACHE_MAX_BYTES", 256 * 1024 * 1024)
+RESULT_CACHE_DIR = _env_str("GOSTGUARD_CACHE_DIR", "")  # пусто - без дискового уровня
+RESULT_CACHE_DISK_MAX_BYTES = _env_int("GOSTGUARD_CACHE_DISK_MAX_BYTES", 2 * 1024 * 1024 * 1024)
+
+# Фоновые задачи (/jobs)
+JOB_WORKERS = _env_int("GOSTGUARD_JOB_WORKERS", 4)
+JOB_MAX_PENDING = _env_int("GOSTGUARD_JOB_MAX_PENDING", 64)
+JOB_MAX_FINISHED = _env_int("GOSTGUARD_JOB_MAX_FINISHED", 256)
+# Состояние задач /jobs в общей базе (каталог RESULT_STORE_DIR): статус, события и отмена - из любого воркера.
+# Без нее gunicorn запускается с одним воркером
+JOB_STORE = _env_str("GOSTGUARD_JOB_STORE", "1").lower() in ("1", "true", "yes")
+
+# Нарезанный инференс в родном разрешении (для крупных сканов)
+TILED_INFERENCE = _env_str("GOSTGUARD_TILED_INFERENCE", "0").lower() in ("1", "true", "yes")
+TILE_SIZE = _env_int("GOSTGUARD_TILE_SIZE", 1024)
+TILE_OVERLAP = _env_float("GOSTGUARD_TILE_OVERLAP", 0.2)
+# Плитки листа батчит планировщик инференса (INFERENCE_MAX_BATCH_SIZE) вместе с другими запросами
+TILE_MERGE = _env_str("GOSTGUARD_TILE_MERGE", "nms")  # nms или wbf
+
+# Каскадный инференс: пограничные по допускам детекции перепроверяются по окнам в родном разрешении
+CASCADE_INFERENCE = _env_str("GOSTGUARD_CASCADE_INFERENCE", "0").lower() in ("1", "true", "yes")
+CASCADE_MARGIN_MM = _env_float("GOSTGUARD_CASCADE_MARGIN_MM", 0.0) or None  # близость к границе, 0 - по масштабу
+CASCADE_CROP_SIZE = _env_int("GOSTGUARD_CASCADE_CROP_SIZE", 256)  # окно и вход модели, px
+CASCADE_MATCH_IOU = _env_float("GOSTGUARD_CASCADE_MATCH_IOU", 0.3)  # совпадение бокса в окне с исходным
+
+# Отдача изображений результата
+TRANSPORT_MODE = _env_str("GOSTGUARD_TRANSPORT_MODE", "base64")  # base64, binary или overlay
+TRANSPORT_DEFAULT_FORMAT = _env_str("GOSTGUARD_TRANSPORT_FORMAT", "png")  # webp, jpeg или png
+TRANSPORT_CACHE_MAX_AGE = _env_int("GOSTGUARD_TRANSPORT_CACHE_MAX_AGE", 24 * 60 * 60)
+PREVIEW_MAX_SIDE = _env_int("GOSTGUARD_PREVIEW_MAX_SIDE", 1024)
+RESULT_IMAGES_MAX_BYTES = _env_int("GOSTGUARD_RESULT_IMAGES_MAX_BYTES", 512 * 1024 * 1024)
+
+# Хранилище результатов: отчеты и история в SQLite, изображения и миниатюры - блобы по хешу содержимого.
+# Каталог общий для всех воркеров. Включается явно: запись кодирует картинки каждой проверки
+# (в overlay-режиме хранится только слой, картинка рисуется при первом запросе)
+RESULT_STORE = _env_str("GOSTGUARD_RESULT_STORE", "0").lower() in ("1", "true", "yes")
+RESULT_STORE_DIR = _env_str("GOSTGUARD_RESULT_STORE_DIR",
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), "result_store"))
+RESULT_STORE_MAX_BYTES = _env_int("GOSTGUARD_RESULT_STORE_MAX_BYTES", 10 * 1024 * 1024 * 1024)  # 0 - без предела
+RESULT_STORE_MAX_AGE_DAYS = _env_float("GOSTGUARD_RESULT_STORE_MAX_AGE_DAYS", 90.0)  # 0 - без предела
+RESULT_STORE_THUMBNAIL_SIZES = [int(size) for size in
+                                _env_str("GOSTGUARD_RESULT_STORE_THUMBNAIL_SIZES", "256").split(",") if size.strip()]
+RESULT_STORE_THUMBNAIL_FORMAT = _env_str("GOSTGUARD_RESULT_STORE_THUMBNAIL_FORMAT", "webp")
+RESULT_STORE_IMAGE_FORMAT = _env_str("GOSTGUARD_RESULT_STORE_IMAGE_FORMAT", "png")
+RESULT_STORE_MAX_PENDING = _env_int("GOSTGUARD_RESULT_STORE_MAX_PENDING", 8)  # очередь записи, сверх нее - отброс
+
+# Пакетная проверка наборов листов (/upload_batch)
+BATCH_MAX_IN_FLIGHT = _env_int("GOSTGUARD_BATCH_MAX_IN_FLIGHT", 4)
+BATCH_PDF_DPI = _env_int("GOSTGUARD_BATCH_PDF_DPI", 200)
+
+# Отчеты Word
+REPORT_IMAGE_DPI = _env_int("GOSTGUARD_REPORT_IMAGE_DPI", 200)  # 0 - изображение без уменьшения
+
+# Сервер (gunicorn.conf.py и встроенный сервер Flask)
+SERVER_BIND = _env_str("GOSTGUARD_BIND", "0.0.0.0:5000")
+SERVER_WORKERS = _env_int("GOSTGUARD_WORKERS", 0)  # 0 - по числу ядер
+SERVER_PRELOAD = _env_str("GOSTGUARD_PRELOAD", "0").lower() in ("1", "true", "yes")
+SERVER_MAX_CONCURRENT = _env_int("GOSTGUARD_MAX_CONCURRENT", 4)  # тяжелых запросов на воркер
+SERVER_MAX_QUEUE = _env_int("GOSTGUARD_MAX_QUEUE", 8)  # ожидающих сверх этого - сразу 503
+SERVER_QUEUE_TIMEOUT_S = _env_float("GOSTGUARD_QUEUE_TIMEOUT_S", 30.0)
+SERVER_RETRY_AFTER_S = _env_int("GOSTGUARD_RETRY_AFTER_S", 5)
+SERVER_DRAIN_TIMEOUT_S = _env_float("GOSTGUARD_DRAIN_TIMEOUT_S", 60.0)
+SERVER_TIMEOUT_S = _env_int("GOSTGUARD_TIMEOUT_S", 300)
+DEBUG = _env_str("GOSTGUARD_DEBUG", "0").lower() in ("1", "true", "yes")
+
+# Наблюдаемость
+REQUEST_LOG = _env_str("GOSTGUARD_REQUEST_LOG", "1").lower() in ("1", "true", "yes")  # JSON-строка на проверку
+
+# Инкрементальная перепроверка новых версий листа в той же сессии
+INCREMENTAL_CHECK = _env_str("GOSTGUARD_INCREMENTAL", "1").lower() in ("1", "true", "yes")
+INCREMENTAL_CELL_SIZE = _env_int("GOSTGUARD_INCREMENTAL_CELL_SIZE", 128)
+INCREMENTAL_PIXEL_THRESHOLD = _env_int("GOSTGUARD_INCREMENTAL_PIXEL_THRESHOLD", 48)
+INCREMENTAL_CONTEXT_PX = _env_int("GOSTGUARD_INCREMENTAL_CONTEXT_PX", 64)
+INCREMENTAL_MAX_CHANGED = _env_float("GOSTGUARD_INCREMENTAL_MAX_CHANGED", 0.5)  # доля листа
+INCREMENTAL_MAX_REGIONS = _env_int("GOSTGUARD_INCREMENTAL_MAX_REGIONS", 32)  # больше - проверка целиком
+INCREMENTAL_SESSIONS_MAX_BYTES = _env_int("GOSTGUARD_INCREMENTAL_SESSIONS_MAX_BYTES", 256 * 1024 * 1024)
+
+# Крупные сканы: пределы и режим с ограниченной памятью
+MAX_UPLOAD_BYTES = _env_int("GOSTGUARD_MAX_UPLOAD_BYTES", 256 * 1024 * 1024)  # тело /upload, 0 - без предела
+MAX_BATCH_UPLOAD_BYTES = _env_int("GOSTGUARD_MAX_BATCH_UPLOAD_BYTES", 2 * 1024 * 1024 * 1024)  # /upload_batch
+UPLOAD_SPOOL_BYTES = _env_int("GOSTGUARD_UPLOAD_SPOOL_BYTES", 8 * 1024 * 1024)  # больше - файл на диске
+MAX_IMAGE_PIXELS = _env_int("GOSTGUARD_MAX_IMAGE_PIXELS", 600_000_000)  # после декодирования, 0 - без предела
+LARGE_IMAGE_PIXELS = _env_int("GOSTGUARD_LARGE_IMAGE_PIXELS", 40_000_000)  # больше - режим крупного скана
+LARGE_IMAGE_WORK_SIDE = _env_int("GOSTGUARD_LARGE_IMAGE_WORK_SIDE", 4096)  # рабочая копия, px
+LARGE_IMAGE_DIR = _env_str("GOSTGUARD_LARGE_IMAGE_DIR", "")  # пусто - системный временный каталог
+RSS_SAMPLE_INTERVAL_MS = _env_float("GOSTGUARD_RSS_SAMPLE_INTERVAL_MS", 100.0)  # опрос пика RSS процесса за запрос, 0 - выкл.
+
+# Этапы проверки (граф зависимостей) и отмена
+PIPELINE_STAGE_WORKERS = _env_int("GOSTGUARD_PIPELINE_STAGE_WORKERS", 8)  # потоков этапов на процесс
+STAGE_TIMEOUTS = {  # секунды с постановки этапа в пул (включая ожидание потока), 0 - без ограничения
+    'frame_check': _env_float("GOSTGUARD_FRAME_TIMEOUT_S", 30.0) or None,
+    'detection': _env_float("GOSTGUARD_DETECTION_TIMEOUT_S", 120.0) or None,
+    'final_image': _env_float("GOSTGUARD_RENDER_TIMEOUT_S", 60.0) or None,
+}
+DISCONNECT_POLL_S = _env_float("GOSTGUARD_DISCONNECT_POLL_S", 0.5)  # проверка отключения клиента /upload
+
+# Теневая проверка модели-кандидата на части трафика /upload и /jobs
+SHADOW_MODEL_PATH = _env_str("GOSTGUARD_SHADOW_MODEL_PATH", "")  # пусто - выключено
+SHADOW_BACKEND = _env_str("GOSTGUARD_SHADOW_BACKEND", INFERENCE_BACKEND)
+SHADOW_SAMPLE_RATE = _env_float("GOSTGUARD_SHADOW_SAMPLE_RATE", 0.1)  # доля проверок
+SHADOW_MAX_PENDING = _env_int("GOSTGUARD_SHADOW_MAX_PENDING", 2)  # сверх очереди образцы отбрасываются
+SHADOW_IOU = _env_float("GOSTGUARD_SHADOW_IOU", 0.5)  # порог IoU при сопоставлении детекций и нарушений
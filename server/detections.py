@@ -0,0 +1,84 @@
+import numpy as np
+
+# Классы модели
+CLS_ARROW = 0
+CLS_OBJECT = 1
+CLS_TEXT = 2
+
+# Размер входа модели по умолчанию
+DEFAULT_IMGSZ = 640
+
+
+def _to_numpy(values):
+    """Тензор ultralytics (.cpu().numpy()) или уже numpy-массив"""
+    return values.cpu().numpy() if hasattr(values, 'cpu') else np.asarray(values)
+
+
+class Detections:
+    """
+    Результат одного прохода детектора по чертежу.
+    Считается один раз на запрос и передается во все проверки и в отрисовку.
+    """
+
+    def __init__(self, boxes, classes, confidences=None):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.classes = np.asarray(classes, dtype=np.int64).reshape(-1)
+        if confidences is None:
+            confidences = np.ones(len(self.classes), dtype=np.float32)
+        self.confidences = np.asarray(confidences, dtype=np.float32).reshape(-1)
+
+        # Разбиваем по классам один раз
+        self.arrows = self.boxes[self.classes == CLS_ARROW]
+        self.objects = self.boxes[self.classes == CLS_OBJECT]
+        self.texts = self.boxes[self.classes == CLS_TEXT]
+
+    @classmethod
+    def from_results(cls, results):
+        """Из результата model.predict (ultralytics или inference_backends)"""
+        result_boxes = results[0].boxes
+        return cls(
+            _to_numpy(result_boxes.xyxy),
+            _to_numpy(result_boxes.cls),
+            _to_numpy(result_boxes.conf),
+        )
+
+    def of_class(self, cls_id):
+        """Боксы одного класса"""
+        return self.boxes[self.classes == cls_id]
+
+    def confidences_of_class(self, cls_id):
+        """Уверенности для боксов одного класса"""
+        return self.confidences[self.classes == cls_id]
+
+    def scaled(self, factor):
+        """Те же детекции в координатах изображения, увеличенного в factor раз"""
+        return Detections(self.boxes * np.float32(factor), self.classes, self.confidences)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __repr__(self):
+        return (f"Detections(arrows={len(self.arrows)}, objects={len(self.objects)}, "
+                f"texts={len(self.texts)})")
+
+
+def detect(image: np.ndarray, model, imgsz=DEFAULT_IMGSZ, cancel=None):
+    """
+    Один прогон модели по изображению.
+    cancel - флаг отмены для ожидания в InferenceScheduler (модель должна принимать cancel)
+    """
+    kwargs = {'cancel': cancel} if cancel is not None else {}
+    results = model.predict(image, imgsz=imgsz, **kwargs)
+    return Detections.from_results(results)
+
+
+def ensure_detections(image, model, detections=None):
+    """
+    Совместимость со старыми сигнатурами: если детекции не переданы,
+    считаем их сами по модели.
+    """
+    if detections is not None:
+        return detections
+    if model is None:
+        raise ValueError("Нужна модель или готовые детекции")
+    return detect(np.asarray(image), model)
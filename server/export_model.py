@@ -0,0 +1,109 @@
+"""
+Экспорт best.pt для других сред выполнения (см. GOSTGUARD_INFERENCE_BACKEND).
+
+    python export_model.py --format onnx
+    python export_model.py --format onnx --int8
+    python export_model.py --format openvino --int8
+
+INT8-квантование калибруется на образцах чертежей (по умолчанию ../application/image).
+Файлы называются так, как их ищет inference_backends.default_model_path.
+"""
+import argparse
+import glob
+import os
+import shutil
+
+import numpy as np
+from PIL import Image
+
+import config
+from detections import DEFAULT_IMGSZ
+from inference_backends import default_model_path, preprocess
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CALIBRATION_DIR = os.path.join(SERVER_DIR, '..', 'application', 'image')
+
+
+def calibration_batches(image_dir, imgsz):
+    """Образцы в том же виде, в каком их видит модель (letterbox, NCHW, 0..1)"""
+    paths = sorted(glob.glob(os.path.join(image_dir, '*.png')) + glob.glob(os.path.join(image_dir, '*.jpg')))
+    if not paths:
+        raise FileNotFoundError(f"Нет образцов для калибровки в {image_dir}")
+    for path in paths:
+        image = np.asarray(Image.open(path).convert("RGB"))
+        batch, _ = preprocess([image], imgsz)
+        yield batch
+
+
+def export_onnx(model_path, imgsz, int8, calibration_dir):
+    from ultralytics import YOLO
+
+    # Динамический батч нужен планировщику инференса, динамический размер - плиткам
+    exported = YOLO(model_path).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+    target = default_model_path('onnx', model_path)
+    if os.path.abspath(exported) != os.path.abspath(target):
+        shutil.move(exported, target)
+    if not int8:
+        return target
+
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            import onnxruntime as ort
+            self.input_name = ort.InferenceSession(target).get_inputs()[0].name
+            self.batches = calibration_batches(calibration_dir, imgsz)
+
+        def get_next(self):
+            batch = next(self.batches, None)
+            return None if batch is None else {self.input_name: batch}
+
+    int8_target = default_model_path('onnx', model_path, int8=True)
+    quantize_static(target, int8_target, Reader(), quant_format=QuantFormat.QDQ,
+                    per_channel=True, activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    return int8_target
+
+
+def export_openvino(model_path, imgsz, int8, calibration_dir):
+    from ultralytics import YOLO
+
+    exported = YOLO(model_path).export(format='openvino', imgsz=imgsz, dynamic=True)
+    target = default_model_path('openvino', model_path)
+    if os.path.abspath(exported) != os.path.abspath(target):
+        shutil.rmtree(target, ignore_errors=True)
+        shutil.move(exported, target)
+    if not int8:
+        return target
+
+    import nncf
+    import openvino as ov
+
+    core = ov.Core()
+    xml = [name for name in os.listdir(target) if name.endswith('.xml')][0]
+    model = core.read_model(os.path.join(target, xml))
+    batches = list(calibration_batches(calibration_dir, imgsz))
+    quantized = nncf.quantize(model, nncf.Dataset(batches), preset=nncf.QuantizationPreset.MIXED,
+                              subset_size=len(batches))
+
+    int8_target = default_model_path('openvino', model_path, int8=True)
+    os.makedirs(int8_target, exist_ok=True)
+    ov.save_model(quantized, os.path.join(int8_target, xml))
+    return int8_target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--format', choices=('onnx', 'openvino'), required=True)
+    parser.add_argument('--model', default=config.MODEL_PATH, help='исходные веса (.pt)')
+    parser.add_argument('--imgsz', type=int, default=DEFAULT_IMGSZ)
+    parser.add_argument('--int8', action='store_true', help='дополнительно INT8-квантование')
+    parser.add_argument('--calibration-dir', default=DEFAULT_CALIBRATION_DIR)
+    args = parser.parse_args()
+
+    export = export_onnx if args.format == 'onnx' else export_openvino
+    path = export(args.model, args.imgsz, args.int8, args.calibration_dir)
+    print(f"Готово: {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,25 @@
 import base64
+import copy
+import threading
 
 from docx import Document
 from docx.shared import Inches
 from docx.enum.text import WD_ALIGN_PARAGRAPH
-import tempfile
-import os
 from io import BytesIO
+from PIL import Image
 
+# Ширина изображения в отчете, дюймы
+REPORT_IMAGE_WIDTH_IN = 5.0
+# Разрешение уменьшенной копии изображения под эту ширину (0 - вставлять как есть)
+REPORT_IMAGE_DPI = 200
 
-def generate_word_report(drawing_id, filename, check_result, image_base64, created_at):
-    # Создаем новый документ Word
+# Заготовка отчета: собирается один раз, дальше каждый отчет - ее копия
+_template_bytes = None
+_template_lock = threading.Lock()
+
+
+def _build_template():
+    """Общая часть всех отчетов: заголовки и таблица с подписями полей"""
     doc = Document()
 
     # Заголовок отчета (кириллица работает идеально!)
@@ -21,23 +31,58 @@ def generate_word_report(drawing_id, filename, check_result, image_base64, creat
 
     # Создаем таблицу для информации
     info_table = doc.add_table(rows=4, cols=2)
-
-    # Заполняем таблицу
     info_table.cell(0, 0).text = 'ID чертежа:'
-    info_table.cell(0, 1).text = str(drawing_id)
-
     info_table.cell(1, 0).text = 'Название файла:'
-    info_table.cell(1, 1).text = filename
-
     info_table.cell(2, 0).text = 'Дата проверки:'
-    info_table.cell(2, 1).text = created_at
-
     info_table.cell(3, 0).text = 'Статус:'
     info_table.cell(3, 1).text = 'Проверен'
 
     # Добавляем раздел с результатами проверки
     doc.add_heading('Результат проверки', level=1)
 
+    buffer = BytesIO()
+    doc.save(buffer)
+    return buffer.getvalue()
+
+
+def _new_document():
+    """Копия заготовки отчета (заготовка собирается при первом вызове)"""
+    global _template_bytes
+    if _template_bytes is None:
+        with _template_lock:
+            if _template_bytes is None:
+                _template_bytes = _build_template()
+    return Document(BytesIO(_template_bytes))
+
+
+def _image_stream(image=None, image_base64=None, image_dpi=REPORT_IMAGE_DPI):
+    """
+    PNG изображения в памяти для add_picture.
+    image_base64 (прислал клиент) вставляется как есть, без перекодирования.
+    image (PIL, уже на сервере) при image_dpi > 0 уменьшается под ширину в отчете.
+    """
+    if image is None:
+        return BytesIO(base64.b64decode(image_base64))
+
+    max_width = int(REPORT_IMAGE_WIDTH_IN * image_dpi)
+    if image_dpi and image.width > max_width:
+        height = max(1, round(image.height * max_width / image.width))
+        image = image.resize((max_width, height), Image.LANCZOS, reducing_gap=2.0)
+
+    buffered = BytesIO()
+    image.save(buffered, format="PNG", compress_level=3)
+    buffered.seek(0)
+    return buffered
+
+
+def _fill_report(doc, info_table, drawing_id, filename, check_result, created_at,
+                 image=None, image_base64=None, image_dpi=REPORT_IMAGE_DPI):
+    """Заполняет одну копию заготовки данными чертежа"""
+    # Заполняем таблицу
+    info_table.cell(0, 1).text = str(drawing_id)
+    info_table.cell(1, 1).text = filename
+    info_table.cell(2, 1).text = created_at or ''
+
     # Добавляем текст результата с сохранением переносов строк
     result_paragraph = doc.add_paragraph()
     lines = check_result.split('\n')
@@ -48,22 +93,13 @@ def generate_word_report(drawing_id, filename, check_result, image_base64, creat
         result_paragraph.add_run(line)
 
     # Добавляем обработанное изображение если есть
-    if image_base64:
+    if image is not None or image_base64:
         try:
             doc.add_heading('Обработанное изображение', level=1)
 
-            # Декодируем base64 и сохраняем во временный файл
-            image_data = base64.b64decode(image_base64)
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as temp_file:
-                temp_file.write(image_data)
-                temp_file_path = temp_file.name
-
-            # Добавляем изображение в документ
-            doc.add_picture(temp_file_path, width=Inches(5.0))
-
-            # Удаляем временный файл
-            os.unlink(temp_file_path)
+            # Изображение вставляется прямо из памяти, без временного файла
+            doc.add_picture(_image_stream(image, image_base64, image_dpi),
+                            width=Inches(REPORT_IMAGE_WIDTH_IN))
 
             # Добавляем подпись к изображению
             caption = doc.add_paragraph()
@@ -74,9 +110,47 @@ def generate_word_report(drawing_id, filename, check_result, image_base64, creat
             error_para = doc.add_paragraph()
             error_para.add_run(f'Ошибка при добавлении изображения: {str(e)}')
 
+
+def _save(doc):
     # Сохраняем документ в buffer
     buffer = BytesIO()
     doc.save(buffer)
     buffer.seek(0)
-
-    return buffer
\ No newline at end of file
+    return buffer
+
+
+def generate_word_report(drawing_id, filename, check_result, image_base64=None, created_at=None,
+                         image=None, image_dpi=REPORT_IMAGE_DPI):
+    """
+    Отчет по одному чертежу.
+    Изображение - image (PIL, уже на сервере) или image_base64 (прислал клиент).
+    """
+    doc = _new_document()
+    _fill_report(doc, doc.tables[0], drawing_id, filename, check_result, created_at,
+                 image=image, image_base64=image_base64, image_dpi=image_dpi)
+    return _save(doc)
+
+
+def generate_bulk_word_report(drawings, image_dpi=REPORT_IMAGE_DPI):
+    """
+    Один .docx на весь набор чертежей, каждый с новой страницы.
+    drawings - словари с полями generate_word_report
+    (drawing_id, filename, check_result, created_at, image или image_base64).
+    """
+    doc = _new_document()
+    body = doc.element.body
+    # Разделы заготовки, которые повторяются для каждого следующего чертежа
+    scaffold = [element for element in body if element is not body.sectPr]
+    scaffold = [copy.deepcopy(element) for element in scaffold]
+
+    for i, drawing in enumerate(drawings):
+        if i > 0:
+            doc.add_page_break()
+            for element in scaffold:
+                body.sectPr.addprevious(copy.deepcopy(element))
+        _fill_report(doc, doc.tables[-1], drawing['drawing_id'], drawing['filename'],
+                     drawing['check_result'], drawing.get('created_at'),
+                     image=drawing.get('image'), image_base64=drawing.get('image_base64'),
+                     image_dpi=image_dpi)
+
+    return _save(doc)
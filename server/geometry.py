@@ -0,0 +1,122 @@
+import numpy as np
+
+# Сколько стрелок обрабатывать за раз при расчете матрицы расстояний,
+# чтобы матрица arrows × objects не разрасталась на плотных чертежах
+DISTANCE_CHUNK_SIZE = 2048
+
+
+def box_centers(boxes):
+    """Центры боксов (N, 4) → (N, 2)"""
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+
+
+def box_widths(boxes):
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return boxes[:, 2] - boxes[:, 0]
+
+
+def box_heights(boxes):
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    return boxes[:, 3] - boxes[:, 1]
+
+
+def box_max_sides(boxes):
+    """Наибольшая сторона каждого бокса"""
+    return np.maximum(box_widths(boxes), box_heights(boxes))
+
+
+def box_iou(boxes_a, boxes_b):
+    """Матрица IoU (N, M) между двумя наборами боксов"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    ix = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    iy = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    inter = ix * iy
+    union = (box_widths(a) * box_heights(a))[:, None] + (box_widths(b) * box_heights(b))[None, :] - inter
+    return inter / np.maximum(union, 1e-6)
+
+
+def nearest_neighbors(points, targets, chunk_size=DISTANCE_CHUNK_SIZE):
+    """
+    Ближайшая цель для каждой точки.
+    Возвращает (индексы, расстояния); если целей нет - индексы -1, расстояния inf.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    targets = np.asarray(targets, dtype=np.float64).reshape(-1, 2)
+
+    indices = np.full(len(points), -1, dtype=np.int64)
+    distances = np.full(len(points), np.inf, dtype=np.float64)
+    if len(points) == 0 or len(targets) == 0:
+        return indices, distances
+
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size]
+        dx = chunk[:, 0, None] - targets[None, :, 0]
+        dy = chunk[:, 1, None] - targets[None, :, 1]
+        dist_sq = dx * dx + dy * dy
+        nearest = np.argmin(dist_sq, axis=1)  # при равенстве - первый, как в цикле
+        indices[start:start + chunk_size] = nearest
+        distances[start:start + chunk_size] = np.sqrt(dist_sq[np.arange(len(chunk)), nearest])
+
+    return indices, distances
+
+
+def rank_within_groups(groups, keys):
+    """
+    Порядковый номер элемента внутри своей группы при сортировке по keys
+    (устойчивая сортировка: при равенстве раньше идет меньший индекс).
+    """
+    groups = np.asarray(groups)
+    order = np.lexsort((keys, groups))
+    ranks = np.empty(len(groups), dtype=np.int64)
+    if len(groups) == 0:
+        return ranks
+    sorted_groups = groups[order]
+    group_start = np.r_[True, sorted_groups[1:] != sorted_groups[:-1]]
+    start_positions = np.maximum.accumulate(np.where(group_start, np.arange(len(order)), 0))
+    ranks[order] = np.arange(len(order)) - start_positions
+    return ranks
+
+
+class ArrowMatches:
+    """Привязка стрелок к ближайшим объектам"""
+
+    def __init__(self, object_idx, distance_px, order, arrow_centers, object_centers):
+        self.object_idx = object_idx      # индекс объекта или -1
+        self.distance_px = distance_px    # расстояние между центрами
+        self.order = order                # номер стрелки в своей группе по расстоянию
+        self.arrow_centers = arrow_centers
+        self.object_centers = object_centers
+
+    @property
+    def matched(self):
+        return self.object_idx >= 0
+
+    def ordered_indices(self):
+        """
+        Индексы сопоставленных стрелок в порядке: группы по первому появлению,
+        внутри группы - по расстоянию
+        """
+        matched = np.flatnonzero(self.matched)
+        if len(matched) == 0:
+            return matched
+        groups = self.object_idx[matched]
+        # Номер группы = позиция первого появления объекта среди стрелок
+        unique_groups, first_seen = np.unique(groups, return_index=True)
+        group_rank = np.empty(groups.max() + 1, dtype=np.int64)
+        group_rank[unique_groups] = first_seen
+        return matched[np.lexsort((matched, self.distance_px[matched], group_rank[groups]))]
+
+
+def match_arrows_to_objects(arrows, objects, chunk_size=DISTANCE_CHUNK_SIZE):
+    """Каждая стрелка привязывается к объекту с ближайшим центром"""
+    arrow_centers = box_centers(arrows)
+    object_centers = box_centers(objects)
+    object_idx, distance_px = nearest_neighbors(arrow_centers, object_centers, chunk_size)
+
+    order = np.full(len(object_idx), -1, dtype=np.int64)
+    matched = object_idx >= 0
+    order[matched] = rank_within_groups(object_idx[matched], distance_px[matched])
+
+    return ArrowMatches(object_idx, distance_px, order, arrow_centers, object_centers)
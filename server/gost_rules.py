@@ -0,0 +1,267 @@
+"""
+Правила ГОСТ как данные и их проверка за один векторный проход.
+
+Все детекции страницы собираются в одну таблицу по столбцам (класс, бокс,
+размеры в мм, группа и порядок стрелки). Правило - строка данных: стандарт,
+класс, столбец-метрика, цель и допуск, необязательное условие на другой
+столбец. evaluate проверяет все правила сразу, матрицей правила × строки.
+
+Новое правило (например, типы линий по ГОСТ 2.303) - это новая строка в RULES
+и, если нужно, новый столбец в DetectionTable; лишних проходов по детекциям
+и по изображению оно не добавляет.
+"""
+import numpy as np
+
+from detections import CLS_ARROW, CLS_TEXT
+from geometry import box_widths, box_heights, match_arrows_to_objects, rank_within_groups
+
+# ИСПРАВЛЕННЫЙ КОЭФФИЦИЕНТ - более реалистичный
+PX_TO_MM = 0.15  # 1px = 0.15mm (вместо 0.36 при dpi=70)
+
+# Строки таблицы полей рамки - стороны листа, а не детекции
+CLS_FRAME_SIDE = -1
+FRAME_SIDES = ('left', 'top', 'right', 'bottom')
+
+
+class Rule:
+    """
+    Одно правило: значение столбца metric у строк класса cls должно быть
+    в пределах target ± tolerance (границы включаются).
+    where = (столбец, от, до) - правило действует только на эти строки.
+    check - тип проверки (раздел отчета и цвет разметки у клиента).
+    message / ok_message / label - шаблоны текста нарушения, нормы и подписи
+    (поля: index, value, target, tolerance, lo, hi, diff, ordinal и переданные проверкой).
+    """
+
+    def __init__(self, id, standard, check, cls, metric, target, tolerance, where=None, message='',
+                 ok_message=None, label=''):
+        self.id = id
+        self.standard = standard
+        self.check = check
+        self.cls = cls
+        self.metric = metric
+        self.target = target
+        self.tolerance = tolerance
+        self.where = where
+        self.message = message
+        self.ok_message = ok_message
+        self.label = label
+
+    @property
+    def lo(self):
+        return self.target - self.tolerance
+
+    @property
+    def hi(self):
+        return self.target + self.tolerance
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+# Правила по детекциям
+RULES = (
+    Rule('arrow_head_size', 'ГОСТ 2.307-68', 'arrow_heads', CLS_ARROW, 'max_side_mm', 4.0, 1.0,
+         message="Наконечник {index} ({value:.1f} мм) не соответствует ГОСТ 2.307-68 (4-5 мм)",
+         label="Стрелка {index}"),
+    # Первая стрелка - 10±2 мм, последующие - 7±2 мм
+    Rule('arrow_first_distance', 'ГОСТ 2.307-68', 'arrow_distances', CLS_ARROW, 'distance_mm', 10.0, 2.0, where=('order', 0, 0),
+         message="{ordinal} стрелка {index}: расстояние {value:.1f} мм вне диапазона {lo}-{hi} мм",
+         ok_message="{ordinal} стрелка {index}: расстояние {value:.1f} мм - норма",
+         label="Стрелка {index}"),
+    Rule('arrow_next_distance', 'ГОСТ 2.307-68', 'arrow_distances', CLS_ARROW, 'distance_mm', 7.0, 2.0, where=('order', 1, np.inf),
+         message="{ordinal} стрелка {index}: расстояние {value:.1f} мм вне диапазона {lo}-{hi} мм",
+         ok_message="{ordinal} стрелка {index}: расстояние {value:.1f} мм - норма",
+         label="Стрелка {index}"),
+    Rule('text_height', 'ГОСТ 2.304-81', 'text', CLS_TEXT, 'height_mm', 3.5, 0.5,
+         message="Текст {index} ({value:.1f} мм) не соответствует {target} мм ±{tolerance}мм",
+         label="Текст {index}"),
+)
+
+# Поля рамки, мм (погрешность ±0.6 мм)
+FRAME_TOLERANCE_MM = 0.6
+_FRAME_MESSAGE = ": {value:.2f} мм (отклонение {diff:.2f} мм, требуется {target} мм ±{tolerance} мм)"
+FRAME_RULES = (
+    Rule('frame_left', 'ГОСТ 2.301-68', 'frame', CLS_FRAME_SIDE, 'margin_mm', 20, FRAME_TOLERANCE_MM,
+         where=('side', 0, 0), message="Слева" + _FRAME_MESSAGE, label="Слева"),
+    Rule('frame_top', 'ГОСТ 2.301-68', 'frame', CLS_FRAME_SIDE, 'margin_mm', 5, FRAME_TOLERANCE_MM,
+         where=('side', 1, 1), message="Сверху" + _FRAME_MESSAGE, label="Сверху"),
+    Rule('frame_right', 'ГОСТ 2.301-68', 'frame', CLS_FRAME_SIDE, 'margin_mm', 5, FRAME_TOLERANCE_MM,
+         where=('side', 2, 2), message="Справа" + _FRAME_MESSAGE, label="Справа"),
+    Rule('frame_bottom', 'ГОСТ 2.301-68', 'frame', CLS_FRAME_SIDE, 'margin_mm', 5, FRAME_TOLERANCE_MM,
+         where=('side', 3, 3), message="Снизу" + _FRAME_MESSAGE, label="Снизу"),
+)
+
+
+class DetectionTable:
+    """
+    Таблица строк страницы по столбцам (словарь имя → массив одной длины).
+    boxes - боксы строк в пикселях (для разметки и отчета).
+    """
+
+    def __init__(self, columns, boxes, matches=None):
+        self.columns = columns
+        self.boxes = boxes
+        # Привязка стрелок к объектам (нужна проверке расстояний для порядка вывода)
+        self.matches = matches
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def rows_of_class(self, cls_id):
+        """Номера строк класса в порядке детекций (i-я строка - i-й бокс класса)"""
+        return np.flatnonzero(self.columns['cls'] == cls_id)
+
+    @classmethod
+    def from_detections(cls, detections, px_to_mm=PX_TO_MM):
+        boxes = detections.boxes
+        classes = detections.classes
+        n = len(boxes)
+
+        width_mm = box_widths(boxes) * px_to_mm
+        height_mm = box_heights(boxes) * px_to_mm
+
+        # Группа (объект), порядок и расстояние считаются только для стрелок
+        group = np.full(n, -1, dtype=np.int64)
+        order = np.full(n, -1, dtype=np.int64)
+        distance_mm = np.full(n, np.nan)
+        arrow_rows = np.flatnonzero(classes == CLS_ARROW)
+        matches = match_arrows_to_objects(detections.arrows, detections.objects)
+        group[arrow_rows] = matches.object_idx
+        order[arrow_rows] = matches.order
+        distance_mm[arrow_rows] = matches.distance_px * px_to_mm
+
+        columns = {
+            'cls': classes,
+            'index': rank_within_groups(classes, np.arange(n)),
+            'width_mm': width_mm,
+            'height_mm': height_mm,
+            'max_side_mm': np.maximum(width_mm, height_mm),
+            'group': group,
+            'order': order,
+            'distance_mm': distance_mm,
+        }
+        return cls(columns, boxes, matches)
+
+    @classmethod
+    def from_frame(cls, margins_mm, frame_box):
+        """Четыре строки - поля рамки слева, сверху, справа, снизу"""
+        sides = np.arange(len(FRAME_SIDES))
+        columns = {
+            'cls': np.full(len(sides), CLS_FRAME_SIDE),
+            'index': sides,
+            'side': sides,
+            'margin_mm': np.asarray(margins_mm, dtype=np.float64),
+        }
+        boxes = np.tile(np.asarray(frame_box, dtype=np.float32), (len(sides), 1))
+        return cls(columns, boxes)
+
+
+class RuleEvaluation:
+    """
+    Результат проверки: матрицы правила × строки
+    applicable (правило действует на строку), ok (значение в допуске), values.
+    """
+
+    def __init__(self, table, rules, applicable, ok, values):
+        self.table = table
+        self.rules = rules
+        self.applicable = applicable
+        self.ok = ok
+        self.values = values
+        self._by_id = {rule.id: i for i, rule in enumerate(rules)}
+
+    def rule(self, rule_id):
+        return self.rules[self._by_id[rule_id]]
+
+    def bad_rows(self, rule_id):
+        """Строки с нарушением правила"""
+        i = self._by_id[rule_id]
+        return np.flatnonzero(self.applicable[i] & ~self.ok[i])
+
+    def is_ok(self, rule_id, row):
+        return bool(self.ok[self._by_id[rule_id], row])
+
+    def _fields(self, i, row, fields):
+        rule = self.rules[i]
+        value = self.values[i, row]
+        result = {'index': int(self.table['index'][row]) + 1, 'value': value, 'target': rule.target,
+                  'tolerance': rule.tolerance, 'lo': rule.lo, 'hi': rule.hi, 'diff': abs(value - rule.target)}
+        if 'order' in self.table.columns:
+            order = int(self.table['order'][row])
+            result['ordinal'] = "Первая" if order == 0 else f"{order + 1}-я"
+        result.update(fields)
+        return result
+
+    def message(self, rule_id, row, ok=False, **fields):
+        """Текст нарушения (или нормы) по шаблону правила"""
+        i = self._by_id[rule_id]
+        rule = self.rules[i]
+        template = rule.ok_message if ok else rule.message
+        return template.format(**self._fields(i, row, fields))
+
+    def label(self, rule_id, row, **fields):
+        """Короткая подпись строки для разметки"""
+        i = self._by_id[rule_id]
+        return self.rules[i].label.format(**self._fields(i, row, fields))
+
+    def violations(self):
+        """Все нарушения в структурированном виде (для JSON-отчета)"""
+        result = []
+        for i, row in zip(*np.nonzero(self.applicable & ~self.ok)):
+            rule = self.rules[i]
+            result.append({
+                'rule': rule.id,
+                'check': rule.check,
+                'standard': rule.standard,
+                'index': int(self.table['index'][row]) + 1,
+                'value': round(float(self.values[i, row]), 2),
+                'target': rule.target,
+                'tolerance': rule.tolerance,
+                'box': [round(float(v), 1) for v in self.table.boxes[row]],
+            })
+        return result
+
+
+def evaluate(table, rules=RULES):
+    """Все правила по всем строкам таблицы за один проход"""
+    n = len(table)
+    # Столбцы, которые нужны правилам; '_any' - для правил без условия
+    names = sorted({rule.metric for rule in rules} | {rule.where[0] for rule in rules if rule.where})
+    column_idx = {name: i for i, name in enumerate(names)}
+    data = np.stack([np.asarray(table[name], dtype=np.float64) for name in names] + [np.zeros(n)]) \
+        if names else np.zeros((1, n))
+    any_idx = len(data) - 1
+
+    rule_cls = np.array([rule.cls for rule in rules])
+    metric_idx = np.array([column_idx[rule.metric] for rule in rules], dtype=np.int64)
+    lo = np.array([rule.lo for rule in rules], dtype=np.float64)
+    hi = np.array([rule.hi for rule in rules], dtype=np.float64)
+    where_idx = np.array([column_idx[rule.where[0]] if rule.where else any_idx for rule in rules], dtype=np.int64)
+    where_lo = np.array([rule.where[1] if rule.where else -np.inf for rule in rules], dtype=np.float64)
+    where_hi = np.array([rule.where[2] if rule.where else np.inf for rule in rules], dtype=np.float64)
+
+    # (правила × строки)
+    values = data[metric_idx]
+    conditions = data[where_idx]
+    applicable = ((np.asarray(table['cls'])[None, :] == rule_cls[:, None]) &
+                  (where_lo[:, None] <= conditions) & (conditions <= where_hi[:, None]))
+    ok = (lo[:, None] <= values) & (values <= hi[:, None])
+    return RuleEvaluation(table, rules, applicable, ok, values)
+
+
+def evaluate_detections(detections, rules=RULES, px_to_mm=PX_TO_MM):
+    """Таблица детекций страницы и проверка всех правил по ней"""
+    return evaluate(DetectionTable.from_detections(detections, px_to_mm), rules)
+
+
+def rules_as_data():
+    """Все правила и масштаб - для ключа кеша результатов"""
+    return {
+        'px_to_mm': PX_TO_MM,
+        'rules': [rule.as_dict() for rule in RULES],
+        'frame_rules': [rule.as_dict() for rule in FRAME_RULES],
+    }
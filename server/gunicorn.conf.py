@@ -0,0 +1,79 @@
+"""
+Production-запуск:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+Веса модели загружаются один раз в мастер-процессе до fork (preload_app),
+воркеры делят их память copy-on-write. Сессии ONNX Runtime / OpenVINO,
+потоки torch, планировщик инференса и пул задач создаются в каждом воркере.
+
+Кеши у каждого воркера свои: бюджеты памяти из config умножаются на число
+воркеров. Состояние задач /jobs/<id> и результаты проверок (/results/<id>,
+история /sessions/<id>/results - при GOSTGUARD_RESULT_STORE=1) - в общей базе
+в RESULT_STORE_DIR и доступны из любого воркера. Без общей базы задач (GOSTGUARD_JOB_STORE=0) запрос
+/jobs/<id> попал бы в чужой воркер, поэтому запускается один воркер,
+а явно заданное большее число - ошибка запуска.
+"""
+import multiprocessing
+import os
+import signal
+
+# До импорта config: app при импорте только загружает веса, прогрев - в post_fork
+os.environ.setdefault("GOSTGUARD_PRELOAD", "1")
+
+# (не просто config: gunicorn считает это имя своей настройкой)
+import config as app_config  # noqa: E402
+
+bind = app_config.SERVER_BIND
+if app_config.JOB_STORE:
+    workers = app_config.SERVER_WORKERS or multiprocessing.cpu_count()
+else:
+    workers = app_config.SERVER_WORKERS or 1
+    if workers > 1:
+        raise RuntimeError(f"GOSTGUARD_WORKERS={workers} без GOSTGUARD_JOB_STORE: задачи /jobs/<id> "
+                           f"были бы видны только в принявшем их воркере")
+preload_app = True
+
+# Потоки воркера: тяжелые запросы, их очередь и запас под легкие (stats, картинки)
+worker_class = 'gthread'
+threads = app_config.SERVER_MAX_CONCURRENT + app_config.SERVER_MAX_QUEUE + 2
+
+timeout = app_config.SERVER_TIMEOUT_S
+graceful_timeout = int(app_config.SERVER_DRAIN_TIMEOUT_S)
+
+# Ядра делятся между воркерами, иначе каждый torch/ORT займет все ядра
+if not app_config.INFERENCE_INTRA_OP_THREADS:
+    app_config.INFERENCE_INTRA_OP_THREADS = max(1, multiprocessing.cpu_count() // workers)
+
+
+def post_fork(server, worker):
+    # Веса уже загружены в мастере, прогрев в воркере идет в фоне (до него /readyz - 503)
+    import app
+    app.start_model()
+
+
+def post_worker_init(worker):
+    # SIGTERM (плавная остановка): пока gunicorn доделывает принятые соединения,
+    # воркер уже не готов - /readyz 503, новые проверки и задачи получают 503
+    import app
+    handle_exit = worker.handle_exit
+
+    def drain_then_exit(sig, frame):
+        app.begin_drain()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, drain_then_exit)
+
+
+def worker_int(worker):
+    # SIGINT / SIGQUIT: быстрая остановка, новые запросы не принимаются
+    import app
+    app.begin_drain()
+
+
+def worker_exit(server, worker):
+    # Воркер больше не обслуживает запросы: дожидаемся принятых,
+    # фоновых задач /jobs и записи результатов в хранилище
+    import app
+    if not app.shutdown(timeout=app_config.SERVER_DRAIN_TIMEOUT_S):
+        print(f"Воркер {worker.pid}: не все задачи завершились за {app_config.SERVER_DRAIN_TIMEOUT_S} с")
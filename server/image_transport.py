@@ -0,0 +1,112 @@
+import io
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+# Поддерживаемые форматы: имя → (формат PIL, mimetype)
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+}
+FORMAT_ALIASES = {'jpg': 'jpeg'}
+
+
+def normalize_format(fmt):
+    """Имя формата из запроса → ключ FORMATS (или None, если не поддерживается)"""
+    if not fmt:
+        return None
+    fmt = fmt.lower()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    return fmt if fmt in FORMATS else None
+
+
+def negotiate_format(requested, accept_header, default='png'):
+    """Явный ?format= важнее заголовка Accept"""
+    fmt = normalize_format(requested)
+    if fmt:
+        return fmt
+    accept = (accept_header or '').lower()
+    if 'image/webp' in accept:
+        return 'webp'
+    return default
+
+
+def clamp_quality(fmt, quality):
+    """Качество в допустимых для формата пределах: 0-9 для png, 1-100 для webp/jpeg (None - по умолчанию)"""
+    if quality is None:
+        return None
+    if fmt == 'png':
+        return max(0, min(9, quality))
+    return max(1, min(100, quality))
+
+
+def encode_image(image: Image.Image, fmt='png', quality=None, max_side=None):
+    """
+    Кодирует изображение в нужный формат.
+    quality - качество для webp/jpeg (1-100) или уровень сжатия для png (0-9).
+    max_side - уменьшенное превью по длинной стороне.
+    """
+    pil_format, mimetype = FORMATS[fmt]
+
+    if max_side and max(image.size) > max_side:
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    quality = clamp_quality(fmt, quality)
+    params = {}
+    if fmt == 'png':
+        params['compress_level'] = 6 if quality is None else quality
+    else:
+        params['quality'] = 85 if quality is None else quality
+        if fmt == 'webp':
+            params['method'] = 4
+
+    if fmt == 'jpeg' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    buffered = io.BytesIO()
+    image.save(buffered, format=pil_format, **params)
+    return buffered.getvalue(), mimetype
+
+
+class ResultImageStore:
+    """
+    Аннотированные изображения по id результата, чтобы отдавать их
+    отдельным запросом вместо base64 внутри JSON.
+    LRU в памяти с ограничением по байтам (считаем по несжатым пикселям).
+    """
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(image):
+        return image.width * image.height * len(image.getbands())
+
+    def put(self, result_id, image: Image.Image):
+        size = self._size(image)
+        with self._lock:
+            old = self._items.pop(result_id, None)
+            if old is not None:
+                self._bytes -= self._size(old)
+            self._items[result_id] = image
+            self._bytes += size
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= self._size(evicted)
+
+    def get(self, result_id):
+        with self._lock:
+            image = self._items.get(result_id)
+            if image is not None:
+                self._items.move_to_end(result_id)
+            return image
+
+    def __contains__(self, result_id):
+        with self._lock:
+            return result_id in self._items
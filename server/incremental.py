@@ -0,0 +1,303 @@
+"""
+Инкрементальная перепроверка исправленного чертежа.
+
+Для session_id хранится предыдущая версия листа (серое изображение, рамка,
+детекции). Новая версия выравнивается по рамке, сравнивается с предыдущей
+по ячейкам сетки, и детектор прогоняется только на измененных областях
+(все области - одним вызовом модели на размер входа). Детекции из нетронутых
+областей берутся из предыдущей версии.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from detections import Detections, detect, DEFAULT_IMGSZ
+from tiled_inference import detect_tiled
+
+# Сетка сравнения и чувствительность
+DEFAULT_CELL_SIZE = 128
+DEFAULT_PIXEL_THRESHOLD = 48  # разница яркости, с которой пиксель считается измененным
+MIN_CHANGED_RATIO = 0.002  # доля измененных пикселей, с которой ячейка пересчитывается
+DEFAULT_CONTEXT_PX = 64  # поля вокруг области, чтобы детектор видел объекты на границе целиком
+DEFAULT_MAX_CHANGED = 0.5  # если изменилось больше - проще проверить лист целиком
+DEFAULT_MAX_REGIONS = 32  # больше разрозненных областей - тоже проверка целиком
+
+# Допустимая разница размеров рамки между версиями (иначе другой масштаб скана)
+MAX_FRAME_SCALE_DIFF = 0.01
+
+
+class SessionVersion:
+    """Последняя проверенная версия листа в сессии"""
+
+    def __init__(self, gray, frame_box, detections, result_id, content_key, settings):
+        self.gray = gray
+        self.frame_box = frame_box
+        self.detections = detections
+        self.result_id = result_id
+        self.content_key = content_key  # ключ по пикселям без учета предыдущей версии
+        self.settings = settings  # режим детекции (полный или нарезанный с параметрами)
+
+    @property
+    def nbytes(self):
+        return self.gray.nbytes + self.detections.boxes.nbytes * 2
+
+
+class SessionVersions:
+    """Версии по session_id: LRU в памяти с ограничением по байтам"""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, session_id, version):
+        with self._lock:
+            old = self._items.pop(session_id, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+            self._items[session_id] = version
+            self._bytes += version.nbytes
+            while self._bytes > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= evicted.nbytes
+
+    def get(self, session_id):
+        with self._lock:
+            version = self._items.get(session_id)
+            if version is not None:
+                self._items.move_to_end(session_id)
+            return version
+
+    def stats(self):
+        with self._lock:
+            return {'sessions': len(self._items), 'bytes': self._bytes, 'max_bytes': self.max_bytes}
+
+
+def to_gray(image_np):
+    return cv2.cvtColor(np.asarray(image_np), cv2.COLOR_RGB2GRAY)
+
+
+def frame_offset(previous_box, frame_box):
+    """
+    Сдвиг новой версии относительно предыдущей по рамке (dx, dy)
+    или None, если размер рамки изменился (другой масштаб или формат).
+    """
+    px0, py0, px1, py1 = previous_box
+    x0, y0, x1, y1 = frame_box
+    for prev_side, side in ((px1 - px0, x1 - x0), (py1 - py0, y1 - y0)):
+        if abs(side - prev_side) > MAX_FRAME_SCALE_DIFF * max(prev_side, 1):
+            return None
+    return int(round(x0 - px0)), int(round(y0 - py0))
+
+
+def changed_cells(prev_gray, gray, offset, cell_size=DEFAULT_CELL_SIZE,
+                  pixel_threshold=DEFAULT_PIXEL_THRESHOLD, min_changed_ratio=MIN_CHANGED_RATIO):
+    """
+    Сетка ячеек новой версии: True - ячейка изменилась.
+    Области без пары в предыдущей версии (после сдвига) сравниваются с белым листом.
+    """
+    dx, dy = offset
+    h, w = gray.shape
+    ph, pw = prev_gray.shape
+
+    # Полосы, которых не было в предыдущей версии (после сдвига), сравниваем с чистым листом
+    _, mask = cv2.threshold(cv2.absdiff(gray, 255), pixel_threshold, 1, cv2.THRESH_BINARY)
+    x0, y0 = max(0, dx), max(0, dy)
+    x1, y1 = min(w, pw + dx), min(h, ph + dy)
+    if x1 > x0 and y1 > y0:
+        diff = cv2.absdiff(gray[y0:y1, x0:x1], prev_gray[y0 - dy:y1 - dy, x0 - dx:x1 - dx])
+        # Шум растеризации отсекается порогом яркости и долей пикселей в ячейке
+        _, mask[y0:y1, x0:x1] = cv2.threshold(diff, pixel_threshold, 1, cv2.THRESH_BINARY)
+
+    ys = np.arange(0, h, cell_size)
+    xs = np.arange(0, w, cell_size)
+    counts = np.add.reduceat(np.add.reduceat(mask, ys, axis=0, dtype=np.int64), xs, axis=1, dtype=np.int64)
+    cell_h = np.diff(np.r_[ys, h])[:, None]
+    cell_w = np.diff(np.r_[xs, w])[None, :]
+    return counts > min_changed_ratio * cell_h * cell_w
+
+
+def changed_regions(cells, cell_size, width, height):
+    """
+    Измененные ячейки → прямоугольники (x0, y0, x1, y1) в пикселях:
+    отрезки подряд идущих ячеек в строке сетки, одинаковые отрезки
+    соседних строк склеиваются (без раздувания Г-образных областей).
+    """
+    regions = []
+    open_runs = {}  # (от, до) по столбцам → [строка начала, строка конца]
+    for row in range(cells.shape[0]):
+        padded = np.r_[False, cells[row], False].astype(np.int8)
+        edges = np.flatnonzero(np.diff(padded))
+        runs = set(zip(edges[::2].tolist(), edges[1::2].tolist()))
+        for run in list(open_runs):
+            if run not in runs:
+                regions.append((run, open_runs.pop(run)))
+        for run in runs:
+            open_runs.setdefault(run, [row, row])[1] = row
+    regions.extend(open_runs.items())
+
+    return sorted(
+        (int(c0 * cell_size), int(r0 * cell_size), int(min(width, c1 * cell_size)),
+         int(min(height, (r1 + 1) * cell_size)))
+        for (c0, c1), (r0, r1) in regions
+    )
+
+
+def _centers_inside(boxes, regions):
+    """Центр бокса внутри хотя бы одной из областей"""
+    if len(boxes) == 0 or not regions:
+        return np.zeros(len(boxes), dtype=bool)
+    cx = (boxes[:, 0] + boxes[:, 2]) / 2
+    cy = (boxes[:, 1] + boxes[:, 3]) / 2
+    r = np.asarray(regions, dtype=np.float32)
+    inside = ((r[None, :, 0] <= cx[:, None]) & (cx[:, None] < r[None, :, 2]) &
+              (r[None, :, 1] <= cy[:, None]) & (cy[:, None] < r[None, :, 3]))
+    return inside.any(axis=1)
+
+
+class IncrementalDetector:
+    """
+    Детекция для run_pipeline(detect_fn=...): по измененным областям, если
+    есть подходящая предыдущая версия, иначе по всему листу как обычно.
+    После прогона detections и frame_box описывают новую версию.
+    """
+
+    def __init__(self, model, previous=None, tiling=None, cell_size=DEFAULT_CELL_SIZE,
+                 pixel_threshold=DEFAULT_PIXEL_THRESHOLD, context_px=DEFAULT_CONTEXT_PX,
+                 max_changed=DEFAULT_MAX_CHANGED, max_regions=DEFAULT_MAX_REGIONS):
+        self.model = model
+        self.previous = previous
+        self.tiling = tiling
+        self.cell_size = cell_size
+        self.pixel_threshold = pixel_threshold
+        self.context_px = context_px
+        self.max_changed = max_changed
+        self.max_regions = max_regions
+
+        self.gray = None
+        self.frame_box = None
+        self.detections = None
+
+    def _full(self, image_np, reason=None, cancel=None):
+        if self.tiling:
+            detections, report = detect_tiled(image_np, self.model, cancel=cancel, **self.tiling)
+        else:
+            detections = detect(image_np, self.model, cancel=cancel)
+            report = {'mode': 'full', 'imgsz': DEFAULT_IMGSZ}
+        if reason:
+            report['incremental'] = {'fallback': reason}
+        return detections, report
+
+    def _detect_regions(self, image_np, regions, cancel=None):
+        """
+        Детекция в областях с полями контекста. Масштаб как при проверке листа:
+        в полном режиме - тот же px на вход модели, в нарезанном - родное разрешение.
+        Области одного размера входа уходят в модель одним вызовом (батчи делит планировщик).
+        Возвращает [(боксы, классы, уверенности)] по областям.
+        """
+        h, w = image_np.shape[:2]
+        crops, origins = [], []
+        by_imgsz = {}  # размер входа → номера областей
+        tiled = []
+        for i, (x0, y0, x1, y1) in enumerate(regions):
+            cx0, cy0 = max(0, x0 - self.context_px), max(0, y0 - self.context_px)
+            cx1, cy1 = min(w, x1 + self.context_px), min(h, y1 + self.context_px)
+            crops.append(image_np[cy0:cy1, cx0:cx1])
+            origins.append((cx0, cy0))
+            long_side = max(cy1 - cy0, cx1 - cx0)
+            if self.tiling and long_side > self.tiling['tile_size']:
+                tiled.append(i)
+            else:
+                scale = 1.0 if self.tiling else DEFAULT_IMGSZ / max(h, w)
+                imgsz = max(64, int(np.ceil(long_side * scale / 32)) * 32)
+                by_imgsz.setdefault(imgsz, []).append(i)
+
+        kwargs = {'cancel': cancel} if cancel is not None else {}
+        found = [None] * len(regions)
+        for imgsz, indices in by_imgsz.items():
+            results = self.model.predict([crops[i] for i in indices], imgsz=imgsz, **kwargs)
+            for i, result in zip(indices, results):
+                found[i] = Detections.from_results([result])
+        for i in tiled:
+            found[i], _ = detect_tiled(crops[i], self.model, cancel=cancel, **self.tiling)
+
+        parts = []
+        for region, (cx0, cy0), detections in zip(regions, origins, found):
+            boxes = detections.boxes + np.array([cx0, cy0, cx0, cy0], dtype=np.float32)
+            # Из области берем только то, что не досталось от нетронутых ячеек
+            keep = _centers_inside(boxes, [region])
+            parts.append((boxes[keep], detections.classes[keep], detections.confidences[keep]))
+        return parts
+
+    def __call__(self, image_np, frame_box, cancel=None):
+        self.gray = to_gray(image_np)
+        self.frame_box = tuple(float(v) for v in frame_box) if frame_box is not None else None
+        detections, report = self._detect(image_np, cancel)
+        self.detections = detections
+        return detections, report
+
+    def _detect(self, image_np, cancel=None):
+        previous = self.previous
+        if previous is None:
+            return self._full(image_np, cancel=cancel)
+        if previous.settings != self.tiling:
+            return self._full(image_np, 'изменился режим детекции', cancel)
+
+        if previous.frame_box is None or self.frame_box is None:
+            return self._full(image_np, 'рамка не найдена', cancel)
+        offset = frame_offset(previous.frame_box, self.frame_box)
+        if offset is None:
+            return self._full(image_np, 'изменился масштаб листа', cancel)
+
+        started = time.perf_counter()
+        h, w = self.gray.shape
+        cells = changed_cells(previous.gray, self.gray, offset, self.cell_size, self.pixel_threshold)
+        regions = changed_regions(cells, self.cell_size, w, h)
+        changed_area = sum((x1 - x0) * (y1 - y0) for x0, y0, x1, y1 in regions) / float(w * h)
+        diff_ms = (time.perf_counter() - started) * 1000.0
+        if changed_area > self.max_changed:
+            return self._full(image_np, f'изменено {changed_area:.0%} листа', cancel)
+        if self.max_regions and len(regions) > self.max_regions:
+            return self._full(image_np, f'изменено {len(regions)} областей', cancel)
+
+        # Детекции прошлой версии в координатах новой; из измененных областей - заново
+        dx, dy = offset
+        old = previous.detections
+        old_boxes = old.boxes + np.array([dx, dy, dx, dy], dtype=np.float32)
+        cx = (old_boxes[:, 0] + old_boxes[:, 2]) / 2
+        cy = (old_boxes[:, 1] + old_boxes[:, 3]) / 2
+        keep = (0 <= cx) & (cx < w) & (0 <= cy) & (cy < h) & ~_centers_inside(old_boxes, regions)
+
+        started = time.perf_counter()
+        parts = [(old_boxes[keep], old.classes[keep], old.confidences[keep])]
+        parts.extend(self._detect_regions(image_np, regions, cancel))
+        detection_ms = (time.perf_counter() - started) * 1000.0
+
+        detections = Detections(np.concatenate([p[0] for p in parts]),
+                                np.concatenate([p[1] for p in parts]),
+                                np.concatenate([p[2] for p in parts]))
+        report = {
+            'mode': 'incremental',
+            'base_result_id': previous.result_id,
+            'offset': [dx, dy],
+            'cell_size': self.cell_size,
+            'changed_cells': int(cells.sum()),
+            'total_cells': int(cells.size),
+            'recomputed_regions': [list(region) for region in regions],
+            'recomputed_area': round(changed_area, 4),
+            'reused_detections': int(keep.sum()),
+            'new_detections': len(detections) - int(keep.sum()),
+            'diff_ms': round(diff_ms, 2),
+            'detection_ms': round(detection_ms, 2),
+        }
+        if self.tiling:
+            report['tiling'] = self.tiling
+        return detections, report
+
+    def version(self, result_id, content_key):
+        """Новая версия листа для SessionVersions (после успешной проверки)"""
+        return SessionVersion(self.gray, self.frame_box, self.detections, result_id, content_key, self.tiling)
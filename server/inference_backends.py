@@ -0,0 +1,338 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+from detections import DEFAULT_IMGSZ
+
+# Поддерживаемые среды выполнения модели
+BACKENDS = ('ultralytics', 'onnx', 'openvino')
+
+# Пороги постобработки - как по умолчанию в ultralytics
+DEFAULT_CONF = 0.25
+DEFAULT_IOU = 0.7
+MAX_DETECTIONS = 300
+# Кандидатов в NMS не больше этого, самые уверенные (max_nms в ultralytics)
+MAX_NMS = 30000
+
+# Цвет заполнения полей при letterbox (как в ultralytics)
+LETTERBOX_FILL = 114
+
+
+class BackendBoxes:
+    """Боксы одного изображения в виде numpy-массивов (поля как у ultralytics)"""
+
+    def __init__(self, xyxy, cls, conf):
+        self.xyxy = xyxy
+        self.cls = cls
+        self.conf = conf
+
+
+class BackendResult:
+    """Результат одного изображения: .boxes и .speed, как у ultralytics"""
+
+    def __init__(self, xyxy, cls, conf, speed):
+        self.boxes = BackendBoxes(xyxy, cls, conf)
+        self.speed = speed
+
+
+def default_model_path(backend, model_path, int8=False):
+    """
+    Путь к весам для среды выполнения по пути к best.pt
+    (имена совпадают с тем, что пишет export_model.py).
+    """
+    stem = os.path.splitext(model_path)[0]
+    if backend == 'onnx':
+        return f"{stem}.int8.onnx" if int8 else f"{stem}.onnx"
+    if backend == 'openvino':
+        return f"{stem}_int8_openvino_model" if int8 else f"{stem}_openvino_model"
+    return model_path
+
+
+def letterbox(image, imgsz):
+    """
+    Вписывает изображение в квадрат imgsz с сохранением пропорций.
+    Возвращает (квадрат, масштаб, (сдвиг x, сдвиг y)).
+    """
+    import cv2
+
+    h, w = image.shape[:2]
+    ratio = min(imgsz / h, imgsz / w)
+    new_w, new_h = round(w * ratio), round(h * ratio)
+    pad_x, pad_y = (imgsz - new_w) / 2, (imgsz - new_h) / 2
+
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, left = round(pad_y - 0.1), round(pad_x - 0.1)
+    canvas = np.full((imgsz, imgsz, 3), LETTERBOX_FILL, dtype=np.uint8)
+    canvas[top:top + new_h, left:left + new_w] = resized
+    return canvas, ratio, (left, top)
+
+
+def nms(boxes, classes, conf, iou):
+    """
+    NMS по каждому классу отдельно (cv2.dnn.NMSBoxesBatched).
+    Возвращает индексы оставленных боксов по убыванию уверенности.
+    """
+    import cv2
+
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+    xywh = np.concatenate([boxes[:, :2], boxes[:, 2:] - boxes[:, :2]], axis=1)
+    keep = cv2.dnn.NMSBoxesBatched(xywh.astype(np.float32).tolist(), conf.astype(np.float32).tolist(),
+                                   classes.astype(np.int32).tolist(), 0.0, float(iou))
+    keep = np.asarray(keep, dtype=np.int64).reshape(-1)
+    return keep[np.argsort(-conf[keep], kind='stable')]
+
+
+def preprocess(images, imgsz):
+    """
+    Батч в виде входа экспортированной модели: letterbox, NCHW, float32 0..1.
+    Возвращает батч и (масштаб, сдвиг, исходный размер) по каждому изображению.
+    """
+    squares, metas = [], []
+    for image in images:
+        square, ratio, pad = letterbox(np.asarray(image), imgsz)
+        squares.append(square)
+        metas.append((ratio, pad, image.shape[:2]))
+    # Как в ultralytics: numpy-вход считается BGR и разворачивается в RGB
+    batch = np.stack(squares)[..., ::-1].transpose(0, 3, 1, 2)
+    return np.ascontiguousarray(batch, dtype=np.float32) / 255.0, metas
+
+
+class _ExportedModel:
+    """
+    Общая часть для экспортированных моделей (ONNX, OpenVINO):
+    letterbox, прогон батча, декодирование выхода YOLO и NMS.
+    Выход модели - (batch, 4 + классы, якоря) с xywh в координатах квадрата.
+    """
+
+    def __init__(self, conf=DEFAULT_CONF, iou=DEFAULT_IOU):
+        self.conf = conf
+        self.iou = iou
+        # Если размер входа зафиксирован при экспорте, используется он
+        self.fixed_imgsz = None
+        self.fixed_batch = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _infer(self, batch):
+        raise NotImplementedError
+
+    def _ensure_loaded(self):
+        """
+        Сессия среды выполнения создается в том процессе, который будет считать:
+        ее пулы потоков не переживают fork (воркеры gunicorn с preload).
+        """
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._load()
+                    self._pid = os.getpid()
+
+    def _postprocess(self, prediction, meta):
+        ratio, (pad_x, pad_y), (h, w) = meta
+        if prediction.shape[0] > prediction.shape[1]:
+            prediction = prediction.T
+        scores = prediction[4:]
+        classes = scores.argmax(axis=0)
+        conf = scores[classes, np.arange(scores.shape[1])]
+        keep = np.flatnonzero(conf > self.conf)
+        if len(keep) > MAX_NMS:
+            keep = keep[np.argsort(-conf[keep])[:MAX_NMS]]
+
+        xywh = prediction[:4, keep].T
+        boxes = np.empty_like(xywh)
+        boxes[:, :2] = xywh[:, :2] - xywh[:, 2:] / 2
+        boxes[:, 2:] = xywh[:, :2] + xywh[:, 2:] / 2
+        classes, conf = classes[keep], conf[keep]
+
+        order = nms(boxes, classes, conf, self.iou)[:MAX_DETECTIONS]
+        boxes, classes, conf = boxes[order], classes[order], conf[order]
+
+        # Из координат квадрата - в координаты исходного изображения
+        boxes -= np.array([pad_x, pad_y, pad_x, pad_y], dtype=np.float32)
+        boxes /= ratio
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+        return boxes, classes.astype(np.float32), conf
+
+    def predict(self, source, imgsz=DEFAULT_IMGSZ, **kwargs):
+        """Совместимо с model.predict: список результатов по изображениям"""
+        self._ensure_loaded()
+        images = source if isinstance(source, list) else [source]
+        imgsz = self.fixed_imgsz or imgsz
+        step = self.fixed_batch or len(images)
+
+        results = []
+        for start in range(0, len(images), step):
+            chunk = images[start:start + step]
+            t0 = time.perf_counter()
+            batch, metas = preprocess(chunk, imgsz)
+            if self.fixed_batch and len(chunk) < self.fixed_batch:
+                # Батч зафиксирован при экспорте: остаток дополняется пустыми входами
+                padding = np.zeros((self.fixed_batch - len(chunk),) + batch.shape[1:], dtype=batch.dtype)
+                batch = np.concatenate([batch, padding])
+            t1 = time.perf_counter()
+            output = self._infer(batch)[:len(chunk)]
+            t2 = time.perf_counter()
+            decoded = [self._postprocess(prediction, meta) for prediction, meta in zip(output, metas)]
+            t3 = time.perf_counter()
+
+            speed = {
+                'preprocess': (t1 - t0) * 1000.0 / len(chunk),
+                'inference': (t2 - t1) * 1000.0 / len(chunk),
+                'postprocess': (t3 - t2) * 1000.0 / len(chunk),
+            }
+            results.extend(BackendResult(*boxes, speed) for boxes in decoded)
+        return results
+
+
+def _static_dim(value):
+    return value if isinstance(value, int) and value > 0 else None
+
+
+class OnnxModel(_ExportedModel):
+    """Экспортированная модель на ONNX Runtime (CPU)"""
+
+    def __init__(self, path, intra_op_threads=0, inter_op_threads=0, **kwargs):
+        super().__init__(**kwargs)
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Нет модели ONNX {path} (см. export_model.py)")
+        self.weights_path = path
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+    def _load(self):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.intra_op_threads:
+            options.intra_op_num_threads = self.intra_op_threads
+        if self.inter_op_threads:
+            options.inter_op_num_threads = self.inter_op_threads
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+
+        self.session = ort.InferenceSession(self.weights_path, options, providers=['CPUExecutionProvider'])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        self.fixed_batch = _static_dim(model_input.shape[0])
+        self.fixed_imgsz = _static_dim(model_input.shape[2])
+
+    def _infer(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OpenVinoModel(_ExportedModel):
+    """Экспортированная модель на OpenVINO (CPU)"""
+
+    def __init__(self, path, intra_op_threads=0, inter_op_threads=0, **kwargs):
+        super().__init__(**kwargs)
+        # ultralytics экспортирует папку с <имя>.xml и <имя>.bin
+        if os.path.isdir(path):
+            xml = [name for name in os.listdir(path) if name.endswith('.xml')]
+            if not xml:
+                raise FileNotFoundError(f"В {path} нет модели OpenVINO (.xml)")
+            path = os.path.join(path, xml[0])
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Нет модели OpenVINO {path} (см. export_model.py)")
+
+        self.xml_path = path
+        self.weights_path = os.path.splitext(path)[0] + '.bin'
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+
+    def _load(self):
+        import openvino as ov
+
+        config = {'PERFORMANCE_HINT': 'LATENCY'}
+        if self.intra_op_threads:
+            config['INFERENCE_NUM_THREADS'] = self.intra_op_threads
+        if self.inter_op_threads:
+            # В OpenVINO параллельные запросы - это потоки выполнения (streams)
+            config['NUM_STREAMS'] = self.inter_op_threads
+
+        core = ov.Core()
+        model = core.read_model(self.xml_path)
+        shape = model.input(0).get_partial_shape()
+        if shape[0].is_static:
+            self.fixed_batch = shape[0].get_length()
+        if shape[2].is_static:
+            self.fixed_imgsz = shape[2].get_length()
+
+        self.compiled = core.compile_model(model, 'CPU', config)
+        self.output = self.compiled.output(0)
+
+    def _infer(self, batch):
+        return self.compiled(batch)[self.output]
+
+
+class UltralyticsModel:
+    """Исходная модель PyTorch через ultralytics (как раньше)"""
+
+    def __init__(self, path, intra_op_threads=0, inter_op_threads=0, **kwargs):
+        from ultralytics import YOLO
+
+        self.weights_path = path
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        # Веса загружаются сразу: при preload их делят все воркеры (copy-on-write)
+        self.model = YOLO(path)
+        self._pid = None
+
+    def _configure_threads(self):
+        """Потоки torch настраиваются в процессе, который считает (после fork)"""
+        import torch
+
+        if self.intra_op_threads:
+            torch.set_num_threads(self.intra_op_threads)
+        if self.inter_op_threads:
+            try:
+                torch.set_num_interop_threads(self.inter_op_threads)
+            except RuntimeError:
+                # Уже задано в этом процессе
+                pass
+
+    def predict(self, source, imgsz=DEFAULT_IMGSZ, **kwargs):
+        if self._pid != os.getpid():
+            self._configure_threads()
+            self._pid = os.getpid()
+        return self.model.predict(source, imgsz=imgsz, **kwargs)
+
+
+def load_backend(backend, model_path, int8=False, intra_op_threads=0, inter_op_threads=0,
+                 conf=DEFAULT_CONF, iou=DEFAULT_IOU, path=None):
+    """
+    Модель в выбранной среде выполнения с интерфейсом predict как у ultralytics.
+    path - явный путь к весам, иначе он выводится из model_path (best.pt).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестная среда выполнения {backend}, доступны: {', '.join(BACKENDS)}")
+    path = path or default_model_path(backend, model_path, int8)
+    threads = {'intra_op_threads': intra_op_threads, 'inter_op_threads': inter_op_threads}
+
+    if backend == 'onnx':
+        return OnnxModel(path, conf=conf, iou=iou, **threads)
+    if backend == 'openvino':
+        return OpenVinoModel(path, conf=conf, iou=iou, **threads)
+    return UltralyticsModel(path, **threads)
+
+
+def warmup(model, runs=2, imgsz=DEFAULT_IMGSZ, image=None):
+    """
+    Прогревочные прогоны на образце листа (image - RGB-массив, иначе пустой лист A3),
+    чтобы первый настоящий запрос не платил за ленивую инициализацию среды выполнения.
+    Возвращает время каждого прогона, мс.
+    """
+    if image is None:
+        image = np.full((imgsz * 297 // 420, imgsz, 3), 255, dtype=np.uint8)
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        model.predict(image, imgsz=imgsz)
+        timings.append(round((time.perf_counter() - started) * 1000.0, 1))
+    return timings
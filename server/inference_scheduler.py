@@ -0,0 +1,168 @@
+import os
+import threading
+import time
+from collections import deque, Counter
+from concurrent.futures import Future, wait
+
+from detections import DEFAULT_IMGSZ
+from stage_graph import Cancelled, CANCEL_POLL_S
+
+
+class _Request:
+    __slots__ = ("image", "imgsz", "future", "enqueued_at")
+
+    def __init__(self, image, imgsz):
+        self.image = image
+        self.imgsz = imgsz
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class InferenceScheduler:
+    """
+    Собирает изображения от параллельных запросов в батчи
+    и прогоняет их через модель одним вызовом predict.
+
+    Имеет тот же интерфейс predict, что и модель, поэтому
+    может подставляться везде вместо нее.
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=10.0, on_batch=None):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size должен быть >= 1")
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        # on_batch(размер батча, секунды) - для метрик
+        self.on_batch = on_batch
+
+        self._start()
+        # Потоки не переживают fork: в дочернем процессе (воркер gunicorn
+        # с preload) планировщик запускается заново
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+
+        # Статистика
+        self._batches = 0
+        self._images = 0
+        self._batch_sizes = Counter()
+        self._max_queue_depth = 0
+        self._total_wait = 0.0
+        self._total_inference = 0.0
+
+        self._worker = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, image, imgsz=DEFAULT_IMGSZ):
+        """Ставит изображение в очередь, возвращает Future с результатом"""
+        req = _Request(image, imgsz)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Планировщик инференса остановлен")
+            self._queue.append(req)
+            self._max_queue_depth = max(self._max_queue_depth, len(self._queue))
+            self._cond.notify()
+        return req.future
+
+    def predict(self, source, imgsz=DEFAULT_IMGSZ, cancel=None, **kwargs):
+        """
+        Совместимо с model.predict: список результатов по изображениям.
+        cancel - threading.Event отмены: ожидание прерывается (stage_graph.Cancelled),
+        еще не взятые в батч изображения снимаются с очереди.
+        """
+        images = source if isinstance(source, list) else [source]
+        futures = [self.submit(image, imgsz) for image in images]
+        if cancel is not None:
+            while wait(futures, timeout=CANCEL_POLL_S).not_done:
+                if cancel.is_set():
+                    for future in futures:
+                        future.cancel()
+                    raise Cancelled("Проверка отменена")
+        return [future.result() for future in futures]
+
+    def _next_batch(self):
+        """Ждет первый запрос, затем добирает батч до размера или таймаута"""
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+
+            deadline = time.perf_counter() + self.max_wait
+            while len(self._queue) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            # В одном батче только изображения с одинаковым imgsz
+            imgsz = self._queue[0].imgsz
+            batch = []
+            rest = deque()
+            while self._queue and len(batch) < self.max_batch_size:
+                req = self._queue.popleft()
+                if req.imgsz == imgsz:
+                    batch.append(req)
+                else:
+                    rest.append(req)
+            rest.extend(self._queue)
+            self._queue = rest
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+
+            batch = [req for req in batch if req.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            try:
+                results = self.model.predict([req.image for req in batch], imgsz=batch[0].imgsz)
+            except Exception as e:
+                for req in batch:
+                    req.future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            with self._cond:
+                self._batches += 1
+                self._images += len(batch)
+                self._batch_sizes[len(batch)] += 1
+                self._total_wait += sum(started - req.enqueued_at for req in batch)
+                self._total_inference += finished - started
+            if self.on_batch is not None:
+                self.on_batch(len(batch), finished - started)
+
+            for req, result in zip(batch, results):
+                req.future.set_result(result)
+
+    def stats(self):
+        """Глубина очереди и статистика размеров батчей"""
+        with self._cond:
+            return {
+                'queue_depth': len(self._queue),
+                'max_queue_depth': self._max_queue_depth,
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'batches': self._batches,
+                'images': self._images,
+                'avg_batch_size': self._images / self._batches if self._batches else 0.0,
+                'batch_size_histogram': {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                'avg_queue_wait_ms': self._total_wait / self._images * 1000.0 if self._images else 0.0,
+                'avg_batch_inference_ms': self._total_inference / self._batches * 1000.0 if self._batches else 0.0,
+            }
+
+    def close(self):
+        """Останавливает поток после обработки уже поставленных запросов"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join()
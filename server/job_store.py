@@ -0,0 +1,198 @@
+"""
+Состояние задач /jobs, общее для всех воркеров gunicorn.
+
+Задача выполняется в том воркере, который ее принял, но опрос статуса,
+поток событий и отмена могут прийти в любой другой. Поэтому воркер-
+исполнитель записывает статус, события и результат задачи в SQLite
+(WAL, тот же каталог, что у хранилища результатов), а остальные воркеры
+читают их оттуда. Отмена из чужого воркера - флаг в базе, исполнитель
+опрашивает его для своих незавершенных задач.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from jobs import DONE, FAILED, CANCELLED
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    pid INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    result TEXT,
+    error TEXT,
+    cancel_requested INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS jobs_pid ON jobs (pid, status);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished_at);
+
+CREATE TABLE IF NOT EXISTS job_events (
+    job_id TEXT NOT NULL REFERENCES jobs (job_id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (job_id, idx)
+);
+"""
+
+FINISHED = (DONE, FAILED, CANCELLED)
+
+# Ожидание блокировки записи SQLite другим воркером, с
+BUSY_TIMEOUT_S = 30.0
+# Опрос новых событий задачи из чужого воркера, с
+EVENTS_POLL_S = 0.1
+
+WORKER_GONE_TEXT = 'Воркер, выполнявший задачу, остановился'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobStore:
+    """
+    root - каталог базы (jobs.sqlite3).
+    max_finished - сколько последних завершенных задач хранить (как у JobManager).
+    """
+
+    def __init__(self, root, max_finished=256):
+        self.root = root
+        self.max_finished = max_finished
+        self.db_path = os.path.join(root, 'jobs.sqlite3')
+        os.makedirs(root, exist_ok=True)
+
+        self._start()
+        # Соединения SQLite не переживают fork: в воркере gunicorn - свои
+        os.register_at_fork(after_in_child=self._start)
+        self._conn().executescript(SCHEMA)
+
+    def _start(self):
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_S, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    # Запись (воркер-исполнитель)
+
+    def register(self, job):
+        """Новая задача этого процесса: дальше ее события пишутся через record_event"""
+        self._conn().execute('INSERT OR REPLACE INTO jobs (job_id, pid, status, created_at) VALUES (?, ?, ?, ?)',
+                             (job.id, os.getpid(), job.status, job.created_at))
+
+    def record_event(self, job, index, event, data):
+        """Событие задачи с номером index; событие смены статуса обновляет и саму задачу"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('INSERT OR REPLACE INTO job_events (job_id, idx, event, data) VALUES (?, ?, ?, ?)',
+                         (job.id, index, event, json.dumps(data, ensure_ascii=False)))
+            if event == 'status':
+                conn.execute('UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE job_id = ?',
+                             (job.status, job.finished_at,
+                              json.dumps(job.result, ensure_ascii=False) if job.result is not None else None,
+                              job.error, job.id))
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+        if event == 'status' and data['status'] in FINISHED:
+            self._evict()
+
+    def _evict(self):
+        self._conn().execute(
+            'DELETE FROM jobs WHERE finished_at IS NOT NULL AND job_id NOT IN '
+            '(SELECT job_id FROM jobs WHERE finished_at IS NOT NULL ORDER BY finished_at DESC LIMIT ?)',
+            (self.max_finished,))
+
+    def cancel_requested(self, job_ids):
+        """Из job_ids - те, которые отменили через другой воркер"""
+        if not job_ids:
+            return []
+        placeholders = ','.join('?' * len(job_ids))
+        rows = self._conn().execute(
+            f'SELECT job_id FROM jobs WHERE cancel_requested = 1 AND job_id IN ({placeholders})', list(job_ids))
+        return [row['job_id'] for row in rows]
+
+    # Чтение и отмена (любой воркер)
+
+    def _row(self, job_id):
+        row = self._conn().execute('SELECT * FROM jobs WHERE job_id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        row = dict(row)
+        if row['status'] not in FINISHED and not _pid_alive(row['pid']):
+            # Воркер упал или перезапущен: задача уже не завершится
+            row.update(status=FAILED, error=WORKER_GONE_TEXT)
+        return row
+
+    def get(self, job_id):
+        """Задача в виде Job.to_dict() или None"""
+        row = self._row(job_id)
+        if row is None:
+            return None
+        stages = {}
+        for event in self._conn().execute(
+                "SELECT data FROM job_events WHERE job_id = ? AND event = 'stage' ORDER BY idx", (job_id,)):
+            data = json.loads(event['data'])
+            stages[data['stage']] = data['data']
+        return {
+            'job_id': row['job_id'],
+            'status': row['status'],
+            'created_at': row['created_at'],
+            'finished_at': row['finished_at'],
+            'stages': stages,
+            'result': json.loads(row['result']) if row['result'] is not None else None,
+            'error': row['error'],
+        }
+
+    def request_cancel(self, job_id):
+        """Отмена задачи другого воркера. Возвращает текущий статус или None, если задачи нет"""
+        conn = self._conn()
+        conn.execute('UPDATE jobs SET cancel_requested = 1 WHERE job_id = ? AND finished_at IS NULL', (job_id,))
+        row = self._row(job_id)
+        return row['status'] if row is not None else None
+
+    def iter_events(self, job_id, start=0, heartbeat=15.0):
+        """Как Job.iter_events, но по базе: новые события опрашиваются каждые EVENTS_POLL_S"""
+        index = start
+        conn = self._conn()
+        last_event = time.monotonic()
+        while True:
+            # Статус читается до событий: у завершенной задачи последние события уже в базе
+            job = self._row(job_id)
+            if job is None:
+                return
+            rows = conn.execute('SELECT idx, event, data FROM job_events WHERE job_id = ? AND idx >= ? ORDER BY idx',
+                                (job_id, index)).fetchall()
+            for row in rows:
+                yield row['idx'], (row['event'], json.loads(row['data']))
+                index = row['idx'] + 1
+            if rows:
+                last_event = time.monotonic()
+                continue
+            if job['status'] in FINISHED:
+                if job['error'] == WORKER_GONE_TEXT:
+                    yield index, ('status', {'status': FAILED, 'error': WORKER_GONE_TEXT})
+                return
+            if time.monotonic() - last_event >= heartbeat:
+                last_event = time.monotonic()
+                yield None
+            time.sleep(EVENTS_POLL_S)
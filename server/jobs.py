@@ -0,0 +1,299 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# Статусы задачи
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+CANCELLED_TEXT = 'Проверка отменена'
+
+
+class QueueFullError(Exception):
+    """Очередь задач переполнена"""
+
+
+class Job:
+    """Одна проверка чертежа, выполняемая в фоне"""
+
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.finished_at = None
+        self.stages = OrderedDict()
+        self.events = []
+        self.result = None
+        self.error = None
+        self._callbacks = []
+        self._cond = threading.Condition()
+        # Флаг отмены: задача проверяет его между этапами
+        self.cancel_event = threading.Event()
+        # listener(job, номер, событие, данные) - копия событий для других воркеров (JobStore)
+        self.listener = None
+
+    def _emit(self, event, data):
+        with self._cond:
+            self.events.append((event, data))
+            if self.listener is not None:
+                # Под блокировкой задачи: события уходят в том же порядке, что и нумеруются
+                try:
+                    self.listener(self, len(self.events) - 1, event, data)
+                except Exception as e:
+                    print(f"Ошибка записи события задачи {self.id}: {str(e)}")
+            self._cond.notify_all()
+
+    def report_stage(self, name, data):
+        """Результат этапа доступен сразу, до окончания всей проверки"""
+        with self._cond:
+            self.stages[name] = data
+        self._emit('stage', {'stage': name, 'data': data})
+
+    def _start(self):
+        """False - задачу отменили, пока она стояла в очереди"""
+        with self._cond:
+            if self.finished:
+                return False
+            # Отмена успела выставить флаг, но еще не завершила задачу - не запускаем
+            cancelled = self.cancel_event.is_set()
+            if not cancelled:
+                self.status = RUNNING
+        if cancelled:
+            self._finish(error=CANCELLED_TEXT, status=CANCELLED)
+            return False
+        self._emit('status', {'status': RUNNING})
+        return True
+
+    def cancel(self):
+        """
+        Отмена: еще не начатая задача завершается сразу, выполняемая -
+        после текущих этапов. Возвращает True, если задача еще не была завершена.
+        """
+        self.cancel_event.set()
+        with self._cond:
+            if self.finished:
+                return False
+            queued = self.status == QUEUED
+        if queued:
+            self._finish(error=CANCELLED_TEXT, status=CANCELLED)
+        return True
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def _finish(self, result=None, error=None, status=None):
+        with self._cond:
+            if self.finished:
+                return
+            self.result = result
+            self.error = error
+            self.status = status or (FAILED if error is not None else DONE)
+            self.finished_at = time.time()
+            callbacks, self._callbacks = self._callbacks, []
+        self._emit('status', {'status': self.status, 'error': error})
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """callback(job) по завершении (сразу, если задача уже завершена)"""
+        with self._cond:
+            if not self.finished:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def wait(self, timeout=None):
+        """Ждет окончания задачи. Возвращает True, если задача завершена"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.finished, timeout)
+
+    def iter_events(self, start=0, heartbeat=15.0):
+        """
+        Генератор событий задачи начиная с номера start.
+        Если событий нет дольше heartbeat секунд, отдает None (для keep-alive).
+        """
+        index = start
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self.events) > index or self.finished, heartbeat)
+                pending = self.events[index:]
+                done = self.finished
+            if not pending and not done:
+                yield None
+                continue
+            for event in pending:
+                yield index, event
+                index += 1
+            if done and index >= len(self.events):
+                return
+
+    def to_dict(self):
+        with self._cond:
+            return {
+                'job_id': self.id,
+                'status': self.status,
+                'created_at': self.created_at,
+                'finished_at': self.finished_at,
+                'stages': dict(self.stages),
+                'result': self.result,
+                'error': self.error,
+            }
+
+
+class JobManager:
+    """
+    Ограниченный пул потоков для проверок.
+    Хранит последние завершенные задачи, чтобы их можно было забрать по id.
+    store - JobStore: задачи из submit_shared видны и отменяются из других воркеров
+    (флаг отмены опрашивается каждые cancel_poll_s).
+    """
+
+    def __init__(self, max_workers=2, max_pending=32, max_finished=256, store=None, cancel_poll_s=0.5):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.store = store
+        self.cancel_poll_s = cancel_poll_s
+        self._start()
+        # В дочернем процессе (воркер gunicorn с preload) - свой пул и свои задачи
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._shared = set()
+        self._lock = threading.Lock()
+        # Освобождение места в очереди (для submit_wait)
+        self._freed = threading.Condition(self._lock)
+        self._closed = False
+        if self.store is not None:
+            threading.Thread(target=self._watch_cancel, name="job-cancel-watch", daemon=True).start()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Ставит fn(job, *args, **kwargs) в очередь. Возвращаемое значение
+        fn становится результатом задачи.
+        """
+        return self._submit(fn, args, kwargs)
+
+    def submit_shared(self, fn, *args, **kwargs):
+        """Как submit, но статус, события и отмена задачи доступны из любого воркера (через store)"""
+        return self._submit(fn, args, kwargs, shared=self.store is not None)
+
+    def submit_wait(self, timeout, fn, *args, **kwargs):
+        """Как submit, но при полной очереди ждет места до timeout секунд, потом QueueFullError"""
+        return self._submit(fn, args, kwargs, timeout=timeout)
+
+    def _pending(self):
+        return sum(1 for j in self._jobs.values() if not j.finished)
+
+    def _submit(self, fn, args, kwargs, shared=False, timeout=0):
+        job = Job()
+        with self._lock:
+            if timeout:
+                self._freed.wait_for(lambda: self._closed or self._pending() < self.max_pending, timeout)
+            if self._closed:
+                raise QueueFullError("Сервер останавливается")
+            if self._pending() >= self.max_pending:
+                raise QueueFullError("Очередь задач переполнена")
+            self._jobs[job.id] = job
+            self._evict()
+        job.add_done_callback(self._release)
+        if shared:
+            # До постановки в пул: первое событие задачи уже попадет в базу
+            self.store.register(job)
+            job.listener = self.store.record_event
+            with self._lock:
+                self._shared.add(job.id)
+            job.add_done_callback(self._unshare)
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _release(self, job):
+        with self._lock:
+            self._freed.notify()
+
+    def _unshare(self, job):
+        with self._lock:
+            self._shared.discard(job.id)
+
+    def _watch_cancel(self):
+        """Отмена задач этого процесса, запрошенная через другой воркер"""
+        while not self._closed:
+            time.sleep(self.cancel_poll_s)
+            with self._lock:
+                job_ids = list(self._shared)
+            if not job_ids:
+                continue
+            try:
+                cancelled = self.store.cancel_requested(job_ids)
+            except Exception as e:
+                print(f"Ошибка опроса отмены задач: {str(e)}")
+                continue
+            for job_id in cancelled:
+                job = self.get(job_id)
+                if job is not None:
+                    job.cancel()
+
+    def _run(self, job, fn, args, kwargs):
+        if not job._start():
+            return
+        try:
+            result = fn(job, *args, **kwargs)
+        except Exception as e:
+            if job.cancelled:
+                job._finish(error=CANCELLED_TEXT, status=CANCELLED)
+                return
+            print(f"Ошибка в задаче {job.id}: {str(e)}")
+            import traceback
+            print(f"Трассировка: {traceback.format_exc()}")
+            job._finish(error=str(e))
+        else:
+            job._finish(result=result)
+
+    def _evict(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def close(self):
+        """Перестает принимать задачи (уже поставленные дорабатывают), не ждет"""
+        with self._lock:
+            self._closed = True
+            self._freed.notify_all()
+
+    def shutdown(self, timeout=None):
+        """
+        Перестает принимать задачи и ждет уже поставленные.
+        Возвращает True, если все задачи успели завершиться.
+        """
+        self.close()
+        with self._lock:
+            pending = [job for job in self._jobs.values() if not job.finished]
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for job in pending:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not job.wait(remaining):
+                return False
+        self._executor.shutdown(wait=False)
+        return True
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in (QUEUED, RUNNING, DONE, FAILED, CANCELLED)}
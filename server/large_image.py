@@ -0,0 +1,178 @@
+"""
+Крупные сканы с ограниченной памятью.
+
+Изображение больше порога декодируется один раз, полосами переводится в RGB
+и записывается в отображенный в память временный файл (страницы живут в кеше
+ОС, а не в куче процесса). Проверкам, которым не нужно полное разрешение
+(детекция на 640 px, грубый поиск рамки, картинка результата), отдается
+уменьшенная в целое число раз копия. Полное разрешение читается кусками:
+полосы уточнения рамки и тайлы нарезанного инференса.
+"""
+import ctypes
+import mmap
+import tempfile
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from process_image import decode_rgb
+
+# Пределы по умолчанию (в сервисе задаются в config.py)
+DEFAULT_MAX_PIXELS = 600_000_000  # A0 при 600 dpi - около 560 Мп
+DEFAULT_LARGE_PIXELS = 40_000_000  # больше - режим крупного скана
+DEFAULT_WORK_MAX_SIDE = 4096  # длинная сторона рабочей копии, px
+
+# Полоса при переводе в RGB, пикселей (около 12 МБ RGB)
+BAND_PIXELS = 4_000_000
+
+
+# malloc_trim есть только в glibc
+try:
+    _libc = ctypes.CDLL('libc.so.6')
+except OSError:
+    _libc = None
+
+
+class ImageTooLarge(ValueError):
+    """Изображение больше допустимого числа пикселей"""
+
+
+class _GrayStrips:
+    """
+    Серый вид полного разрешения для срезов: переводятся только
+    запрошенные полосы, целиком серая копия страницы не создается.
+    """
+
+    def __init__(self, rgb):
+        self.rgb = rgb
+        self.shape = rgb.shape[:2]
+
+    def __getitem__(self, key):
+        strip = self.rgb[key]
+        if strip.size == 0:
+            return np.empty(strip.shape[:2], dtype=np.uint8)
+        return cv2.cvtColor(np.ascontiguousarray(strip), cv2.COLOR_RGB2GRAY)
+
+
+class LargeImage:
+    """
+    Крупный скан: full - полное разрешение (массив поверх mmap временного файла, только для чтения),
+    preview - копия в памяти, уменьшенная в factor раз (размер с округлением вверх).
+    """
+
+    def __init__(self, full, preview, factor):
+        self.full = full
+        self.preview = preview
+        self.factor = factor
+
+    @property
+    def shape(self):
+        return self.full.shape
+
+    @property
+    def dtype(self):
+        return self.full.dtype
+
+    def gray_strips(self):
+        return _GrayStrips(self.full)
+
+    def report(self):
+        h, w = self.full.shape[:2]
+        ph, pw = self.preview.shape[:2]
+        return {'width': w, 'height': h, 'factor': self.factor, 'work_width': pw, 'work_height': ph}
+
+
+def _disk_array(shape, tmp_dir=None):
+    """
+    Массив в анонимном временном файле: место на диске освобождается вместе с массивом.
+    Возвращает (массив, mmap) - mmap нужен, чтобы отпускать записанные страницы.
+    """
+    with tempfile.TemporaryFile(dir=tmp_dir or None) as f:
+        f.truncate(int(np.prod(shape)))
+        buffer = mmap.mmap(f.fileno(), int(np.prod(shape)))
+    return np.frombuffer(buffer, dtype=np.uint8).reshape(shape), buffer
+
+
+def _release(buffer, start, end):
+    """
+    Убирает страницы [start, end) из RSS процесса: данные остаются
+    в кеше ОС и в файле и подгружаются снова при чтении.
+    Возвращает новую границу отпущенного (по размеру страницы).
+    """
+    end = end // mmap.PAGESIZE * mmap.PAGESIZE
+    if end > start and hasattr(buffer, 'madvise'):
+        buffer.madvise(mmap.MADV_DONTNEED, start, end - start)
+    return max(start, end)
+
+
+def _decode_large(image, work_max_side, tmp_dir=None):
+    """
+    Одно декодирование в исходном режиме (1 бит, оттенки серого или RGB),
+    дальше полосами: RGB в файл и уменьшенная копия в память.
+    Пик памяти - исходное декодирование и одна полоса, а не вся страница в RGB.
+    """
+    w, h = image.size
+    factor = max(1, int(np.ceil(max(w, h) / work_max_side)))
+    image.load()
+
+    full, buffer = _disk_array((h, w, 3), tmp_dir)
+    released = 0
+    preview = np.empty((-(-h // factor), -(-w // factor), 3), dtype=np.uint8)
+
+    # Высота полосы кратна factor: уменьшение по полосам совпадает с уменьшением целиком
+    band_rows = max(factor, BAND_PIXELS // w // factor * factor)
+    for y in range(0, h, band_rows):
+        band = image.crop((0, y, w, min(h, y + band_rows)))
+        if band.mode != "RGB":
+            band = band.convert("RGB")
+        full[y:y + band.height] = np.asarray(band)
+        small = band.reduce(factor) if factor > 1 else band
+        preview[y // factor:y // factor + small.height] = np.asarray(small)
+        released = _release(buffer, released, (y + band.height) * w * 3)
+
+    full.flags.writeable = False
+    preview.flags.writeable = False
+    return LargeImage(full, preview, factor)
+
+
+def _trim_heap():
+    """Освобожденная память декодирования возвращается ОС (glibc сама отдает ее не всегда)"""
+    if _libc is not None and hasattr(_libc, 'malloc_trim'):
+        _libc.malloc_trim(0)
+
+
+def open_image(file, max_pixels=DEFAULT_MAX_PIXELS, large_pixels=DEFAULT_LARGE_PIXELS,
+               work_max_side=DEFAULT_WORK_MAX_SIDE, tmp_dir=None):
+    """
+    Загруженный файл → RGB-массив только для чтения (как load_image)
+    или LargeImage, если пикселей больше large_pixels (0 - режим выключен).
+    Размер проверяется по заголовку до декодирования: больше max_pixels - ImageTooLarge.
+    """
+    image = _open_image(file, max_pixels, large_pixels, work_max_side, tmp_dir)
+    if isinstance(image, LargeImage):
+        # Исходное декодирование уже освобождено - в памяти остается только рабочая копия
+        _trim_heap()
+    return image
+
+
+def _open_image(file, max_pixels, large_pixels, work_max_side, tmp_dir):
+    stream = getattr(file, 'stream', file)
+    try:
+        image = Image.open(stream)
+    except Image.DecompressionBombError as e:
+        raise ImageTooLarge(f"Изображение слишком большое: {str(e)}")
+    except Exception as e:
+        raise Exception(f"Ошибка чтения изображения: {str(e)}")
+
+    with image:
+        w, h = image.size
+        if max_pixels and w * h > max_pixels:
+            raise ImageTooLarge(f"Изображение слишком большое: {w}x{h} px, допускается не больше "
+                                f"{max_pixels / 1e6:.0f} Мп")
+        try:
+            if large_pixels and w * h > large_pixels:
+                return _decode_large(image, work_max_side, tmp_dir)
+            return decode_rgb(image)
+        except Exception as e:
+            raise Exception(f"Ошибка чтения изображения: {str(e)}")
@@ -0,0 +1,180 @@
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss_bytes():
+    """Текущий RSS процесса (Linux - из /proc, иначе - пиковый из getrusage)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        # ru_maxrss в КБ на Linux и в байтах на macOS
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if rss > 1 << 32 else rss * 1024
+    return 0
+
+
+def peak_rss_bytes():
+    """Пиковый RSS процесса за все время (VmHWM на Linux, иначе getrusage)"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if rss > 1 << 32 else rss * 1024
+    return 0
+
+
+class PeakRSSSampler:
+    """
+    Пиковый RSS за время выполнения блока: фоновый поток опрашивает RSS
+    с заданным интервалом.
+
+        with PeakRSSSampler() as sampler:
+            ...
+        sampler.peak_delta_bytes
+    """
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.start_bytes = 0
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_bytes = max(self.peak_bytes, current_rss_bytes())
+
+    def __enter__(self):
+        self.reset()
+        self.resume()
+        return self
+
+    def reset(self):
+        """Исходный уровень - текущий RSS"""
+        self.start_bytes = self.peak_bytes = current_rss_bytes()
+
+    def __exit__(self, *exc):
+        self.pause()
+        return False
+
+    def pause(self):
+        """Останавливает опрос, пик и исходный уровень сохраняются"""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.peak_bytes = max(self.peak_bytes, current_rss_bytes())
+
+    def resume(self):
+        """Продолжает опрос после pause (пик считается от того же исходного уровня)"""
+        if self._thread is not None:
+            return
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+        self._thread.start()
+
+    @property
+    def peak_delta_bytes(self):
+        """Насколько RSS поднимался над уровнем на входе в блок"""
+        return max(0, self.peak_bytes - self.start_bytes)
+
+
+class ProcessRSSMonitor:
+    """
+    Один поток опроса RSS на весь процесс вместо потока на каждый запрос.
+    RSS общий на процесс, поэтому окно (запрос) получает пик процесса за время,
+    пока оно было открыто, а не память самого запроса: параллельные запросы
+    входят в пик друг друга. Поток запускается при первом открытом окне
+    и завершается, когда открытых окон не осталось.
+    """
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self._reset()
+        if hasattr(os, 'register_at_fork'):
+            # Потоки не переживают fork: в дочернем процессе опрос начинается заново
+            os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._windows = set()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            rss = current_rss_bytes()
+            with self._lock:
+                if not self._windows:
+                    self._thread = None
+                    return
+                for window in self._windows:
+                    window.peak_bytes = max(window.peak_bytes, rss)
+
+    def _open(self, window):
+        with self._lock:
+            self._windows.add(window)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rss-monitor", daemon=True)
+                self._thread.start()
+
+    def _close(self, window):
+        with self._lock:
+            self._windows.discard(window)
+
+    def window(self, suspended=False):
+        """Окно наблюдения от текущего RSS; suspended - опрос не идет до resume()"""
+        window = RSSWindow(self)
+        if not suspended:
+            window.resume()
+        return window
+
+    @property
+    def active_windows(self):
+        return len(self._windows)
+
+
+class RSSWindow:
+    """Пик RSS процесса за время окна ProcessRSSMonitor (паузы не учитываются)"""
+
+    def __init__(self, monitor):
+        self.monitor = monitor
+        self.start_bytes = self.peak_bytes = current_rss_bytes()
+        self.active = False
+
+    def pause(self):
+        if not self.active:
+            return
+        self.active = False
+        self.monitor._close(self)
+        self.peak_bytes = max(self.peak_bytes, current_rss_bytes())
+
+    def resume(self):
+        if self.active:
+            return
+        self.active = True
+        self.monitor._open(self)
+
+    close = pause
+
+    @property
+    def peak_delta_bytes(self):
+        """Насколько RSS процесса поднимался над уровнем на открытии окна"""
+        return max(0, self.peak_bytes - self.start_bytes)
@@ -0,0 +1,303 @@
+"""
+Метрики в текстовом формате Prometheus (без внешних зависимостей).
+Метрики - глобальные объекты модуля, их можно обновлять из любого этапа.
+При нескольких воркерах gunicorn у каждого процесса свои значения, поэтому
+у каждой серии есть метка worker (pid процесса): без нее серии разных
+воркеров, отданные через один адрес, были бы неотличимы. Суммировать по
+воркерам - в запросе Prometheus: sum without (worker) (...).
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from memory_usage import current_rss_bytes, peak_rss_bytes
+
+# Границы гистограмм
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+PIXELS_BUCKETS = (512, 1024, 2048, 3072, 4096, 6144, 8192, 12288, 16384)
+COUNT_BUCKETS = (0, 1, 5, 10, 25, 50, 100, 200, 300)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32)
+BYTES_BUCKETS = tuple(2 ** 20 * mb for mb in (16, 64, 128, 256, 512, 1024, 2048, 4096))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    # pid берется при выдаче: после fork у воркера gunicorn он свой
+    pairs = [('worker', os.getpid())] + list(zip(names, values)) + list(extra)
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = OrderedDict()
+        REGISTRY.append(self)
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kwargs):
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        values = tuple(str(v) for v in values)
+        with self._lock:
+            child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+            return child
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        family = f"{self.name}_total" if self.kind == 'counter' else self.name
+        lines = [f"# HELP {family} {self.documentation}", f"# TYPE {family} {self.kind}"]
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1.0):
+        self.labels().inc(amount)
+
+    def _samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        return [f"{self.name}_total{_format_labels(self.labelnames, values)} {_format_value(child.value)}"
+                for values, child in children]
+
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        self.buckets = tuple(buckets) + (float('inf'),)
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self):
+        with self._lock:
+            children = list(self._children.items())
+        lines = []
+        for values, child in children:
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, values, [('le', _format_value(float(bound)))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    Значение считается в момент выдачи /metrics.
+    fn() возвращает число, а при одной метке - словарь {значение метки: число}.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, fn, labelnames=()):
+        self.fn = fn
+        super().__init__(name, documentation, labelnames)
+
+    def _samples(self):
+        value = self.fn()
+        if not self.labelnames:
+            return [f"{self.name}{_format_labels((), ())} {_format_value(value)}"]
+        return [f"{self.name}{_format_labels(self.labelnames, (label,))} {_format_value(v)}"
+                for label, v in value.items()]
+
+
+REGISTRY = []
+
+
+def render():
+    """Все метрики в текстовом формате Prometheus"""
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+# Метрики сервиса
+REQUESTS = Counter('gostguard_requests', 'HTTP-запросы по эндпоинту и коду ответа',
+                   ('endpoint', 'method', 'status'))
+REQUEST_SECONDS = Histogram('gostguard_request_duration_seconds', 'Время ответа по эндпоинту',
+                            ('endpoint',))
+CHECK_ERRORS = Counter('gostguard_check_errors', 'Проверки чертежей, завершившиеся ошибкой', ('stage',))
+STAGE_SECONDS = Histogram('gostguard_stage_duration_seconds', 'Время этапов проверки чертежа', ('stage',))
+PREDICT_SECONDS = Histogram('gostguard_model_predict_seconds', 'Время одного вызова model.predict (батч)')
+PREDICT_BATCH_SIZE = Histogram('gostguard_model_batch_size', 'Изображений в одном вызове model.predict',
+                               buckets=BATCH_BUCKETS)
+IMAGE_PIXELS = Histogram('gostguard_image_pixels', 'Размер входного изображения по сторонам, px',
+                         ('side',), buckets=PIXELS_BUCKETS)
+DETECTIONS = Histogram('gostguard_detections_per_image', 'Детекций на чертеж по классам',
+                       ('class',), buckets=COUNT_BUCKETS)
+CACHE_HITS = Counter('gostguard_result_cache_requests', 'Проверки, отданные из кеша или посчитанные заново',
+                     ('result',))
+PROCESS_MEMORY = Gauge('gostguard_process_resident_memory_bytes', 'RSS процесса', current_rss_bytes)
+PROCESS_PEAK_MEMORY = Gauge('gostguard_process_peak_resident_memory_bytes', 'Пиковый RSS процесса за все время',
+                            peak_rss_bytes)
+CHECK_RSS_GROWTH = Histogram('gostguard_check_rss_growth_bytes',
+                             'Рост RSS всего процесса за время проверки чертежа (включая параллельные запросы)',
+                             buckets=BYTES_BUCKETS)
+
+SHADOW_SAMPLES = Counter('gostguard_shadow_samples', 'Образцы теневой проверки модели-кандидата по результату',
+                         ('result',))
+SHADOW_PREDICT_SECONDS = Histogram('gostguard_shadow_predict_seconds', 'Время детекции моделью-кандидатом')
+
+
+def observe_image(image_np):
+    h, w = image_np.shape[:2]
+    IMAGE_PIXELS.labels('width').observe(w)
+    IMAGE_PIXELS.labels('height').observe(h)
+
+
+def observe_detections(detections):
+    DETECTIONS.labels('arrow').observe(len(detections.arrows))
+    DETECTIONS.labels('object').observe(len(detections.objects))
+    DETECTIONS.labels('text').observe(len(detections.texts))
+
+
+def observe_batch(batch_size, seconds):
+    """Колбэк планировщика инференса"""
+    PREDICT_SECONDS.observe(seconds)
+    PREDICT_BATCH_SIZE.observe(batch_size)
+
+
+def observe_shadow(result, seconds):
+    """Колбэк теневой проверки"""
+    SHADOW_SAMPLES.labels(result).inc()
+    if seconds is not None:
+        SHADOW_PREDICT_SECONDS.observe(seconds)
+
+
+class StageTimings:
+    """
+    Время этапов одного запроса: пишется в общие гистограммы
+    и сохраняется для структурированного лога запроса.
+    rss_monitor - еще и пик RSS процесса за время запроса (общий ProcessRSSMonitor, до close()).
+    suspended - окно не открывается до resume() (запрос сразу уходит в очередь задач).
+    """
+
+    def __init__(self, rss_monitor=None, suspended=False):
+        self.stages = OrderedDict()
+        self.started = time.perf_counter()
+        self.current = None
+        self.memory = None
+        if rss_monitor is not None:
+            self.memory = rss_monitor.window(suspended=suspended)
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        self.current = name
+        try:
+            yield
+            # При ошибке current остается именем упавшего этапа
+            self.current = None
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stages[name] = self.stages.get(name, 0.0) + elapsed
+            STAGE_SECONDS.labels(name).observe(elapsed)
+
+    def suspend(self):
+        """Пауза опроса RSS, пока задача ждет в очереди (задачу могут отменить, так и не запустив)"""
+        if self.memory is not None:
+            self.memory.pause()
+
+    def resume(self):
+        """Опрос RSS снова идет - задача начала выполняться"""
+        if self.memory is not None:
+            self.memory.resume()
+
+    def as_ms(self):
+        return {name: round(seconds * 1000.0, 2) for name, seconds in self.stages.items()}
+
+    def total_ms(self):
+        return round((time.perf_counter() - self.started) * 1000.0, 2)
+
+    def close(self):
+        """
+        Закрывает окно RSS. Возвращает {process_peak_rss_mb, process_rss_growth_mb} для лога:
+        пик и рост RSS всего процесса за время запроса, а не память самого запроса
+        (параллельные запросы входят в пик друг друга).
+        """
+        if self.memory is None:
+            return {}
+        window, self.memory = self.memory, None
+        window.close()
+        CHECK_RSS_GROWTH.observe(window.peak_delta_bytes)
+        return {'process_peak_rss_mb': round(window.peak_bytes / 2 ** 20, 1),
+                'process_rss_growth_mb': round(window.peak_delta_bytes / 2 ** 20, 1)}
+
+
+def log_request(event, **fields):
+    """Одна строка JSON на запрос (по session_id их можно собрать в сессию)"""
+    record = {'ts': round(time.time(), 3), 'event': event}
+    record.update(fields)
+    print(json.dumps(record, ensure_ascii=False, default=str), flush=True)
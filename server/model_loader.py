@@ -0,0 +1,125 @@
+"""
+Загрузка модели в фоне.
+
+Импорт app не ждет весов: сервер сразу отвечает на /healthz, а модель
+загружается и прогревается в отдельном потоке. До конца прогрева
+/readyz отвечает 503 с текущей фазой, проверки - 503 с Retry-After.
+"""
+import threading
+import time
+
+# Фазы загрузки
+PENDING = 'pending'
+LOADING = 'loading'
+WARMING = 'warming'
+READY = 'ready'
+FAILED = 'failed'
+
+
+class ModelLoader:
+    """
+    load() → модель с интерфейсом predict (например, inference_backends.load_backend).
+    У самого загрузчика тот же predict: планировщик получает его вместо модели,
+    а первый вызов ждет окончания загрузки.
+    weights_path - путь к весам до загрузки (для статистики),
+    started - отсчет времени до готовности (time.perf_counter() начала импорта сервиса).
+    """
+
+    def __init__(self, load, weights_path=None, started=None):
+        self._load = load
+        self._weights_path = weights_path
+        self._model = None
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._thread = None
+        self.phase = PENDING
+        self.error = None
+        self.started = started if started is not None else time.perf_counter()
+        self.timings_ms = {}
+
+    def _mark(self, name, started):
+        self.timings_ms[name] = round((time.perf_counter() - started) * 1000.0, 1)
+
+    def load(self):
+        """Загрузка весов в текущем потоке (повторный вызов ничего не делает)"""
+        with self._lock:
+            if self._loaded.is_set():
+                return self.get()
+            self.phase = LOADING
+            started = time.perf_counter()
+            try:
+                self._model = self._load()
+            except Exception as e:
+                self.phase, self.error = FAILED, str(e)
+                raise
+            finally:
+                self._mark('load', started)
+                self._loaded.set()
+            self.phase = WARMING
+            return self._model
+
+    def warm_up(self, warmup=None):
+        """Прогрев загруженной модели, после него - готовность"""
+        self.get()
+        self.phase = WARMING
+        started = time.perf_counter()
+        try:
+            if warmup is not None:
+                warmup()
+        except Exception as e:
+            self.phase, self.error = FAILED, str(e)
+            raise
+        finally:
+            self._mark('warmup', started)
+        self.phase = READY
+        self._mark('ready', self.started)
+
+    def start(self, warmup=None, on_ready=None):
+        """
+        Загрузка (если веса еще не загружены) и прогрев в фоновом потоке.
+        При preload вызывается в каждом воркере после fork: веса уже
+        загружены в мастер-процессе, в воркере остается только прогрев.
+        """
+        def run():
+            try:
+                self.load()
+                self.warm_up(warmup)
+            except Exception as e:
+                print(f"Ошибка загрузки модели {self.weights_path}: {str(e)}")
+                import traceback
+                print(f"Трассировка: {traceback.format_exc()}")
+                return
+            if on_ready is not None:
+                on_ready()
+
+        self._thread = threading.Thread(target=run, name="model-loader", daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def get(self, timeout=None):
+        """Загруженная модель (ждет загрузки). При ошибке загрузки - RuntimeError"""
+        if not self._loaded.wait(timeout):
+            raise TimeoutError("Модель еще загружается")
+        if self._model is None:
+            raise RuntimeError(f"Модель не загружена: {self.error}")
+        return self._model
+
+    def predict(self, source, *args, **kwargs):
+        return self.get().predict(source, *args, **kwargs)
+
+    @property
+    def ready(self):
+        return self.phase == READY
+
+    @property
+    def weights_path(self):
+        return getattr(self._model, 'weights_path', self._weights_path)
+
+    def stats(self):
+        return {
+            'phase': self.phase,
+            'ready': self.ready,
+            'error': self.error,
+            'weights': self.weights_path,
+            'startup_ms': dict(self.timings_ms),
+        }
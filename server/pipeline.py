@@ -0,0 +1,266 @@
+import io
+import base64
+
+from process_image import build_annotations, build_overlay
+from process_arrow_heads import process_arrow_heads
+from process_arrow_distances import process_arrow_distances
+from process_text import process_text
+from process_borders import check_borders, FRAME_OK_TEXT, FRAME_FAILED_TEXT
+from gost_rules import evaluate_detections
+from detections import detect, DEFAULT_IMGSZ
+from large_image import LargeImage
+from tiled_inference import detect_tiled
+from cascade import refine_borderline
+from metrics import StageTimings, observe_detections
+from annotations import AnnotationLayer
+from stage_graph import Stage, StageGraph
+
+# Этапы в порядке выполнения и соответствующие разделы отчета
+STAGES = (
+    ('frame_check', 'frame_check'),
+    ('detection', 'detection'),
+    ('arrow_heads', 'arrow_heads_check'),
+    ('arrow_distances', 'arrow_distances_check'),
+    ('text', 'text_check'),
+    ('final_image', None),
+)
+
+# Потоков в пуле этапов по умолчанию
+DEFAULT_STAGE_WORKERS = 4
+
+
+def _no_stage(name, data):
+    pass
+
+
+# Пул этапов по умолчанию (сервис передает свой, см. app.py)
+_default_graph = None
+
+
+def default_graph():
+    global _default_graph
+    if _default_graph is None:
+        _default_graph = StageGraph(max_workers=DEFAULT_STAGE_WORKERS)
+    return _default_graph
+
+
+def run_pipeline(image_np, model, on_stage=None, tiling=None, timings=None, detect_fn=None, render=True,
+                 graph=None, cancel=None, timeouts=None, on_detections=None, cascade=None):
+    """
+    Полная проверка одного чертежа.
+    image_np - RGB-массив (только для чтения), все этапы работают с ним без копий,
+    или large_image.LargeImage: детекция и картинка результата - по уменьшенной копии,
+    полное разрешение читается из файла только для уточнения рамки и тайлов
+    Возвращает финальное изображение, общий текст и структурированный отчет.
+    on_stage(name, data) вызывается по завершении каждого этапа (из потока этапа)
+    tiling - параметры detect_tiled для нарезанного инференса (None - вся страница в 640 px)
+    cascade - параметры cascade.refine_borderline: пограничные детекции перепроверяются
+    по окнам в родном разрешении (None - без перепроверки; при нарезке не нужен)
+    timings - metrics.StageTimings для времени этапов (иначе создается свой)
+    detect_fn(image_np, рамка x0, y0, x1, y1 или None, cancel=...) → (Detections, отчет) - своя
+    детекция вместо прогона по всему листу (например, incremental.IncrementalDetector)
+    render=False - вместо финального изображения вернуть векторную разметку нарушений
+    (AnnotationLayer, см. build_overlay): без растеризации и кодирования страницы
+    graph - stage_graph.StageGraph (пул этапов), cancel - threading.Event отмены,
+    timeouts - {этап: секунды}. Поиск рамки и детекция идут параллельно;
+    ошибка поиска рамки не отменяет проверки по детекциям.
+    on_detections(Detections, отчет детекции) - детекции основной модели (для теневой проверки)
+    """
+    on_stage = on_stage or _no_stage
+    timings = timings or StageTimings()
+    timeouts = timeouts or {}
+    large = isinstance(image_np, LargeImage)
+    pixels = image_np.full if large else image_np
+
+    # 1. ПРОВЕРКА РАМКИ
+    def frame_check(results):
+        with timings.stage('frame_check'):
+            annotations, frame_text, frame_rules = check_borders(image_np, cancel)
+        on_stage('frame_check', {'result': frame_text})
+        return annotations, frame_text, frame_rules, None
+
+    def frame_failed(error):
+        # Без рамки остальные проверки все равно выполняются
+        frame_text = f"{FRAME_FAILED_TEXT}: {error}"
+        on_stage('frame_check', {'result': frame_text, 'error': str(error)})
+        return AnnotationLayer(), frame_text, None, str(error)
+
+    # Один прогон детектора на весь запрос
+    def detection(results):
+        with timings.stage('detection'):
+            if detect_fn is not None:
+                frame_rules = results['frame_check'][2]
+                frame_box = frame_rules.table.boxes[0] if frame_rules is not None else None
+                detections, detection_report = detect_fn(pixels, frame_box, cancel=cancel)
+            elif tiling:
+                # У крупного скана тайлы читаются из файла по одному
+                detections, detection_report = detect_tiled(pixels, model, cancel=cancel, **tiling)
+            elif large:
+                # Модель все равно видит 640 px: уменьшенной копии достаточно
+                detections = detect(image_np.preview, model, cancel=cancel).scaled(image_np.factor)
+                detection_report = {'mode': 'full', 'imgsz': DEFAULT_IMGSZ}
+            else:
+                detections = detect(image_np, model, cancel=cancel)
+                detection_report = {'mode': 'full', 'imgsz': DEFAULT_IMGSZ}
+        if cascade and not tiling:
+            # Второй проход только по боксам у границ допусков
+            with timings.stage('cascade'):
+                detections, detection_report['cascade'] = refine_borderline(pixels, detections, model,
+                                                                             cancel=cancel, **cascade)
+        if large:
+            detection_report['large_image'] = image_np.report()
+        observe_detections(detections)
+        on_stage('detection', detection_report)
+        return detections, detection_report
+
+    # Все правила ГОСТ по детекциям - одной таблицей за один проход
+    def rules(results):
+        with timings.stage('rules'):
+            return evaluate_detections(results['detection'][0])
+
+    # 2. ПРОВЕРКА НАКОНЕЧНИКОВ СТРЕЛОК
+    def arrow_heads(results):
+        with timings.stage('arrow_heads'):
+            violations, stats, text, _ = process_arrow_heads(
+                pixels, detections=results['detection'][0], render=False, evaluation=results['rules'])
+        check = {
+            'result': text,
+            'violations': violations,
+            'statistics': stats,
+            'gost_standard': 'ГОСТ 2.307-68'
+        }
+        on_stage('arrow_heads', check)
+        return check
+
+    # 3. ПРОВЕРКА РАССТОЯНИЙ
+    def arrow_distances(results):
+        with timings.stage('arrow_distances'):
+            violations, stats, text, _ = process_arrow_distances(
+                pixels, detections=results['detection'][0], render=False, evaluation=results['rules'])
+        check = {
+            'result': text,
+            'violations': violations,
+            'statistics': stats,
+            'gost_standard': 'ГОСТ 2.307-68'
+        }
+        on_stage('arrow_distances', check)
+        return check
+
+    # 4. ПРОВЕРКА ТЕКСТА
+    def text(results):
+        with timings.stage('text'):
+            violations, warnings, stats, text, _ = process_text(
+                pixels, detections=results['detection'][0], render=False, evaluation=results['rules'])
+        check = {
+            'result': text,
+            'violations': violations,
+            'warnings': warnings,
+            'statistics': stats,
+            'gost_standard': 'ГОСТ 2.304-81'
+        }
+        on_stage('text', check)
+        return check
+
+    def final_image(results):
+        annotations, frame_text, frame_rules, _ = results['frame_check']
+        if not render:
+            # Только векторная разметка нарушений - клиент рисует ее поверх своего изображения
+            with timings.stage('overlay'):
+                overlay = build_overlay(frame_rules, results['rules'], frame_text)
+            on_stage('final_image', {'width': image_np.shape[1], 'height': image_np.shape[0],
+                                     'overlay_items': len(overlay)})
+            return overlay
+
+        # финальное изображение все со всем: примитивы растеризуются один раз
+        with timings.stage('final_image'):
+            annotations.extend(build_annotations(
+                arrow_heads_violations_data=results['arrow_heads']['violations'],
+                arrow_distances_violations_data=results['arrow_distances']['violations'],
+                text_violations_data=results['text']['violations'],
+                detections=results['detection'][0]
+            ))
+            if large:
+                # Картинка результата - в разрешении рабочей копии
+                image = annotations.scaled(1.0 / image_np.factor).rasterize(image_np.preview)
+            else:
+                image = annotations.rasterize(image_np)
+        on_stage('final_image', {'width': image.width, 'height': image.height})
+        return image
+
+    checks = ('arrow_heads', 'arrow_distances', 'text')
+    results = (graph or default_graph()).run([
+        Stage('frame_check', frame_check, timeout=timeouts.get('frame_check'), fallback=frame_failed),
+        # Своей детекции (инкрементальной) нужна рамка, обычная от нее не зависит
+        Stage('detection', detection, deps=('frame_check',) if detect_fn is not None else (),
+              timeout=timeouts.get('detection')),
+        Stage('rules', rules, deps=('detection',), timeout=timeouts.get('rules')),
+        Stage('arrow_heads', arrow_heads, deps=('detection', 'rules'), timeout=timeouts.get('arrow_heads')),
+        Stage('arrow_distances', arrow_distances, deps=('detection', 'rules'),
+              timeout=timeouts.get('arrow_distances')),
+        Stage('text', text, deps=('detection', 'rules'), timeout=timeouts.get('text')),
+        Stage('final_image', final_image, deps=('frame_check', 'detection', 'rules') + checks,
+              timeout=timeouts.get('final_image')),
+    ], cancel=cancel)
+
+    _, frame_text, frame_rules, frame_error = results['frame_check']
+    frame_check = {'result': frame_text}
+    if frame_error is not None:
+        frame_check['error'] = frame_error
+    detection_report = results['detection'][1]
+    if on_detections is not None:
+        on_detections(results['detection'][0], detection_report)
+    evaluation = results['rules']
+    arrow_heads_check, arrow_distances_check, text_check = (results[name] for name in checks)
+
+    # ОБЪЕДИНЯЕМ ВСЕ РЕЗУЛЬТАТЫ
+    all_violations = (arrow_heads_check['violations'] + arrow_distances_check['violations'] +
+                      text_check['violations'])
+
+    # Формируем общий текст результата
+    combined_text = f"""📐 ПРОВЕРКА РАМКИ:
+{frame_text}
+
+🎯 ПРОВЕРКА НАКОНЕЧНИКОВ СТРЕЛОК (ГОСТ 2.307-68):
+{arrow_heads_check['result']}
+
+📏 ПРОВЕРКА РАССТОЯНИЙ (ГОСТ 2.307-68):
+{arrow_distances_check['result']}
+
+📝 ПРОВЕРКА ТЕКСТА (ГОСТ 2.304-81):
+{text_check['result']}"""
+
+    full_report = {
+        'frame_check': frame_check,
+        'arrow_heads_check': arrow_heads_check,
+        'arrow_distances_check': arrow_distances_check,
+        'text_check': text_check,
+        'detection': detection_report,
+        # Нарушения всех правил в структурированном виде (правило, стандарт, значение, бокс)
+        'rule_violations': (frame_rules.violations() if frame_rules is not None else []) + evaluation.violations(),
+        'summary': {
+            'total_violations': len(all_violations),
+            'has_violations': len(all_violations) > 0
+        }
+    }
+
+    return results['final_image'], combined_text, full_report
+
+
+def violation_counts(full_report):
+    """Число нарушений по каждой проверке ГОСТ (для сводки по набору листов)"""
+    frame_lines = full_report['frame_check']['result'].splitlines()
+    if 'error' in full_report['frame_check']:
+        frame_lines = []
+    return {
+        'frame': sum(1 for line in frame_lines if line and line != FRAME_OK_TEXT),
+        'arrow_heads': len(full_report['arrow_heads_check']['violations']),
+        'arrow_distances': len(full_report['arrow_distances_check']['violations']),
+        'text': len(full_report['text_check']['violations']),
+    }
+
+
+def encode_png_base64(image):
+    """PNG → base64-строка для JSON"""
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode('utf-8')
@@ -1,20 +1,22 @@
-import math
 import numpy as np
-from PIL import Image, ImageDraw
 
+from annotations import AnnotationLayer, layer_output
+from detections import ensure_detections, CLS_ARROW
+from gost_rules import evaluate_detections
 
-def process_arrow_distances(image: np.ndarray, model):
+
+def process_arrow_distances(image: np.ndarray, model=None, detections=None, render=True, evaluation=None):
     """
     Проверка расстояний от наконечников стрелок до объектов по ГОСТ 2.307-68
+    detections - готовый результат детектора (если нет, модель запускается здесь)
+    evaluation - готовая проверка правил gost_rules по этим детекциям
+    render=False - вместо картинки вернуть AnnotationLayer (эта проверка ничего не рисует)
     """
-    pil_image = Image.fromarray(image)
-
-    results = model.predict(image, imgsz=640)
-    boxes = results[0].boxes.xyxy.cpu().numpy()
-    classes = results[0].boxes.cls.cpu().numpy()
+    layer = AnnotationLayer()
 
-    arrows = [box for box, cls in zip(boxes, classes) if cls == 0]
-    objects = [box for box, cls in zip(boxes, classes) if cls == 1]
+    detections = ensure_detections(image, model, detections)
+    arrows = detections.arrows
+    objects = detections.objects
 
     violations = []
     warnings = []
@@ -25,54 +27,26 @@ def process_arrow_distances(image: np.ndarray, model):
     }
 
     if len(arrows) == 0:
-        return violations, statistics, "Стрелки не обнаружены", pil_image
-
-    px_to_mm = 0.15
+        return violations, statistics, "Стрелки не обнаружены", layer_output(image, layer, render)
 
-    # Группируем стрелки по объектам
-    object_arrows = {}
+    # Привязка стрелок к ближайшим объектам и номера внутри групп - в таблице правил
+    evaluation = evaluation or evaluate_detections(detections)
+    matches = evaluation.table.matches
+    statistics['matched_pairs'] = int(matches.matched.sum())
+    arrow_rows = evaluation.table.rows_of_class(CLS_ARROW)
 
-    for i, arrow in enumerate(arrows):
-        arrow_center = [(arrow[0] + arrow[2]) / 2, (arrow[1] + arrow[3]) / 2]
-        min_distance_px = float('inf')
-        closest_obj_idx = None
-
-        for j, obj in enumerate(objects):
-            obj_center = [(obj[0] + obj[2]) / 2, (obj[1] + obj[3]) / 2]
-            distance_px = math.dist(arrow_center, obj_center)
-            if distance_px < min_distance_px:
-                min_distance_px = distance_px
-                closest_obj_idx = j
+    # Проверяем расстояния для каждой группы
+    for arrow_idx in matches.ordered_indices():
+        order = matches.order[arrow_idx]
+        row = arrow_rows[arrow_idx]
 
-        if closest_obj_idx is not None:
-            if closest_obj_idx not in object_arrows:
-                object_arrows[closest_obj_idx] = []
-            object_arrows[closest_obj_idx].append((i, arrow, min_distance_px))
+        # Правило: первая стрелка - 10±2 мм, последующие - 7±2 мм
+        rule_id = 'arrow_first_distance' if order == 0 else 'arrow_next_distance'
 
-    # Проверяем расстояния для каждой группы
-    for obj_idx, arrows_data in object_arrows.items():
-        arrows_data.sort(key=lambda x: x[2])  # сортируем по расстоянию
-
-        for order, (arrow_idx, arrow, distance_px) in enumerate(arrows_data):
-            distance_mm = distance_px * px_to_mm
-
-            # Правило: первая стрелка - 10±2 мм, последующие - 7±2 мм
-            if order == 0:
-                target_min, target_max = 8.0, 12.0
-                arrow_type = "первая"
-            else:
-                target_min, target_max = 5.0, 9.0
-                arrow_type = f"{order + 1}-я"
-
-            if not (target_min <= distance_mm <= target_max):
-                violations.append(
-                    f"{arrow_type.capitalize()} стрелка {arrow_idx + 1}: расстояние {distance_mm:.1f} мм "
-                    f"вне диапазона {target_min}-{target_max} мм"
-                )
-            else:
-                warnings.append(
-                    f"{arrow_type.capitalize()} стрелка {arrow_idx + 1}: расстояние {distance_mm:.1f} мм - норма"
-                )
+        if not evaluation.is_ok(rule_id, row):
+            violations.append(evaluation.message(rule_id, row))
+        else:
+            warnings.append(evaluation.message(rule_id, row, ok=True))
 
     # Формируем итоговый текст
     result_lines = []
@@ -92,4 +66,4 @@ def process_arrow_distances(image: np.ndarray, model):
 
     result_text = "\n".join(result_lines)
 
-    return violations, statistics, result_text, pil_image
\ No newline at end of file
+    return violations, statistics, result_text, layer_output(image, layer, render)
\ No newline at end of file
@@ -1,42 +1,32 @@
 import numpy as np
-from PIL import Image, ImageDraw
 
+from annotations import AnnotationLayer, layer_output
+from detections import ensure_detections
+from gost_rules import evaluate_detections
 
-def process_arrow_heads(image: np.ndarray, model):
+
+def process_arrow_heads(image: np.ndarray, model=None, detections=None, render=True, evaluation=None):
     """
     Проверка наконечников стрелок по ГОСТ 2.307-68
+    detections - готовый результат детектора (если нет, модель запускается здесь)
+    evaluation - готовая проверка правил gost_rules по этим детекциям
+    render=False - вместо картинки с разметкой вернуть AnnotationLayer
     """
-    pil_image = Image.fromarray(image)
-    draw = ImageDraw.Draw(pil_image)
-
-    results = model.predict(image, imgsz=640)
-    boxes = results[0].boxes.xyxy.cpu().numpy()
-    classes = results[0].boxes.cls.cpu().numpy()
+    layer = AnnotationLayer()
 
-    arrows = [box for box, cls in zip(boxes, classes) if cls == 0]
+    detections = ensure_detections(image, model, detections)
+    arrows = detections.arrows
     violations = []
     statistics = {'total_arrows': len(arrows)}
 
     if len(arrows) == 0:
-        return violations, statistics, "Ошибок нет", pil_image
-
-    # ИСПРАВЛЕННЫЙ КОЭФФИЦИЕНТ - более реалистичный
-    px_to_mm = 0.15  # 1px = 0.15mm (вместо 0.36 при dpi=70)
-
-    # Целевые размеры в мм
-    ARROW_HEAD_TARGET_MM = 4.0
-    ARROW_HEAD_TOLERANCE_MM = 1.0
+        return violations, statistics, "Ошибок нет", layer_output(image, layer, render)
 
-    for i, arrow in enumerate(arrows):
-        width_px = arrow[2] - arrow[0]
-        height_px = arrow[3] - arrow[1]
-        arrow_size_px = max(width_px, height_px)
-        arrow_size_mm = arrow_size_px * px_to_mm
+    evaluation = evaluation or evaluate_detections(detections)
 
-        if not (
-                ARROW_HEAD_TARGET_MM - ARROW_HEAD_TOLERANCE_MM <= arrow_size_mm <= ARROW_HEAD_TARGET_MM + ARROW_HEAD_TOLERANCE_MM):
-            violations.append(f"Наконечник {i + 1} ({arrow_size_mm:.1f} мм) не соответствует ГОСТ 2.307-68 (4-5 мм)")
-            draw.rectangle([arrow[0], arrow[1], arrow[2], arrow[3]], outline="red", width=3)
+    for row in evaluation.bad_rows('arrow_head_size'):
+        violations.append(evaluation.message('arrow_head_size', row))
+        layer.rect(evaluation.table.boxes[row], "red", width=3, kind='arrow_heads')
 
     result_text = "\n".join(violations) if violations else "Все наконечники соответствуют ГОСТ 2.307-68"
-    return violations, statistics, result_text, pil_image
\ No newline at end of file
+    return violations, statistics, result_text, layer_output(image, layer, render)
@@ -1,64 +1,54 @@
-from PIL import Image, ImageDraw
 import numpy as np
 import cv2
 
-# ГОСТы
-GOST_TOP = 5
-GOST_RIGHT = 5
-GOST_BOTTOM = 5
-GOST_LEFT = 20
+from annotations import AnnotationLayer, layer_output
+from gost_rules import DetectionTable, FRAME_RULES, evaluate
+from large_image import LargeImage
+from stage_graph import Cancelled
 
-# Размеры A3 в мм
+# Размеры A3 в мм (поля рамки по ГОСТ - в gost_rules.FRAME_RULES)
 A3_WIDTH_MM = 297
 A3_HEIGHT_MM = 420
 
-TOLERANCE = 0.6  # погрешность ±0.6 мм
+# Поиск рамки от грубого к точному
+COARSE_MAX_SIDE = 1024  # длинная сторона уменьшенной копии, px
+MIN_FRAME_AREA_RATIO = 0.05  # рамка занимает не меньше этой доли листа
+REFINE_MIN_LINE_FILL = 0.3  # доля полосы, вдоль которой должна тянуться линия рамки
 
+# Текст проверки рамки без нарушений
+FRAME_OK_TEXT = "Все стороны соответствуют размерам"
+# Начало текста, если рамку проверить не удалось
+FRAME_FAILED_TEXT = "Проверка рамки не выполнена"
 
-def _pil_to_cv(img_pil: Image.Image):
-    """PIL → OpenCV (BGR)"""
-    if img_pil.mode == "RGBA":
-        img_pil = img_pil.convert("RGB")
-    img = np.array(img_pil)
-    return cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
 
-
-def _cv_to_pil(img_cv):
-    """OpenCV → PIL"""
-    rgb = cv2.cvtColor(img_cv, cv2.COLOR_BGR2RGB)
-    return Image.fromarray(rgb)
+def _edges(gray):
+    blur = cv2.GaussianBlur(gray, (5, 5), 0)
+    return cv2.Canny(blur, 50, 150)
 
 
-def _check(val, need, tol=TOLERANCE):
-    """Проверка значения с погрешностью"""
-    diff = abs(val - need)
-    ok = (need - tol) <= val <= (need + tol)
-    return diff, ok
+def _check_cancel(cancel):
+    if cancel is not None and cancel.is_set():
+        raise Cancelled("Проверка отменена")
 
 
-def process_borders(image: Image.Image):
+def _find_quad(edges, min_area=0, cancel=None):
     """
-    Возвращает изображение с рамкой и текст с проверкой размеров сторон.
+    Самый большой четырехугольник среди контуров.
+    Контуры с площадью описанного прямоугольника меньше min_area
+    отбрасываются до аппроксимации (штриховка, текст).
     """
-
-    img = _pil_to_cv(image)
-    h, w = img.shape[:2]
-
-    # коэффициенты px → mm
-    px_to_mm_x = A3_WIDTH_MM / w
-    px_to_mm_y = A3_HEIGHT_MM / h
-
-    # поиск рамки
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    edges = cv2.Canny(blur, 50, 150)
-
     contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    _check_cancel(cancel)
 
-    max_area = 0
+    # Четырехугольник меньше min_area тоже не считается рамкой
+    max_area = min_area
     best_rect = None
 
     for cnt in contours:
+        if min_area:
+            _, _, cnt_w, cnt_h = cv2.boundingRect(cnt)
+            if cnt_w * cnt_h < min_area:
+                continue
         approx = cv2.approxPolyDP(cnt, 0.01 * cv2.arcLength(cnt, True), True)
         if len(approx) == 4:
             area = cv2.contourArea(approx)
@@ -66,39 +56,168 @@ def process_borders(image: Image.Image):
                 max_area = area
                 best_rect = approx
 
+    return best_rect
+
+
+def _refine_edge(gray, axis, lo, hi, span_lo, span_hi, outer_first):
+    """
+    Уточняет положение одной стороны рамки в узкой полосе полного разрешения.
+    axis=1 - вертикальная сторона (ищем столбец), axis=0 - горизонтальная (строку).
+    [lo, hi) - границы полосы поперек стороны, [span_lo, span_hi) - вдоль нее.
+    Возвращает координату внешнего края линии или None.
+    """
+    if axis == 1:
+        strip = gray[span_lo:span_hi, lo:hi]
+    else:
+        strip = gray[lo:hi, span_lo:span_hi]
+    if strip.size == 0:
+        return None
+
+    profile = _edges(strip).sum(axis=0 if axis == 1 else 1) / 255
+    peak = profile.max()
+    # Настоящая линия рамки тянется почти вдоль всей полосы
+    if peak < REFINE_MIN_LINE_FILL * (span_hi - span_lo):
+        return None
+
+    strong = np.flatnonzero(profile >= 0.5 * peak)
+    return lo + (strong[0] if outer_first else strong[-1])
+
+
+def _refine_rect(gray, x, y, rect_w, rect_h, scale, cancel=None):
+    """Уточнение грубого прямоугольника по четырем полосам вокруг сторон"""
+    h, w = gray.shape[:2]
+    # Погрешность грубого уровня в пикселях полного разрешения
+    r = int(np.ceil(2 / scale)) + 2
+
+    x0, y0, x1, y1 = x, y, x + rect_w, y + rect_h
+    # Вдоль стороны отступаем от углов, чтобы не захватывать соседние стороны
+    span_y = (max(0, y0 + r), min(h, y1 - r))
+    span_x = (max(0, x0 + r), min(w, x1 - r))
+
+    # Полосы крупного скана читаются из файла - между ними проверяем отмену
+    left = _refine_edge(gray, 1, max(0, x0 - r), min(w, x0 + r + 1), *span_y, outer_first=True)
+    _check_cancel(cancel)
+    right = _refine_edge(gray, 1, max(0, x1 - r - 1), min(w, x1 + r), *span_y, outer_first=False)
+    _check_cancel(cancel)
+    top = _refine_edge(gray, 0, max(0, y0 - r), min(h, y0 + r + 1), *span_x, outer_first=True)
+    _check_cancel(cancel)
+    bottom = _refine_edge(gray, 0, max(0, y1 - r - 1), min(h, y1 + r), *span_x, outer_first=False)
+
+    x0 = x0 if left is None else left
+    y0 = y0 if top is None else top
+    x1 = x1 if right is None else right + 1
+    y1 = y1 if bottom is None else bottom + 1
+    return int(x0), int(y0), int(x1 - x0), int(y1 - y0)
+
+
+def find_frame(image, cancel=None):
+    """
+    Поиск рамки от грубого к точному.
+    Кандидат ищется на уменьшенной копии, стороны уточняются в узких
+    полосах полного разрешения. Если на грубом уровне крупной рамки нет,
+    ищем как раньше - по всем контурам в полном разрешении.
+    image - PIL-изображение, RGB-массив или large_image.LargeImage
+    (грубый поиск - по его рабочей копии, уточнение - по полосам из файла).
+    cancel - threading.Event отмены: поиск прерывается между шагами (stage_graph.Cancelled).
+    Возвращает (x, y, w, h) в пикселях исходного изображения.
+    """
+    if isinstance(image, LargeImage):
+        base = cv2.cvtColor(image.preview, cv2.COLOR_RGB2GRAY)
+        return _find_frame(image.gray_strips(), base, image.factor, cancel)
+
+    rgb = np.asarray(image)
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    return _find_frame(gray, gray, 1, cancel)
+
+
+def _find_frame(gray, base, base_factor, cancel=None):
+    """
+    gray - серое полного разрешения (для уточнения сторон),
+    base - серое, уменьшенное в base_factor раз (для грубого поиска).
+    """
+    h, w = base.shape[:2]
+
+    # Целый коэффициент: INTER_AREA тогда сводится к быстрому усреднению блоков
+    factor = int(np.ceil(max(h, w) / COARSE_MAX_SIDE))
+    if factor > 1:
+        coarse = cv2.resize(base, None, fx=1.0 / factor, fy=1.0 / factor, interpolation=cv2.INTER_AREA)
+    else:
+        coarse = base
+    scale = 1.0 / (factor * base_factor)
+    coarse_edges = _edges(coarse)
+    _check_cancel(cancel)
+
+    best_rect = _find_quad(coarse_edges, min_area=MIN_FRAME_AREA_RATIO * coarse.size, cancel=cancel)
+    if best_rect is not None:
+        x, y, rect_w, rect_h = cv2.boundingRect(best_rect)
+        if scale == 1.0:
+            return x, y, rect_w, rect_h
+        x, y = round(x / scale), round(y / scale)
+        rect_w, rect_h = round(rect_w / scale), round(rect_h / scale)
+        return _refine_rect(gray, x, y, rect_w, rect_h, scale, cancel)
+
+    # Запасной путь: без порога по площади, в разрешении base
+    edges = coarse_edges if factor == 1 else _edges(base)
+    _check_cancel(cancel)
+    best_rect = _find_quad(edges, cancel=cancel)
     if best_rect is None:
         raise ValueError("Рамка не найдена")
-
     x, y, rect_w, rect_h = cv2.boundingRect(best_rect)
+    return x * base_factor, y * base_factor, rect_w * base_factor, rect_h * base_factor
 
-    # переводим в мм
-    dist_left_mm = x * px_to_mm_x
-    dist_top_mm = y * px_to_mm_y
-    dist_right_mm = (w - (x + rect_w)) * px_to_mm_x
-    dist_bottom_mm = (h - (y + rect_h)) * px_to_mm_y
 
-    # проверяем границы
-    errors = []
+def check_borders(image_np, cancel=None):
+    """
+    Поиск рамки и проверка полей по правилам FRAME_RULES.
+    image_np - RGB-массив или large_image.LargeImage, cancel - см. find_frame.
+    Возвращает (AnnotationLayer с рамкой, текст проверки, gost_rules.RuleEvaluation).
+    """
+    h, w = image_np.shape[:2]
 
-    def add_check(name, val, gost):
-        diff, ok = _check(val, gost)
-        if not ok:
-            errors.append(
-                f"{name}: {val:.2f} мм (отклонение {diff:.2f} мм, требуется {gost} мм ±{TOLERANCE} мм)"
-            )
+    # коэффициенты px → mm
+    px_to_mm_x = A3_WIDTH_MM / w
+    px_to_mm_y = A3_HEIGHT_MM / h
+
+    # поиск рамки
+    x, y, rect_w, rect_h = find_frame(image_np, cancel)
 
-    add_check("Слева", dist_left_mm, GOST_LEFT)
-    add_check("Сверху", dist_top_mm, GOST_TOP)
-    add_check("Справа", dist_right_mm, GOST_RIGHT)
-    add_check("Снизу", dist_bottom_mm, GOST_BOTTOM)
+    # переводим в мм: слева, сверху, справа, снизу
+    margins_mm = (
+        x * px_to_mm_x,
+        y * px_to_mm_y,
+        (w - (x + rect_w)) * px_to_mm_x,
+        (h - (y + rect_h)) * px_to_mm_y,
+    )
+    frame_box = (x, y, x + rect_w, y + rect_h)
+
+    # проверяем границы
+    evaluation = evaluate(DetectionTable.from_frame(margins_mm, frame_box), FRAME_RULES)
+    errors = [evaluation.message(rule.id, row) for rule in FRAME_RULES for row in evaluation.bad_rows(rule.id)]
 
     # рисуем рамку
-    cv2.rectangle(img, (x, y), (x + rect_w, y + rect_h), (0, 255, 0), 4)
-    output_pil = _cv_to_pil(img)
+    layer = AnnotationLayer()
+    layer.rect(frame_box, (0, 255, 0), width=4, centered=True, kind='frame')
 
     if len(errors) == 0:
-        errors.append("Все стороны соответствуют размерам")
+        errors.append(FRAME_OK_TEXT)
 
-    text = "\n".join(errors)
+    return layer, "\n".join(errors), evaluation
 
-    return output_pil, text
\ No newline at end of file
+
+def process_borders(image, image_np=None, render=True, cancel=None):
+    """
+    Возвращает изображение с рамкой и текст с проверкой размеров сторон.
+    image - PIL-изображение или RGB-массив
+    image_np - уже готовый RGB-массив того же изображения (чтобы не копировать еще раз)
+    render=False - вместо картинки вернуть AnnotationLayer с рамкой
+    cancel - threading.Event отмены (см. find_frame)
+    """
+    if isinstance(image, np.ndarray):
+        image_np = image
+    elif image.mode != "RGB":
+        image_np = np.asarray(image.convert("RGB"))
+    elif image_np is None:
+        image_np = np.asarray(image)
+
+    layer, text, _ = check_borders(image_np, cancel)
+    return layer_output(image_np, layer, render), text
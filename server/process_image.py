@@ -1,92 +1,131 @@
-from PIL import Image, ImageDraw
+from PIL import Image
 import numpy as np
-import math
-import io
 
+from annotations import AnnotationLayer
+from detections import ensure_detections
 
-def get_image_from_request(file):
-    """Универсальная функция для получения изображения из запроса"""
+# Разные цвета для разных типов нарушений
+ANNOTATION_COLORS = {
+    'arrow_heads': 'pink',
+    'arrow_distances': 'blue',
+    'text': 'green',
+    'frame': 'orange'
+}
+
+
+def decode_rgb(image):
+    """Открытое PIL-изображение → RGB-массив только для чтения"""
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image_np = np.asarray(image)
+    image_np.flags.writeable = False
+    return image_np
+
+
+def load_image(file):
+    """
+    Декодирует загруженный файл один раз в RGB-массив только для чтения.
+    Файл читается прямо из потока запроса, без промежуточной копии в bytes.
+    Все этапы работают с видами (view) этого массива.
+    Крупные сканы с ограничением памяти - large_image.open_image.
+    """
     try:
-        # Сохраняем файл в памяти для многократного использования
-        file_bytes = file.read()
-        file_stream = io.BytesIO(file_bytes)
-        image = Image.open(file_stream).convert("RGB")
-        image_np = np.array(image)
-        return image, image_np, file_stream
+        stream = getattr(file, 'stream', file)
+        with Image.open(stream) as image:
+            return decode_rgb(image)
     except Exception as e:
         raise Exception(f"Ошибка чтения изображения: {str(e)}")
 
 
-def create_final_image_with_all_annotations(original_image, processed_image,
-                                            arrow_heads_violations_data,
-                                            arrow_distances_violations_data,
-                                            text_violations_data, model):
+def get_image_from_request(file):
     """
-    Создает финальное изображение со всеми аннотациями разных типов
+    Универсальная функция для получения изображения из запроса.
+    Оставлена для совместимости, новый код использует load_image.
     """
-    # Начинаем с оригинального изображения
-    final_image = processed_image.copy()
-    draw = ImageDraw.Draw(final_image)
-
-    # Разные цвета для разных типов нарушений
-    colors = {
-        'arrow_heads': 'pink',
-        'arrow_distances': 'blue',
-        'text': 'green',
-        'frame': 'orange'
-    }
+    image_np = load_image(file)
+    return Image.fromarray(image_np), image_np, None
 
-    # 1. Рисуем нарушения наконечников стрелок (красные прямоугольники)
-    if arrow_heads_violations_data and len(arrow_heads_violations_data) > 0:
-        results = model.predict(np.array(original_image), imgsz=640)
-        boxes = results[0].boxes.xyxy.cpu().numpy()
-        classes = results[0].boxes.cls.cpu().numpy()
 
-        arrows = [box for box, cls in zip(boxes, classes) if cls == 0]
+def build_annotations(arrow_heads_violations_data,
+                      arrow_distances_violations_data,
+                      text_violations_data, detections):
+    """
+    Разметка финального изображения как векторные примитивы
+    (без рамки - ее добавляет process_borders)
+    """
+    colors = ANNOTATION_COLORS
+    layer = AnnotationLayer()
 
-        for i, arrow in enumerate(arrows):
-            draw.rectangle([arrow[0], arrow[1], arrow[2], arrow[3]],
-                           outline=colors['arrow_heads'], width=3)
+    # 1. Рисуем нарушения наконечников стрелок (красные прямоугольники)
+    if arrow_heads_violations_data and len(arrow_heads_violations_data) > 0:
+        for i, arrow in enumerate(detections.arrows):
+            layer.rect(arrow, colors['arrow_heads'], width=3, kind='arrow_heads',
+                       label=f"Strelka {i + 1}")
             # Подпись для наконечника
-            draw.text((arrow[0], arrow[1] - 20), f"Strelka {i + 1}",
-                      fill=colors['arrow_heads'])
-
-    # 2. Рисуем нарушения расстояний (синие линии)
-    if arrow_distances_violations_data and len(arrow_distances_violations_data) > 0:
-        results = model.predict(np.array(original_image), imgsz=640)
-        boxes = results[0].boxes.xyxy.cpu().numpy()
-        classes = results[0].boxes.cls.cpu().numpy()
-
-        arrows = [box for box, cls in zip(boxes, classes) if cls == 0]
-        objects = [box for box, cls in zip(boxes, classes) if cls == 1]
-
-        for i, arrow in enumerate(arrows):
-            arrow_center = [(arrow[0] + arrow[2]) / 2, (arrow[1] + arrow[3]) / 2]
-            min_distance_px = float('inf')
-            closest_obj = None
-
-            for obj in objects:
-                obj_center = [(obj[0] + obj[2]) / 2, (obj[1] + obj[3]) / 2]
-                distance_px = math.dist(arrow_center, obj_center)
-                if distance_px < min_distance_px:
-                    min_distance_px = distance_px
-                    closest_obj = obj
+            layer.text((arrow[0], arrow[1] - 20), f"Strelka {i + 1}",
+                       colors['arrow_heads'], kind='arrow_heads')
+
+    # 2. Нарушения расстояний на изображении не рисуются - только в тексте проверки
+    # (линии стрелка - объект есть в overlay-разметке, см. build_overlay)
 
     # 3. Рисуем нарушения текста (зеленые прямоугольники)
     if text_violations_data and len(text_violations_data) > 0:
-        results = model.predict(np.array(original_image), imgsz=640)
-        boxes = results[0].boxes.xyxy.cpu().numpy()
-        classes = results[0].boxes.cls.cpu().numpy()
+        for i, text in enumerate(detections.texts):
+            layer.rect(text, colors['text'], width=3, kind='text', label=f"Text {i + 1}")
+            # Подпись для текста
+            layer.text((text[0], text[1] - 20), f"Text {i + 1}",
+                       colors['text'], kind='text')
 
-        texts = [box for box, cls in zip(boxes, classes) if cls == 2]
+    return layer
 
-        for i, text in enumerate(texts):
-            draw.rectangle([text[0], text[1], text[2], text[3]],
-                           outline=colors['text'], width=3)
-            # Подпись для текста
-            draw.text((text[0], text[1] - 20), f"Text {i + 1}",
-                      fill=colors['text'])
 
+def build_overlay(frame_rules, evaluation, frame_text):
+    """
+    Векторная разметка для клиента вместо картинки (режим overlay):
+    рамка и каждое нарушение правил ГОСТ - тип проверки (ключ цвета),
+    координаты, подпись и текст нарушения.
+    frame_rules, evaluation - gost_rules.RuleEvaluation рамки и детекций
+    (frame_rules=None - рамку найти не удалось)
+    """
+    colors = ANNOTATION_COLORS
+    layer = AnnotationLayer()
+    if frame_rules is not None:
+        layer.rect(frame_rules.table.boxes[0], colors['frame'], width=4, centered=True, kind='frame',
+                   label='Рамка', message=frame_text)
+
+    table = evaluation.table
+    for rule in evaluation.rules:
+        for row in evaluation.bad_rows(rule.id):
+            label = evaluation.label(rule.id, row)
+            message = evaluation.message(rule.id, row)
+            if rule.check == 'arrow_distances':
+                # Линия от центра стрелки к центру объекта, до которого мерили расстояние
+                box = table.boxes[row]
+                start = ((box[0] + box[2]) / 2, (box[1] + box[3]) / 2)
+                end = table.matches.object_centers[table['group'][row]]
+                layer.line(start, end, colors[rule.check], width=2, kind=rule.check, label=label, message=message)
+            else:
+                layer.rect(table.boxes[row], colors[rule.check], width=3, kind=rule.check,
+                           label=label, message=message)
+    return layer
+
+
+def create_final_image_with_all_annotations(original_image, processed_image,
+                                            arrow_heads_violations_data,
+                                            arrow_distances_violations_data,
+                                            text_violations_data, model=None,
+                                            detections=None):
+    """
+    Создает финальное изображение со всеми аннотациями разных типов
+    detections - результат детектора, общий с проверками.
+    Если не передан, модель запускается здесь не более одного раза.
+    """
+    if any([arrow_heads_violations_data, arrow_distances_violations_data, text_violations_data]):
+        detections = ensure_detections(original_image, model, detections)
 
+    layer = build_annotations(arrow_heads_violations_data,
+                              arrow_distances_violations_data,
+                              text_violations_data, detections)
 
-    return final_image
+    # Начинаем с изображения с рамкой
+    return layer.rasterize(processed_image)
@@ -1,19 +1,21 @@
 import numpy as np
-from PIL import Image, ImageDraw
 
-def process_text(image: np.ndarray, model):
+from annotations import AnnotationLayer, layer_output
+from detections import ensure_detections
+from gost_rules import evaluate_detections
+
+def process_text(image: np.ndarray, model=None, detections=None, render=True, evaluation=None):
     """
     Проверяет текст по ГОСТ
     Только ошибки красным
+    detections - готовый результат детектора (если нет, модель запускается здесь)
+    evaluation - готовая проверка правил gost_rules по этим детекциям
+    render=False - вместо картинки с разметкой вернуть AnnotationLayer
     """
-    pil_image = Image.fromarray(image)
-    draw = ImageDraw.Draw(pil_image)
-
-    results = model.predict(image, imgsz=640)
-    boxes = results[0].boxes.xyxy.cpu().numpy()
-    classes = results[0].boxes.cls.cpu().numpy()
+    layer = AnnotationLayer()
 
-    texts = [box for box, cls in zip(boxes, classes) if cls == 2]
+    detections = ensure_detections(image, model, detections)
+    texts = detections.texts
 
     violations = []
     warnings = []
@@ -22,23 +24,16 @@ def process_text(image: np.ndarray, model):
     }
 
     if len(texts) == 0:
-        return violations, warnings, statistics, "Ошибок нет", pil_image
-
-    px_to_mm = 0.15
-    TEXT_HEIGHT_TARGET_MM = 3.5
-    TEXT_HEIGHT_TOLERANCE_MM = 0.5
+        return violations, warnings, statistics, "Ошибок нет", layer_output(image, layer, render)
 
-    for i, text in enumerate(texts):
-        text_height_px = text[3] - text[1]
-        text_height_mm = text_height_px * px_to_mm
+    evaluation = evaluation or evaluate_detections(detections)
 
-        # ТОЛЬКО если нарушение - выделяем красным
-        if not (TEXT_HEIGHT_TARGET_MM - TEXT_HEIGHT_TOLERANCE_MM <= text_height_mm <= TEXT_HEIGHT_TARGET_MM + TEXT_HEIGHT_TOLERANCE_MM):
-            violation_text = f"Текст {i + 1} ({text_height_mm:.1f} мм) не соответствует {TEXT_HEIGHT_TARGET_MM} мм ±{TEXT_HEIGHT_TOLERANCE_MM}мм"
-            violations.append(violation_text)
-            # ВЫДЕЛЯЕМ ТОЛЬКО НАРУШЕНИЯ
-            draw.rectangle([text[0], text[1], text[2], text[3]], outline="red", width=3)
+    # ТОЛЬКО если нарушение - выделяем красным
+    for row in evaluation.bad_rows('text_height'):
+        violations.append(evaluation.message('text_height', row))
+        # ВЫДЕЛЯЕМ ТОЛЬКО НАРУШЕНИЯ
+        layer.rect(evaluation.table.boxes[row], "red", width=3, kind='text')
 
     result_text = "\n".join(violations) if violations else "Весь текст соответствует ГОСТ"
 
-    return violations, warnings, statistics, result_text, pil_image
\ No newline at end of file
+    return violations, warnings, statistics, result_text, layer_output(image, layer, render)
@@ -0,0 +1,233 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import gost_rules
+import process_borders
+
+
+def file_fingerprint(path):
+    """Хеш содержимого файла (весов модели). Если файла нет - хеш от пути"""
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+    except OSError:
+        h.update(f"missing:{path}".encode('utf-8'))
+    return h.hexdigest()
+
+
+def rules_fingerprint():
+    """Хеш всех констант правил ГОСТ, влияющих на результат проверки"""
+    rules = {
+        'gost': gost_rules.rules_as_data(),
+        'borders': {name: getattr(process_borders, name) for name in (
+            'A3_WIDTH_MM', 'A3_HEIGHT_MM',
+            'COARSE_MAX_SIDE', 'MIN_FRAME_AREA_RATIO', 'REFINE_MIN_LINE_FILL')},
+    }
+    data = json.dumps(rules, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def image_key(image_np, *parts):
+    """Ключ по декодированным пикселям и дополнительным частям (модель, правила)"""
+    h = hashlib.blake2b(digest_size=20)
+    h.update(str(image_np.shape).encode('utf-8'))
+    h.update(str(image_np.dtype).encode('utf-8'))
+    h.update(image_np if image_np.flags.c_contiguous else image_np.tobytes())
+    for part in parts:
+        h.update(b'\0')
+        h.update(str(part).encode('utf-8'))
+    return h.hexdigest()
+
+
+def data_key(*parts):
+    """Ключ по произвольным данным (например, входу /generate_report)"""
+    h = hashlib.blake2b(digest_size=20)
+    for part in parts:
+        h.update(b'\0')
+        if isinstance(part, bytes):
+            h.update(part)
+        else:
+            h.update(str(part).encode('utf-8'))
+    return h.hexdigest()
+
+
+# Вытеснение на диске - до этой доли disk_max_bytes, чтобы обход каталога
+# не повторялся на каждой следующей записи
+DISK_EVICT_TARGET = 0.9
+
+
+class ResultCache:
+    """
+    Кеш результатов с адресацией по содержимому.
+    В памяти - LRU с ограничением по байтам, на диске - необязательный
+    второй уровень, который переживает перезапуск сервера.
+    Значения хранятся как bytes.
+    Объем диска считается по записям этого процесса; каталог обходится только
+    при превышении disk_max_bytes (тогда же счетчик сверяется с диском, в том
+    числе с записями других воркеров).
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, disk_dir=None, disk_max_bytes=None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # Объем дискового уровня (None - еще не считали)
+        self._disk_bytes = None
+        self._disk_evict_lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return value
+
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._memory_put(key, value)
+        return value
+
+    def put(self, key, value: bytes):
+        with self._lock:
+            self._memory_put(key, value)
+        self._disk_put(key, value)
+
+    def _memory_put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old)
+        self._items[key] = value
+        self._bytes += len(value)
+        while self._bytes > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.evictions += 1
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)  # для LRU на диске
+            return value
+        except OSError:
+            return None
+
+    def _disk_put(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            old_size = os.stat(path).st_size
+        except OSError:
+            old_size = 0
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Пишем во временный файл и переименовываем, чтобы не оставить обрывок
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Ошибка записи в дисковый кеш: {str(e)}")
+            return
+        if not self.disk_max_bytes:
+            return
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(value) - old_size
+            over = self._disk_bytes is None or self._disk_bytes > self.disk_max_bytes
+        if over:
+            self._disk_evict()
+
+    def _disk_evict(self):
+        """Обход каталога: самые давние записи удаляются до DISK_EVICT_TARGET от предела"""
+        if not self._disk_evict_lock.acquire(blocking=False):
+            # Уже вытесняет другой поток
+            return
+        try:
+            self._disk_evict_locked()
+        finally:
+            self._disk_evict_lock.release()
+
+    def _disk_evict_locked(self):
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        entries.sort()
+        if total > self.disk_max_bytes:
+            target = self.disk_max_bytes * DISK_EVICT_TARGET
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.unlink(path)
+                except OSError:
+                    continue
+                total -= size
+                with self._lock:
+                    self.disk_evictions += 1
+        with self._lock:
+            self._disk_bytes = total
+
+    def get_json(self, key):
+        value = self.get(key)
+        return json.loads(value) if value is not None else None
+
+    def put_json(self, key, obj):
+        self.put(key, json.dumps(obj, ensure_ascii=False).encode('utf-8'))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._items),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'disk_evictions': self.disk_evictions,
+                'disk_enabled': bool(self.disk_dir),
+            }
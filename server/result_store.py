@@ -0,0 +1,584 @@
+"""
+Хранилище результатов проверок на сервере.
+
+Отчеты и история по session_id - в SQLite, изображения - в каталоге блобов
+с адресацией по содержимому (имя файла - хеш байтов, одинаковые картинки
+хранятся один раз). Для каждого результата сохраняются структурированный
+отчет, исходное изображение, аннотированное изображение и миниатюры для
+карточек истории: клиенту больше не нужно хранить и пересылать base64.
+Результаты overlay-режима хранятся как слой разметки (JSON): картинка
+рисуется поверх исходника только при первом запросе, а не при каждой проверке.
+
+База общая для всех воркеров gunicorn (WAL). Запись блобов и их удаление
+при вытеснении идут внутри транзакции записи SQLite, поэтому воркеры не
+удаляют блоб, на который другой воркер как раз ставит ссылку.
+Кодирование картинок и запись - в фоновом потоке, вне пути запроса. До записи
+результат отмечен в таблице pending, и чтение в любом воркере ждет его записи.
+Если очередь записи полна, проверка не ждет: запись отбрасывается и считается.
+"""
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from PIL import Image
+
+from annotations import AnnotationLayer
+from image_transport import encode_image
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    result_id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    total_violations INTEGER,
+    violations TEXT,
+    text TEXT,
+    report TEXT
+);
+CREATE INDEX IF NOT EXISTS results_last_seen ON results (last_seen);
+
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    result_id TEXT NOT NULL REFERENCES results (result_id) ON DELETE CASCADE,
+    filename TEXT,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS history_session ON history (session_id, id);
+CREATE INDEX IF NOT EXISTS history_result ON history (result_id);
+CREATE INDEX IF NOT EXISTS history_created ON history (created_at);
+
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mimetype TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS result_blobs (
+    result_id TEXT NOT NULL REFERENCES results (result_id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    PRIMARY KEY (result_id, kind)
+);
+CREATE INDEX IF NOT EXISTS result_blobs_digest ON result_blobs (digest);
+
+CREATE TABLE IF NOT EXISTS pending (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    result_id TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pending_result ON pending (result_id);
+CREATE INDEX IF NOT EXISTS pending_session ON pending (session_id);
+"""
+
+# Виды блобов результата (миниатюры - 'thumbnail:<сторона>')
+ORIGINAL = 'original'
+IMAGE = 'image'
+OVERLAY = 'overlay'
+THUMBNAIL = 'thumbnail'
+
+# Сколько ждать записи результата из очереди (отметки старше не учитываются), с
+PENDING_WAIT_S = 10.0
+PENDING_POLL_S = 0.05
+# Ожидание блокировки записи SQLite другим воркером, с
+BUSY_TIMEOUT_S = 30.0
+# Временные файлы загрузок, оставшиеся после падения процесса, удаляются при запуске
+STAGING_MAX_AGE_S = 60 * 60
+# Наибольшее число записей истории за один запрос
+MAX_PAGE_SIZE = 100
+
+
+def thumbnail_kind(size):
+    return f'{THUMBNAIL}:{size}'
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+def _thumbnail(image, max_side):
+    """Уменьшенная копия по длинной стороне (без полной копии страницы, как у Image.thumbnail)"""
+    scale = max_side / max(image.size)
+    if scale >= 1:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+
+
+class StagedFile:
+    """Загрузка, скопированная во временный файл хранилища: путь, хеш, размер и тип"""
+
+    def __init__(self, path, digest, size, mimetype):
+        self.path = path
+        self.digest = digest
+        self.size = size
+        self.mimetype = mimetype
+
+
+class ResultStore:
+    """
+    root - каталог хранилища (база results.sqlite3, блобы, временные файлы).
+    max_bytes - предел суммарного объема блобов, max_age_s - срок хранения истории
+    (0 или None - без предела). При превышении вытесняются результаты,
+    которые дольше всего не проверялись, вместе с их историей.
+    thumbnail_sizes - длинные стороны миниатюр аннотированного изображения.
+    max_pending - очередь фоновой записи: при полной очереди submit отбрасывает запись.
+    """
+
+    def __init__(self, root, max_bytes=None, max_age_s=None, thumbnail_sizes=(256,),
+                 thumbnail_format='webp', image_format='png', max_pending=8):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.thumbnail_sizes = tuple(sorted(thumbnail_sizes, reverse=True))
+        self.thumbnail_format = thumbnail_format
+        self.image_format = image_format
+        self.max_pending = max_pending
+
+        self.db_path = os.path.join(root, 'results.sqlite3')
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.staging_dir = os.path.join(root, 'staging')
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.staging_dir, exist_ok=True)
+
+        self._start()
+        # Соединения SQLite и поток записи не переживают fork: в воркере gunicorn - свои
+        os.register_at_fork(after_in_child=self._start)
+
+        self._conn().executescript(SCHEMA)
+        self._clean_staging()
+
+    def _start(self):
+        self._local = threading.local()
+        self._queue = queue.Queue(maxsize=max(1, self.max_pending))
+        self._closed = False
+
+        # Статистика процесса
+        self._saved = 0
+        self._errors = 0
+        self._dropped = 0
+        self._evicted = 0
+
+        self._worker = threading.Thread(target=self._run, name="result-store", daemon=True)
+        self._worker.start()
+
+    def _conn(self):
+        """Соединение текущего потока (в режиме autocommit, транзакции записи - через _write)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_S, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """Транзакция записи: одна на все процессы, блобы пишутся и удаляются внутри нее"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
+
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    def _clean_staging(self):
+        cutoff = time.time() - STAGING_MAX_AGE_S
+        for name in os.listdir(self.staging_dir):
+            path = os.path.join(self.staging_dir, name)
+            try:
+                if os.stat(path).st_mtime < cutoff:
+                    os.unlink(path)
+            except OSError:
+                continue
+
+    # Запись
+
+    def stage(self, stream):
+        """
+        Копирует загруженный файл во временный файл хранилища (пока поток запроса еще открыт).
+        Хеш считается при копировании, в блоб файл переносится при записи результата.
+        """
+        h = hashlib.blake2b(digest_size=20)
+        size = 0
+        fd, path = tempfile.mkstemp(dir=self.staging_dir)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter(lambda: stream.read(1 << 20), b''):
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            mimetype = 'application/octet-stream'
+            try:
+                # Только заголовок файла, пиксели не декодируются
+                with Image.open(path) as image:
+                    mimetype = Image.MIME.get(image.format, mimetype)
+            except Exception:
+                pass
+        except BaseException:
+            os.unlink(path)
+            raise
+        return StagedFile(path, h.hexdigest(), size, mimetype)
+
+    @staticmethod
+    def discard(staged):
+        """Временный файл загрузки больше не нужен (проверка не удалась или результат уже сохранен)"""
+        if staged is None:
+            return
+        try:
+            os.unlink(staged.path)
+        except OSError:
+            pass
+
+    def submit(self, result_id, session_id, text, full_report, violations, image=None, pixels=None,
+               original=None, filename=None):
+        """
+        Ставит проверку в очередь записи: запись истории, а если результата еще нет -
+        и сам результат с изображениями. image - аннотированное изображение (PIL)
+        или слой разметки (хранится как есть), pixels - массив проверки (для размеров),
+        original - StagedFile загрузки (листы наборов приходят без него - исходник не хранится).
+        При полной очереди не ждет: запись отбрасывается (False), проверка отвечает без истории.
+        """
+        if self._closed:
+            self.discard(original)
+            return False
+        created_at = time.time()
+        with self._write() as conn:
+            pending_id = conn.execute('INSERT INTO pending (session_id, result_id, created_at) VALUES (?, ?, ?)',
+                                      (session_id, result_id, created_at)).lastrowid
+        record = {
+            'pending_id': pending_id,
+            'result_id': result_id,
+            'session_id': session_id,
+            'text': text,
+            'full_report': full_report,
+            'violations': violations,
+            'image': image,
+            'pixels': pixels,
+            'original': original,
+            'filename': filename,
+            'created_at': created_at,
+        }
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self._dropped += 1
+            self.discard(original)
+            with self._write() as conn:
+                conn.execute('DELETE FROM pending WHERE id = ?', (pending_id,))
+            return False
+        return True
+
+    def close(self, timeout=None):
+        """Дописывает очередь и останавливает поток записи"""
+        self._closed = True
+        self._queue.put(None)
+        self._worker.join(timeout)
+        return not self._worker.is_alive()
+
+    def _run(self):
+        while True:
+            record = self._queue.get()
+            if record is None:
+                return
+            try:
+                self._save(**record)
+                self._saved += 1
+            except Exception as e:
+                print(f"Ошибка записи результата {record['result_id']}: {str(e)}")
+                import traceback
+                print(f"Трассировка: {traceback.format_exc()}")
+                self._errors += 1
+                self.discard(record['original'])
+                try:
+                    with self._write() as conn:
+                        conn.execute('DELETE FROM pending WHERE id = ?', (record['pending_id'],))
+                except sqlite3.Error:
+                    pass
+                continue
+            try:
+                self.evict()
+            except Exception as e:
+                print(f"Ошибка вытеснения результатов: {str(e)}")
+
+    def _exists(self, result_id):
+        return self._conn().execute('SELECT 1 FROM results WHERE result_id = ?', (result_id,)).fetchone() is not None
+
+    def _encode(self, image):
+        """Блобы результата {вид: (байты, mimetype)} - вне транзакции, это самая долгая часть записи"""
+        if image is None:
+            return {}
+        if isinstance(image, AnnotationLayer):
+            # Overlay-режим: только слой, картинку и миниатюры нарисуют при первом запросе
+            return {OVERLAY: (image.to_bytes(), 'application/json')}
+        blobs = {}
+        blobs[IMAGE] = encode_image(image, self.image_format)
+        # Миниатюры от большей к меньшей: каждая уменьшается из предыдущей
+        thumb = image
+        for size in self.thumbnail_sizes:
+            thumb = _thumbnail(thumb, size)
+            blobs[thumbnail_kind(size)] = encode_image(thumb, self.thumbnail_format)
+        return blobs
+
+    def _put_blob(self, conn, result_id, kind, data=None, mimetype=None, staged=None):
+        """Блоб по хешу содержимого (внутри транзакции записи) и ссылка на него от результата"""
+        if staged is not None:
+            digest, size, mimetype = staged.digest, staged.size, staged.mimetype
+        else:
+            digest, size = _digest(data), len(data)
+        path = self._blob_path(digest)
+        known = conn.execute('SELECT 1 FROM blobs WHERE digest = ?', (digest,)).fetchone() is not None
+        if known and os.path.exists(path):
+            self.discard(staged)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if staged is not None:
+                os.replace(staged.path, path)
+            else:
+                # Во временный файл и переименование, чтобы не оставить обрывок
+                fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            conn.execute('INSERT OR REPLACE INTO blobs (digest, size, mimetype, created_at) VALUES (?, ?, ?, ?)',
+                         (digest, size, mimetype, time.time()))
+        conn.execute('INSERT OR REPLACE INTO result_blobs (result_id, kind, digest) VALUES (?, ?, ?)',
+                     (result_id, kind, digest))
+
+    def _save(self, pending_id, result_id, session_id, text, full_report, violations, image, pixels, original,
+              filename, created_at):
+        # Повторная проверка того же чертежа - только запись истории, без кодирования картинок
+        blobs = None if self._exists(result_id) else self._encode(image)
+        with self._write() as conn:
+            if not self._exists(result_id):
+                if blobs is None:
+                    # Результат вытеснили, пока шла проверка - кодируем заново
+                    blobs = self._encode(image)
+                height, width = pixels.shape[:2] if pixels is not None else (None, None)
+                conn.execute(
+                    'INSERT INTO results (result_id, created_at, last_seen, width, height, total_violations, '
+                    'violations, text, report) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (result_id, created_at, created_at, width, height,
+                     full_report['summary']['total_violations'], json.dumps(violations),
+                     text, json.dumps(full_report, ensure_ascii=False)))
+                for kind, (data, mimetype) in blobs.items():
+                    self._put_blob(conn, result_id, kind, data, mimetype)
+                if original is not None:
+                    self._put_blob(conn, result_id, ORIGINAL, staged=original)
+            else:
+                self.discard(original)
+                conn.execute('UPDATE results SET last_seen = MAX(last_seen, ?) WHERE result_id = ?',
+                             (created_at, result_id))
+            conn.execute('INSERT INTO history (session_id, result_id, filename, created_at) VALUES (?, ?, ?, ?)',
+                         (session_id, result_id, filename, created_at))
+            conn.execute('DELETE FROM pending WHERE id = ?', (pending_id,))
+
+    # Вытеснение
+
+    def _collect_blobs(self, conn):
+        """Удаляет блобы, на которые не ссылается ни один результат"""
+        orphans = [row['digest'] for row in conn.execute(
+            'SELECT digest FROM blobs WHERE NOT EXISTS '
+            '(SELECT 1 FROM result_blobs WHERE result_blobs.digest = blobs.digest)')]
+        for digest in orphans:
+            conn.execute('DELETE FROM blobs WHERE digest = ?', (digest,))
+            try:
+                os.unlink(self._blob_path(digest))
+            except OSError:
+                pass
+        return len(orphans)
+
+    def evict(self):
+        """Вытеснение по сроку хранения и по объему. Возвращает число удаленных результатов"""
+        removed = 0
+        with self._write() as conn:
+            # Отметки процессов, упавших до записи
+            conn.execute('DELETE FROM pending WHERE created_at < ?', (time.time() - PENDING_WAIT_S,))
+            if self.max_age_s:
+                conn.execute('DELETE FROM history WHERE created_at < ?', (time.time() - self.max_age_s,))
+            # Результат живет, пока на него есть запись истории
+            removed += conn.execute('DELETE FROM results WHERE NOT EXISTS '
+                                    '(SELECT 1 FROM history WHERE history.result_id = results.result_id)').rowcount
+            self._collect_blobs(conn)
+
+            if self.max_bytes:
+                # По одному результату: общие блобы освобождаются только вместе с последней ссылкой
+                while conn.execute('SELECT COALESCE(SUM(size), 0) FROM blobs').fetchone()[0] > self.max_bytes:
+                    oldest = conn.execute('SELECT result_id FROM results ORDER BY last_seen LIMIT 1').fetchone()
+                    if oldest is None:
+                        break
+                    conn.execute('DELETE FROM results WHERE result_id = ?', (oldest['result_id'],))
+                    removed += 1
+                    self._collect_blobs(conn)
+        self._evicted += removed
+        return removed
+
+    # Чтение
+
+    def _wait_pending(self, session_id=None, result_id=None, timeout=PENDING_WAIT_S):
+        """
+        Ждет записи проверок из очереди (в том числе другого воркера):
+        результат и история видны сразу после ответа на /upload.
+        """
+        column, value = ('result_id', result_id) if result_id is not None else ('session_id', session_id)
+        deadline = time.monotonic() + timeout
+        conn = self._conn()
+        while True:
+            pending = conn.execute(f'SELECT 1 FROM pending WHERE {column} = ? AND created_at > ? LIMIT 1',
+                                   (value, time.time() - PENDING_WAIT_S)).fetchone()
+            if pending is None:
+                return True
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(PENDING_POLL_S)
+
+    def get(self, result_id):
+        """Результат: отчет, текст, размеры и имеющиеся блобы {вид: digest}, или None"""
+        self._wait_pending(result_id=result_id)
+        conn = self._conn()
+        row = conn.execute('SELECT * FROM results WHERE result_id = ?', (result_id,)).fetchone()
+        if row is None:
+            return None
+        blobs = {b['kind']: b['digest'] for b in conn.execute(
+            'SELECT kind, digest FROM result_blobs WHERE result_id = ?', (result_id,))}
+        return {
+            'result_id': row['result_id'],
+            'created_at': row['created_at'],
+            'last_seen': row['last_seen'],
+            'width': row['width'],
+            'height': row['height'],
+            'total_violations': row['total_violations'],
+            'violations': json.loads(row['violations']),
+            'text': row['text'],
+            'full_report': json.loads(row['report']),
+            'blobs': blobs,
+        }
+
+    def text(self, result_id):
+        """Текст проверки без разбора отчета (для /generate_report)"""
+        self._wait_pending(result_id=result_id)
+        row = self._conn().execute('SELECT text FROM results WHERE result_id = ?', (result_id,)).fetchone()
+        return row['text'] if row is not None else None
+
+    def blob(self, result_id, kind):
+        """(путь к файлу, mimetype, digest) блоба результата или None"""
+        self._wait_pending(result_id=result_id)
+        row = self._conn().execute(
+            'SELECT blobs.digest, blobs.mimetype FROM result_blobs JOIN blobs USING (digest) '
+            'WHERE result_blobs.result_id = ? AND result_blobs.kind = ?', (result_id, kind)).fetchone()
+        if row is None:
+            return None
+        return self._blob_path(row['digest']), row['mimetype'], row['digest']
+
+    def has_blob(self, result_id, kind):
+        row = self._conn().execute('SELECT 1 FROM result_blobs WHERE result_id = ? AND kind = ?',
+                                   (result_id, kind)).fetchone()
+        return row is not None
+
+    def image(self, result_id):
+        """Аннотированное изображение (PIL) или None"""
+        found = self.blob(result_id, IMAGE)
+        if found is None:
+            return None
+        try:
+            with Image.open(found[0]) as image:
+                image.load()
+                return image
+        except OSError:
+            # Блоб успели вытеснить
+            return None
+
+    def layer(self, result_id):
+        """Слой разметки overlay-результата (AnnotationLayer) или None"""
+        found = self.blob(result_id, OVERLAY)
+        if found is None:
+            return None
+        try:
+            with open(found[0], 'rb') as f:
+                return AnnotationLayer.from_bytes(f.read())
+        except OSError:
+            return None
+
+    def history(self, session_id, limit=20, before=None):
+        """
+        Страница истории сессии, новые первыми: (записи, курсор следующей страницы или None).
+        before - курсор из предыдущей страницы (id записи истории).
+        Отчеты целиком не читаются - только сводка для карточек.
+        """
+        self._wait_pending(session_id=session_id)
+        limit = max(1, min(limit, MAX_PAGE_SIZE))
+        conn = self._conn()
+        rows = conn.execute(
+            'SELECT history.id, history.result_id, history.filename, history.created_at, '
+            'results.width, results.height, results.total_violations, results.violations '
+            'FROM history JOIN results USING (result_id) '
+            'WHERE history.session_id = ? AND (? IS NULL OR history.id < ?) '
+            'ORDER BY history.id DESC LIMIT ?',
+            (session_id, before, before, limit + 1)).fetchall()
+        next_cursor = rows[limit - 1]['id'] if len(rows) > limit else None
+        rows = rows[:limit]
+
+        kinds = {}
+        if rows:
+            result_ids = sorted({row['result_id'] for row in rows})
+            placeholders = ','.join('?' * len(result_ids))
+            for blob in conn.execute(f'SELECT result_id, kind FROM result_blobs WHERE result_id IN ({placeholders})',
+                                     result_ids):
+                kinds.setdefault(blob['result_id'], set()).add(blob['kind'])
+
+        items = []
+        for row in rows:
+            available = kinds.get(row['result_id'], set())
+            items.append({
+                'id': row['id'],
+                'result_id': row['result_id'],
+                'filename': row['filename'],
+                'created_at': row['created_at'],
+                'width': row['width'],
+                'height': row['height'],
+                'total_violations': row['total_violations'],
+                'violations': json.loads(row['violations']),
+                'has_image': IMAGE in available,
+                'has_original': ORIGINAL in available,
+                'has_overlay': OVERLAY in available,
+                'thumbnail_sizes': sorted(size for size in self.thumbnail_sizes
+                                          if thumbnail_kind(size) in available),
+            })
+        return items, next_cursor
+
+    def stats(self):
+        conn = self._conn()
+        results = conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        history = conn.execute('SELECT COUNT(*) FROM history').fetchone()[0]
+        blobs, size = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs').fetchone()
+        pending = conn.execute('SELECT COUNT(*) FROM pending').fetchone()[0]
+        return {
+            'results': results,
+            'history': history,
+            'blobs': blobs,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'max_age_s': self.max_age_s,
+            'pending': pending,
+            'saved': self._saved,
+            'errors': self._errors,
+            'dropped': self._dropped,
+            'evicted': self._evicted,
+        }
@@ -0,0 +1,225 @@
+"""
+Теневая проверка модели-кандидата на части реального трафика.
+
+Выбранная доля проверок (sample_rate) ставится в ограниченную очередь,
+кандидат прогоняется в отдельном фоновом потоке - вне пути запроса.
+Если очередь полна, образец отбрасывается: основная проверка не ждет.
+Для каждого образца копится время инференса кандидата и согласие с
+основной моделью по детекциям и по нарушениям правил ГОСТ.
+"""
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from detections import detect, CLS_ARROW, CLS_OBJECT, CLS_TEXT
+from geometry import box_iou
+from gost_rules import evaluate_detections
+from large_image import LargeImage
+from tiled_inference import detect_tiled
+from cascade import refine_borderline
+
+CLASS_NAMES = {CLS_ARROW: 'arrow', CLS_OBJECT: 'object', CLS_TEXT: 'text'}
+
+# Сколько последних образцов хранить для процентилей времени
+LATENCY_WINDOW = 1000
+
+
+def match_boxes(boxes_a, boxes_b, iou_threshold=0.5):
+    """Число пар при жадном сопоставлении по убыванию IoU (каждый бокс - не больше одной пары)"""
+    if len(boxes_a) == 0 or len(boxes_b) == 0:
+        return 0
+    iou = box_iou(boxes_a, boxes_b)
+    rows, cols = np.nonzero(iou >= iou_threshold)
+    used_a = np.zeros(len(boxes_a), dtype=bool)
+    used_b = np.zeros(len(boxes_b), dtype=bool)
+    matched = 0
+    for k in np.argsort(-iou[rows, cols], kind='stable'):
+        i, j = rows[k], cols[k]
+        if not used_a[i] and not used_b[j]:
+            used_a[i] = used_b[j] = True
+            matched += 1
+    return matched
+
+
+def _agreement(primary, candidate, matched):
+    """Кандидат относительно основной модели: precision - доля подтвержденных, recall - доля найденных"""
+    precision = matched / candidate if candidate else (1.0 if not primary else 0.0)
+    recall = matched / primary if primary else (1.0 if not candidate else 0.0)
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'primary': primary, 'candidate': candidate, 'matched': matched,
+            'precision': round(precision, 4), 'recall': round(recall, 4), 'f1': round(f1, 4)}
+
+
+def _latency(values):
+    if not values:
+        return None
+    values = np.asarray(values)
+    return {'mean': round(float(values.mean()), 2),
+            'p50': round(float(np.percentile(values, 50)), 2),
+            'p95': round(float(np.percentile(values, 95)), 2)}
+
+
+def _counts(table, key, primary, candidate, matched):
+    counts = table.setdefault(key, [0, 0, 0])
+    counts[0] += primary
+    counts[1] += candidate
+    counts[2] += matched
+
+
+class ShadowEvaluator:
+    """
+    model - модель-кандидат (интерфейс predict, как у inference_backends).
+    Вызывается напрямую из своего потока, мимо планировщика основной модели.
+    on_sample(результат, секунды) - для метрик: результат 'evaluated', 'dropped' или 'error'.
+    """
+
+    def __init__(self, model, sample_rate=0.1, max_pending=2, iou_threshold=0.5, on_sample=None):
+        self.model = model
+        self.sample_rate = sample_rate
+        self.max_pending = max_pending
+        self.iou_threshold = iou_threshold
+        self.on_sample = on_sample
+
+        self._start()
+        # Поток не переживает fork: в воркере gunicorn с preload - свой
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._queue = queue.Queue(maxsize=max(1, self.max_pending))
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # Статистика
+        self._sampled = 0
+        self._dropped = 0
+        self._errors = 0
+        self._evaluated = 0
+        self._candidate_ms = deque(maxlen=LATENCY_WINDOW)
+        self._primary_ms = deque(maxlen=LATENCY_WINDOW)
+        self._detections = {}  # класс → [основная, кандидат, совпало]
+        self._violations = {}  # правило → [основная, кандидат, совпало]
+        self._same_verdict = 0
+
+        self._worker = threading.Thread(target=self._run, name="shadow-evaluator", daemon=True)
+        self._worker.start()
+
+    def submit(self, image_np, detections, tiling=None, primary_ms=None, cascade=None):
+        """
+        Возможно ставит образец в очередь: image_np - изображение проверки,
+        detections - детекции основной модели, tiling и cascade - те же параметры нарезки и каскада,
+        primary_ms - время детекции основной моделью в запросе.
+        Никогда не ждет: при полной очереди образец отбрасывается.
+        """
+        if self._closed or random.random() >= self.sample_rate:
+            return False
+        with self._lock:
+            self._sampled += 1
+        try:
+            self._queue.put_nowait((image_np, detections, tiling, cascade, primary_ms))
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            if self.on_sample:
+                self.on_sample('dropped', None)
+            return False
+        return True
+
+    def close(self):
+        self._closed = True
+        try:
+            self._queue.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def _detect(self, image_np, tiling, cascade):
+        """Та же детекция, что и у основной модели в pipeline.run_pipeline"""
+        pixels = image_np.full if isinstance(image_np, LargeImage) else image_np
+        if tiling:
+            return detect_tiled(pixels, self.model, **tiling)[0]
+        if isinstance(image_np, LargeImage):
+            detections = detect(image_np.preview, self.model).scaled(image_np.factor)
+        else:
+            detections = detect(image_np, self.model)
+        if cascade:
+            detections = refine_borderline(pixels, detections, self.model, **cascade)[0]
+        return detections
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            image_np, primary, tiling, cascade, primary_ms = item
+            started = time.perf_counter()
+            try:
+                candidate = self._detect(image_np, tiling, cascade)
+                seconds = time.perf_counter() - started
+                self._record(primary, candidate, seconds * 1000.0, primary_ms)
+            except Exception as e:
+                print(f"Ошибка теневой проверки: {str(e)}")
+                with self._lock:
+                    self._errors += 1
+                if self.on_sample:
+                    self.on_sample('error', None)
+                continue
+            if self.on_sample:
+                self.on_sample('evaluated', seconds)
+
+    def _record(self, primary, candidate, candidate_ms, primary_ms):
+        detections = {}
+        for cls_id in CLASS_NAMES:
+            a, b = primary.of_class(cls_id), candidate.of_class(cls_id)
+            detections[cls_id] = (len(a), len(b), match_boxes(a, b, self.iou_threshold))
+
+        # Нарушения сопоставляются в пределах одного правила по боксу
+        primary_violations = evaluate_detections(primary).violations()
+        candidate_violations = evaluate_detections(candidate).violations()
+        violations = {}
+        for rule in {v['rule'] for v in primary_violations + candidate_violations}:
+            a = np.array([v['box'] for v in primary_violations if v['rule'] == rule]).reshape(-1, 4)
+            b = np.array([v['box'] for v in candidate_violations if v['rule'] == rule]).reshape(-1, 4)
+            violations[rule] = (len(a), len(b), match_boxes(a, b, self.iou_threshold))
+
+        with self._lock:
+            self._evaluated += 1
+            self._candidate_ms.append(candidate_ms)
+            if primary_ms is not None:
+                self._primary_ms.append(primary_ms)
+            for cls_id, counts in detections.items():
+                _counts(self._detections, CLASS_NAMES[cls_id], *counts)
+            for rule, counts in violations.items():
+                _counts(self._violations, rule, *counts)
+            if bool(primary_violations) == bool(candidate_violations):
+                self._same_verdict += 1
+
+    def stats(self):
+        with self._lock:
+            detections = {name: list(counts) for name, counts in self._detections.items()}
+            violations = {rule: list(counts) for rule, counts in self._violations.items()}
+            stats = {
+                'sample_rate': self.sample_rate,
+                'max_pending': self.max_pending,
+                'iou_threshold': self.iou_threshold,
+                'sampled': self._sampled,
+                'dropped': self._dropped,
+                'errors': self._errors,
+                'evaluated': self._evaluated,
+                'pending': self._queue.qsize(),
+                'latency_ms': {'candidate': _latency(self._candidate_ms),
+                               'primary': _latency(self._primary_ms)},
+                'same_verdict_rate': round(self._same_verdict / self._evaluated, 4) if self._evaluated else None,
+            }
+
+        def totals(table):
+            return [sum(counts[k] for counts in table.values()) for k in range(3)]
+
+        stats['detections'] = dict(_agreement(*totals(detections)),
+                                   by_class={name: _agreement(*c) for name, c in detections.items()})
+        stats['violations'] = dict(_agreement(*totals(violations)),
+                                   by_rule={rule: _agreement(*c) for rule, c in sorted(violations.items())})
+        return stats
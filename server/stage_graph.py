@@ -0,0 +1,124 @@
+"""
+Этапы проверки как граф зависимостей.
+
+Независимые этапы (поиск рамки и детекция) выполняются параллельно в общем
+пуле потоков: OpenCV и модель отпускают GIL. У каждого этапа свое ограничение
+времени. При отмене (клиент ушел) или при фатальной ошибке этапа еще не
+начатые этапы не запускаются. Необязательный этап при ошибке заменяется
+запасным результатом (fallback), и зависимые от него этапы продолжают работу.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Как часто проверять флаг отмены, пока этапы выполняются, с
+CANCEL_POLL_S = 0.05
+
+
+class Cancelled(Exception):
+    """Проверка отменена (клиент отключился или задачу отменили)"""
+
+
+class StageFailed(Exception):
+    """Фатальная ошибка этапа: stage - имя этапа, error - исходное исключение"""
+
+    def __init__(self, stage, error):
+        super().__init__(f"Этап {stage}: {error}")
+        self.stage = stage
+        self.error = error
+
+
+class StageTimeout(Exception):
+    """Этап не уложился в свое время"""
+
+
+class Stage:
+    """
+    fn(results) → результат этапа; results - словарь результатов уже
+    выполненных этапов (гарантированно есть все из deps).
+    timeout - секунды с постановки этапа в пул: ожидание свободного потока
+    тоже входит в срок (None - без ограничения).
+    fallback(error) - результат вместо упавшего необязательного этапа;
+    без fallback ошибка этапа фатальна для всей проверки.
+    """
+
+    def __init__(self, name, fn, deps=(), timeout=None, fallback=None):
+        self.name = name
+        self.fn = fn
+        self.deps = tuple(deps)
+        self.timeout = timeout
+        self.fallback = fallback
+
+
+class StageGraph:
+    """Общий пул потоков для этапов всех проверок процесса"""
+
+    def __init__(self, max_workers=8):
+        self.max_workers = max_workers
+        self._start()
+        # В дочернем процессе (воркер gunicorn с preload) - свой пул
+        os.register_at_fork(after_in_child=self._start)
+
+    def _start(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stage")
+
+    def run(self, stages, cancel=None):
+        """
+        Выполняет этапы с учетом зависимостей, возвращает {имя: результат}.
+        Фатальная ошибка или превышение времени - StageFailed, отмена - Cancelled.
+        Уже запущенный поток прервать нельзя: его результат просто отбрасывается,
+        а сами этапы могут проверять cancel и выходить раньше (Cancelled).
+        """
+        pending = list(stages)
+        results = {}
+        running = {}  # future → этап
+        deadlines = {}  # имя → срок этапа (от постановки в пул)
+
+        def fail(stage, error):
+            if isinstance(error, Cancelled):
+                # Этап сам заметил отмену - это не ошибка этапа
+                raise error
+            if stage.fallback is None:
+                raise StageFailed(stage.name, error)
+            results[stage.name] = stage.fallback(error)
+
+        try:
+            while pending or running:
+                if cancel is not None and cancel.is_set():
+                    raise Cancelled("Проверка отменена")
+
+                for stage in [s for s in pending if all(d in results for d in s.deps)]:
+                    pending.remove(stage)
+                    if stage.timeout is not None:
+                        deadlines[stage.name] = time.monotonic() + stage.timeout
+                    running[self._executor.submit(stage.fn, dict(results))] = stage
+                if not running:
+                    raise ValueError(f"Неразрешимые зависимости этапов: {[s.name for s in pending]}")
+
+                # Ждем до ближайшего срока этапа (и не дольше интервала проверки отмены)
+                now = time.monotonic()
+                timeout = min((deadlines[s.name] for s in running.values() if s.name in deadlines),
+                              default=now + CANCEL_POLL_S) - now
+                if cancel is not None:
+                    timeout = min(timeout, CANCEL_POLL_S)
+                done, _ = wait(list(running), timeout=max(0.0, timeout), return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    stage = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        fail(stage, error)
+                    else:
+                        results[stage.name] = future.result()
+
+                now = time.monotonic()
+                for future, stage in list(running.items()):
+                    if stage.name in deadlines and now > deadlines[stage.name]:
+                        del running[future]
+                        fail(stage, StageTimeout(f"превышено время этапа ({stage.timeout:g} с)"))
+        finally:
+            # Не начатые этапы снимаются с очереди пула
+            for future in running:
+                future.cancel()
+        return results
+
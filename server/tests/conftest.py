@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Модули сервиса лежат плоско в server/ и импортируются по имени, как в app.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
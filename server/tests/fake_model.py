@@ -0,0 +1,59 @@
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+# Яркость закрашенного прямоугольника → класс детекции
+CLASS_BY_LEVEL = {0: 0, 60: 1, 120: 2}
+
+
+def result(boxes, classes, confidences):
+    """Результат predict в форме ultralytics: .boxes.xyxy/.cls/.conf"""
+    return SimpleNamespace(boxes=SimpleNamespace(
+        xyxy=np.asarray(boxes, dtype=np.float32).reshape(-1, 4),
+        cls=np.asarray(classes, dtype=np.float32).reshape(-1),
+        conf=np.asarray(confidences, dtype=np.float32).reshape(-1),
+    ))
+
+
+def draw_box(page, box, cls_id=0):
+    """Закрашенный прямоугольник, который модель-заглушка найдет как детекцию класса cls_id"""
+    level = {cls: level for level, cls in CLASS_BY_LEVEL.items()}[cls_id]
+    x0, y0, x1, y1 = box
+    page[y0:y1, x0:x1] = level
+
+
+class BoxModel:
+    """
+    Модель-заглушка: детекции - связные темные области изображения
+    (класс - по яркости, см. CLASS_BY_LEVEL). Запоминает вызовы (число изображений, imgsz).
+    confidence - уверенность или функция от бокса.
+    """
+
+    def __init__(self, confidence=0.9):
+        self.confidence = confidence
+        self.calls = []
+        self.cancels = []
+
+    def _detect(self, image):
+        gray = image if image.ndim == 2 else image[..., 0]
+        boxes, classes = [], []
+        for level, cls_id in CLASS_BY_LEVEL.items():
+            mask = (gray == level).astype(np.uint8)
+            count, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=4)
+            for x, y, w, h, _ in stats[1:count]:
+                boxes.append([x, y, x + w, y + h])
+                classes.append(cls_id)
+        confidence = self.confidence
+        confidences = [confidence(box) if callable(confidence) else confidence for box in boxes]
+        return result(boxes, classes, confidences)
+
+    def predict(self, source, imgsz=640, cancel=None):
+        images = source if isinstance(source, list) else [source]
+        self.calls.append((len(images), imgsz))
+        self.cancels.append(cancel)
+        return [self._detect(image) for image in images]
+
+
+def blank_page(width, height):
+    return np.full((height, width, 3), 255, dtype=np.uint8)
@@ -0,0 +1,126 @@
+import json
+import xml.etree.ElementTree as ET
+
+import numpy as np
+import pytest
+from PIL import ImageColor
+
+from annotations import AnnotationLayer
+from detections import Detections, CLS_ARROW, CLS_OBJECT, CLS_TEXT
+from gost_rules import DetectionTable, FRAME_RULES, evaluate, evaluate_detections
+from process_image import build_annotations, build_overlay, ANNOTATION_COLORS
+
+SVG = '{http://www.w3.org/2000/svg}'
+
+
+def _layer():
+    layer = AnnotationLayer()
+    layer.rect((10.04, 20.06, 50.0, 60.0), (255, 0, 0), kind='text', label='Text 1', message='высота <3 мм> & "шрифт"')
+    layer.line((0, 0), (30.333, 40.666), 'blue', kind='arrow_distances', message='расстояние')
+    layer.text((10, 0), 'Text 1', (0, 128, 0), kind='text')
+    return layer
+
+
+def _evaluations(seed=0, n=80):
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 2000, (n, 2))
+    boxes = np.concatenate([xy, xy + rng.uniform(15, 45, (n, 2))], axis=1)
+    detections = Detections(boxes, rng.choice([CLS_ARROW, CLS_OBJECT, CLS_TEXT], n))
+    frame = evaluate(DetectionTable.from_frame((19.0, 5.2, 5.0, 4.1), (130, 35, 1950, 2770)), FRAME_RULES)
+    return frame, evaluate_detections(detections)
+
+
+# Слой
+
+def test_to_json_drops_text_and_rounds():
+    items = _layer().to_json()
+    assert [item['type'] for item in items] == ['rect', 'line']
+    assert items[0]['box'] == [10.0, 20.1, 50.0, 60.0]
+    assert items[0]['color'] == '#ff0000'
+    assert items[1]['points'] == [[0.0, 0.0], [30.3, 40.7]]
+    json.dumps(items)
+
+
+def test_to_svg_elements_and_titles():
+    svg = ET.fromstring(_layer().to_svg(200, 100))
+    assert (svg.get('width'), svg.get('height'), svg.get('viewBox')) == ('200', '100', '0 0 200 100')
+    rect, line = list(svg)
+    assert rect.tag == SVG + 'rect'
+    assert [rect.get(k) for k in ('x', 'y', 'width', 'height', 'class')] == ['10', '20.1', '40', '39.9', 'text']
+    assert rect.find(SVG + 'title').text == 'высота <3 мм> & "шрифт"'
+    assert line.tag == SVG + 'line'
+    assert [line.get(k) for k in ('x2', 'y2', 'stroke')] == ['30.3', '40.7', 'blue']
+
+
+def test_rasterize_leaves_page_untouched():
+    page = np.full((80, 80, 3), 255, dtype=np.uint8)
+    page.flags.writeable = False
+    image = _layer().rasterize(page)
+    assert (page == 255).all()
+    assert image.getpixel((30, 20)) == (255, 0, 0)
+    assert image.getpixel((70, 70)) == (255, 255, 255)
+
+
+def test_scaled_keeps_widths():
+    scaled = _layer().scaled(0.5)
+    assert scaled.items[0]['box'] == pytest.approx([5.02, 10.03, 25.0, 30.0])
+    assert scaled.items[1]['points'][1] == pytest.approx([15.1665, 20.333])
+    assert scaled.items[2]['xy'] == [5.0, 0.0]
+    assert [item.get('width') for item in scaled.items] == [item.get('width') for item in _layer().items]
+
+
+def test_bytes_round_trip_keeps_text_colors():
+    layer = _layer()
+    restored = AnnotationLayer.from_bytes(layer.to_bytes())
+    assert restored.items[2]['color'] == (0, 128, 0)
+    page = np.full((80, 80, 3), 255, dtype=np.uint8)
+    assert np.array_equal(np.asarray(restored.rasterize(page)), np.asarray(layer.rasterize(page)))
+
+
+# Разметка финального изображения
+
+def test_annotations_without_distance_lines():
+    rng = np.random.default_rng(0)
+    xy = rng.uniform(0, 2000, (30, 2))
+    detections = Detections(np.concatenate([xy, xy + 30], axis=1), rng.choice([CLS_ARROW, CLS_OBJECT, CLS_TEXT], 30))
+    layer = build_annotations(['наконечник'], ['расстояние'], ['текст'], detections)
+    # Нарушения расстояний на картинке не рисуются, как и до векторной разметки
+    assert {item['kind'] for item in layer.items} == {'arrow_heads', 'text'}
+    assert all(item['type'] != 'line' for item in layer.items)
+    assert sum(item['type'] == 'rect' for item in layer.items) == len(detections.arrows) + len(detections.texts)
+
+
+# Разметка нарушений для клиента
+
+@pytest.mark.parametrize('seed', range(3))
+def test_overlay_item_per_violation(seed):
+    frame, evaluation = _evaluations(seed)
+    layer = build_overlay(frame, evaluation, 'рамка')
+    items = layer.to_json()
+
+    expected = [(rule.check, evaluation.message(rule.id, row))
+                for rule in evaluation.rules for row in evaluation.bad_rows(rule.id)]
+    assert items[0]['kind'] == 'frame' and items[0]['message'] == 'рамка'
+    assert items[0]['box'] == [130, 35, 1950, 2770]
+    assert [(item['kind'], item['message']) for item in items[1:]] == expected
+    for item in items:
+        assert item['color'] == ANNOTATION_COLORS[item['kind']]
+        ImageColor.getrgb(item['color'])
+
+
+def test_overlay_distance_lines_join_matched_centers():
+    frame, evaluation = _evaluations(1)
+    table = evaluation.table
+    lines = [item for item in build_overlay(frame, evaluation, '').items if item['type'] == 'line']
+    rows = [row for rule in evaluation.rules if rule.check == 'arrow_distances' for row in evaluation.bad_rows(rule.id)]
+    assert len(lines) == len(rows) > 0
+    for line, row in zip(lines, rows):
+        box = table.boxes[row]
+        assert line['points'][0] == pytest.approx([(box[0] + box[2]) / 2, (box[1] + box[3]) / 2])
+        assert line['points'][1] == pytest.approx(list(table.matches.object_centers[table['group'][row]]))
+
+
+def test_overlay_without_frame():
+    _, evaluation = _evaluations()
+    layer = build_overlay(None, evaluation, '')
+    assert all(item['kind'] != 'frame' for item in layer.items)
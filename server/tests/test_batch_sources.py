@@ -0,0 +1,146 @@
+import io
+import math
+import tempfile
+import zipfile
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from batch_sources import detect_container, iter_sheets, _page_dpi, PDF_MIN_DPI
+from large_image import ImageTooLarge
+
+
+def _png(value, size=(40, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (value, value, value)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def _zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def _tiff(sizes):
+    buffer = io.BytesIO()
+    frames = [Image.new('L', size, i * 10) for i, size in enumerate(sizes)]
+    frames[0].save(buffer, 'TIFF', save_all=True, append_images=frames[1:])
+    buffer.seek(0)
+    return buffer
+
+
+def _pdf(pages, size=(595, 842)):
+    fitz = pytest.importorskip('fitz')
+    document = fitz.open()
+    for _ in range(pages):
+        document.new_page(width=size[0], height=size[1])
+    data = document.tobytes()
+    document.close()
+    return data
+
+
+def test_detect_container():
+    assert detect_container(_zip({'a.png': _png(0)})) == 'zip'
+    assert detect_container(_tiff([(10, 10)])) == 'tiff'
+    assert detect_container(io.BytesIO(b'%PDF-1.7\n')) == 'pdf'
+    stream = io.BytesIO(b'\x89PNG\r\n\x1a\n')
+    assert detect_container(stream) is None
+    # Сигнатура читается без сдвига потока
+    assert stream.tell() == 0
+
+
+def test_unknown_container():
+    with pytest.raises(ValueError):
+        iter_sheets(io.BytesIO(_png(0)))
+
+
+def test_zip_sheets_sorted_and_filtered():
+    archive = _zip({
+        'set/b.png': _png(20),
+        'set/a.png': _png(10),
+        'set/.hidden.png': _png(0),
+        'set/readme.txt': b'text',
+        'set/broken.png': b'not an image',
+    })
+    sheets = list(iter_sheets(archive))
+    assert [name for name, _, _ in sheets] == ['set/a.png', 'set/b.png', 'set/broken.png']
+    (_, first, error), (_, second, _), (_, broken, broken_error) = sheets
+    assert error is None and first.shape == (30, 40, 3) and first[0, 0, 0] == 10
+    assert second[0, 0, 0] == 20
+    # Битый лист - ошибка этого листа, набор продолжается
+    assert broken is None and broken_error
+
+
+def test_zip_uses_given_decoder():
+    seen = []
+
+    def decode(member):
+        seen.append(member.name)
+        return np.zeros((2, 2, 3), dtype=np.uint8)
+
+    list(iter_sheets(_zip({'a.png': _png(0), 'b.jpg': b''}), decode=decode))
+    assert seen == ['a.png', 'b.jpg']
+
+
+def test_tiff_frames_with_pixel_limit():
+    sheets = list(iter_sheets(_tiff([(40, 30), (400, 300), (20, 10)]), max_pixels=10000))
+    assert [name for name, _, _ in sheets] == ['page_1', 'page_2', 'page_3']
+    assert sheets[0][1].shape == (30, 40, 3)
+    assert not sheets[0][1].flags.writeable
+    # Только слишком большой кадр становится ошибкой листа
+    assert sheets[1][1] is None and 'слишком большое' in sheets[1][2]
+    assert sheets[2][1].shape == (10, 20, 3)
+
+
+# Разрешение страниц PDF
+
+def _page(width_pt, height_pt):
+    return SimpleNamespace(rect=SimpleNamespace(width=width_pt, height=height_pt))
+
+
+def test_page_dpi_without_limit():
+    assert _page_dpi(_page(595, 842), 200, 0) == 200
+    assert _page_dpi(_page(595, 842), 200, 10 ** 9) == 200
+
+
+def test_page_dpi_fits_pixel_limit():
+    page = _page(595, 842)
+    full = (595 * 200 / 72) * (842 * 200 / 72)
+    dpi = _page_dpi(page, 200, full / 4)
+    assert dpi == 100
+    for max_pixels in (full / 3, full / 7, 2_000_000):
+        dpi = _page_dpi(page, 200, max_pixels)
+        assert (595 * dpi / 72) * (842 * dpi / 72) <= max_pixels
+        # Не грубее, чем нужно: на 1 dpi больше уже не укладывается
+        assert (595 * (dpi + 1) / 72) * (842 * (dpi + 1) / 72) > max_pixels
+
+
+def test_page_dpi_below_minimum_is_too_large():
+    page = _page(595 * 10, 842 * 10)
+    max_pixels = (595 * 10 * PDF_MIN_DPI / 72) * (842 * 10 * PDF_MIN_DPI / 72) / 2
+    with pytest.raises(ImageTooLarge):
+        _page_dpi(page, 200, max_pixels)
+
+
+def test_pdf_pages_from_memory():
+    sheets = list(iter_sheets(io.BytesIO(_pdf(2)), pdf_dpi=72))
+    assert [name for name, _, _ in sheets] == ['page_1', 'page_2']
+    assert sheets[0][1].shape == (842, 595, 3)
+    assert not sheets[0][1].flags.writeable
+
+
+def test_pdf_from_spool_file_with_pixel_limit():
+    with tempfile.NamedTemporaryFile() as spool:
+        spool.write(_pdf(1))
+        spool.seek(0)
+        name, image_np, error = next(iter_sheets(spool, pdf_dpi=200, max_pixels=1_000_000))
+    assert error is None
+    h, w = image_np.shape[:2]
+    assert w * h <= 1_000_000
+    assert math.isclose(w / h, 595 / 842, rel_tol=0.01)
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from cascade import refine_borderline, borderline_rows, _crop_window, _crop_imgsz, _rows_to_recheck
+from detections import Detections, detect, CLS_ARROW, CLS_OBJECT, CLS_TEXT
+from fake_model import BoxModel, blank_page, draw_box
+from gost_rules import evaluate_detections
+
+# Страница крупнее входа дешевого прохода: каскад включается
+WIDTH, HEIGHT = 2000, 1400
+TRUE = [((100, 100, 160, 130), CLS_TEXT), ((600, 400, 900, 700), CLS_OBJECT), ((1500, 1000, 1540, 1012), CLS_ARROW)]
+
+
+def _page(boxes=TRUE):
+    page = blank_page(WIDTH, HEIGHT)
+    for box, cls_id in boxes:
+        draw_box(page, box, cls_id)
+    return page
+
+
+def _coarse(shift=2):
+    """Боксы дешевого прохода: сдвинуты на пару пикселей от истинных"""
+    boxes = np.array([box for box, _ in TRUE], dtype=np.float32) + shift
+    return Detections(boxes, np.array([cls_id for _, cls_id in TRUE]), np.full(len(TRUE), 0.5, dtype=np.float32))
+
+
+def test_crop_window_min_size_context_and_clip():
+    assert _crop_window((100, 100, 120, 110), 2000, 1400, 256) == (0, 0, 256, 256)
+    # Крупный бокс: окно с полями, больше crop_size
+    x0, y0, x1, y1 = _crop_window((600, 400, 900, 700), 2000, 1400, 256)
+    assert (x1 - x0, y1 - y0) == (600, 600)
+    assert (x0 + x1) / 2 == 750 and (y0 + y1) / 2 == 550
+    # У края страницы окно сдвигается внутрь
+    assert _crop_window((1990, 1390, 2000, 1400), 2000, 1400, 256) == (1744, 1144, 2000, 1400)
+    # Страница меньше окна
+    assert _crop_window((10, 10, 20, 20), 100, 80, 256) == (0, 0, 100, 80)
+
+
+def test_crop_imgsz_rounds_up_to_stride():
+    assert _crop_imgsz((0, 0, 256, 256)) == 256
+    assert _crop_imgsz((0, 0, 257, 100)) == 288
+    assert _crop_imgsz((0, 0, 100, 600)) == 608
+
+
+def test_margin_selects_rows():
+    detections = _coarse()
+    evaluation = evaluate_detections(detections)
+    assert borderline_rows(evaluation, 0.0).size <= borderline_rows(evaluation, 1000.0).size
+    rows = _rows_to_recheck(detections, evaluation, 1000.0)
+    assert set(borderline_rows(evaluation, 1000.0).tolist()) <= set(rows)
+
+
+def test_refine_replaces_boxes_with_native_crops():
+    model = BoxModel()
+    detections, report = refine_borderline(_page(), _coarse(), model, margin_mm=1000.0)
+    rows = _rows_to_recheck(_coarse(), evaluate_detections(_coarse()), 1000.0)
+    assert report['rechecked'] == len(rows) > 0
+    assert report['refined'] == len(rows)
+    for row in rows:
+        assert detections.boxes[row].tolist() == list(TRUE[row][0])
+    assert detections.classes.tolist() == _coarse().classes.tolist()
+    # Окна одного размера - одним вызовом
+    assert sorted(imgsz for _, imgsz in model.calls) == sorted(int(k) for k in report['crop_imgsz'])
+    assert sum(n for n, _ in model.calls) == len(rows)
+
+
+def test_refine_keeps_box_without_match():
+    # В окне нет объекта того же класса - бокс остается из дешевого прохода
+    page = _page([])
+    detections, report = refine_borderline(page, _coarse(), BoxModel(), margin_mm=1000.0)
+    assert report['refined'] == 0
+    assert np.array_equal(detections.boxes, _coarse().boxes)
+
+
+def test_refine_skips_small_page():
+    model = BoxModel()
+    small = blank_page(600, 400)
+    detections = detect(small, model)
+    model.calls.clear()
+    result, report = refine_borderline(small, detections, model)
+    assert result is detections and report['rechecked'] == 0 and 'skipped' in report
+    assert model.calls == []
+
+
+@pytest.mark.parametrize('cancel', [None, object()])
+def test_refine_passes_cancel(cancel):
+    model = BoxModel()
+    refine_borderline(_page(), _coarse(), model, margin_mm=1000.0, cancel=cancel)
+    assert model.cancels and all(c is cancel for c in model.cancels)
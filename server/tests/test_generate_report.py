@@ -0,0 +1,113 @@
+import base64
+import io
+import threading
+
+from docx import Document
+from PIL import Image
+
+from generate_report import generate_word_report, generate_bulk_word_report, REPORT_IMAGE_WIDTH_IN, REPORT_IMAGE_DPI
+
+
+def _open(buffer):
+    return Document(buffer)
+
+
+def _info(table):
+    return [[cell.text for cell in row.cells] for row in table.rows]
+
+
+def _pictures(doc):
+    """Байты вставленных изображений в порядке документа"""
+    blobs = []
+    for shape in doc.inline_shapes:
+        r_id = shape._inline.graphic.graphicData.pic.blipFill.blip.embed
+        blobs.append(doc.part.related_parts[r_id].blob)
+    return blobs
+
+
+def _page(width=2400, height=1200):
+    return Image.new('RGB', (width, height), (255, 255, 255))
+
+
+def test_report_fields_and_text():
+    doc = _open(generate_word_report(7, 'лист.png', 'Первая строка\nВторая строка', created_at='2024-01-01'))
+    assert _info(doc.tables[0]) == [
+        ['ID чертежа:', '7'],
+        ['Название файла:', 'лист.png'],
+        ['Дата проверки:', '2024-01-01'],
+        ['Статус:', 'Проверен'],
+    ]
+    headings = [p.text for p in doc.paragraphs if p.style.name.startswith(('Heading', 'Title'))]
+    assert headings == ['Отчет по проверке чертежа', 'Информация о чертеже', 'Результат проверки']
+    result = doc.paragraphs[-1]
+    # Переносы строк - разрывы внутри одного абзаца
+    assert result.text == 'Первая строка\nВторая строка'
+    assert len(doc.inline_shapes) == 0
+
+
+def test_server_image_is_downscaled_to_report_width():
+    doc = _open(generate_word_report(1, 'a.png', 'ok', image=_page()))
+    (blob,) = _pictures(doc)
+    with Image.open(io.BytesIO(blob)) as picture:
+        assert picture.size == (int(REPORT_IMAGE_WIDTH_IN * REPORT_IMAGE_DPI), 500)
+    assert doc.inline_shapes[0].width.inches == REPORT_IMAGE_WIDTH_IN
+
+
+def test_image_dpi_zero_keeps_size():
+    doc = _open(generate_word_report(1, 'a.png', 'ok', image=_page(), image_dpi=0))
+    with Image.open(io.BytesIO(_pictures(doc)[0])) as picture:
+        assert picture.size == (2400, 1200)
+
+
+def test_client_base64_is_inserted_as_is():
+    buffer = io.BytesIO()
+    _page(300, 200).save(buffer, 'PNG')
+    doc = _open(generate_word_report(1, 'a.png', 'ok', image_base64=base64.b64encode(buffer.getvalue()).decode()))
+    assert _pictures(doc) == [buffer.getvalue()]
+
+
+def test_broken_image_keeps_report():
+    doc = _open(generate_word_report(1, 'a.png', 'ok', image_base64=base64.b64encode(b'not png').decode()))
+    assert doc.paragraphs[-1].text.startswith('Ошибка при добавлении изображения')
+    assert _info(doc.tables[0])[0] == ['ID чертежа:', '1']
+
+
+def test_template_is_not_shared_between_reports():
+    first = _open(generate_word_report(1, 'first.png', 'первый', image=_page(400, 200)))
+    second = _open(generate_word_report(2, 'second.png', 'второй'))
+    assert _info(second.tables[0])[1] == ['Название файла:', 'second.png']
+    assert 'первый' not in [p.text for p in second.paragraphs]
+    assert len(first.inline_shapes) == 1 and len(second.inline_shapes) == 0
+
+
+def test_concurrent_reports():
+    results = {}
+
+    def build(i):
+        results[i] = _open(generate_word_report(i, f'{i}.png', f'текст {i}'))
+
+    threads = [threading.Thread(target=build, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for i, doc in results.items():
+        assert _info(doc.tables[0])[0] == ['ID чертежа:', str(i)]
+        assert doc.paragraphs[-1].text == f'текст {i}'
+
+
+def test_bulk_report_one_section_per_drawing():
+    drawings = [
+        {'drawing_id': 1, 'filename': 'a.png', 'check_result': 'a', 'image': _page(400, 200)},
+        {'drawing_id': 2, 'filename': 'b.png', 'check_result': 'b'},
+        {'drawing_id': 3, 'filename': 'c.png', 'check_result': 'c', 'created_at': 'сегодня'},
+    ]
+    doc = _open(generate_bulk_word_report(drawings))
+    assert [_info(table)[0][1] for table in doc.tables] == ['1', '2', '3']
+    assert [_info(table)[1][1] for table in doc.tables] == ['a.png', 'b.png', 'c.png']
+    assert _info(doc.tables[2])[2] == ['Дата проверки:', 'сегодня']
+    titles = [p.text for p in doc.paragraphs if p.style.name == 'Title']
+    assert titles == ['Отчет по проверке чертежа'] * 3
+    # Каждый следующий чертеж - с новой страницы
+    assert doc.element.body.xml.count('w:type="page"') == 2
+    assert len(doc.inline_shapes) == 1
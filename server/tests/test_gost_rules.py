@@ -0,0 +1,103 @@
+"""Движок правил gost_rules дает те же тексты, что и прежние проверки с зашитыми константами"""
+import numpy as np
+import pytest
+
+from detections import Detections, CLS_ARROW, CLS_OBJECT, CLS_TEXT
+from geometry import box_heights, box_max_sides, match_arrows_to_objects
+from gost_rules import DetectionTable, FRAME_RULES, evaluate
+from process_arrow_distances import process_arrow_distances
+from process_arrow_heads import process_arrow_heads
+from process_text import process_text
+
+PX_TO_MM = 0.15
+
+
+def _random_detections(seed, n=60):
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 2000, (n, 2))
+    # Размеры вокруг допусков: часть в норме, часть нет
+    wh = rng.uniform(15, 45, (n, 2))
+    boxes = np.concatenate([xy, xy + wh], axis=1)
+    classes = rng.choice([CLS_ARROW, CLS_OBJECT, CLS_TEXT], n)
+    return Detections(boxes, classes)
+
+
+# Прежние проверки (до gost_rules), дословно по тексту сообщений
+
+def _legacy_arrow_heads(detections):
+    arrows = detections.arrows
+    size_mm = box_max_sides(arrows) * PX_TO_MM
+    bad = ~((3.0 <= size_mm) & (size_mm <= 5.0))
+    return [f"Наконечник {i + 1} ({size_mm[i]:.1f} мм) не соответствует ГОСТ 2.307-68 (4-5 мм)"
+            for i in np.flatnonzero(bad)]
+
+
+def _legacy_text(detections):
+    height_mm = box_heights(detections.texts) * PX_TO_MM
+    bad = ~((3.0 <= height_mm) & (height_mm <= 4.0))
+    return [f"Текст {i + 1} ({height_mm[i]:.1f} мм) не соответствует 3.5 мм ±0.5мм" for i in np.flatnonzero(bad)]
+
+
+def _legacy_arrow_distances(detections):
+    matches = match_arrows_to_objects(detections.arrows, detections.objects)
+    distance_mm = matches.distance_px * PX_TO_MM
+    is_first = matches.order == 0
+    target_min = np.where(is_first, 8.0, 5.0)
+    target_max = np.where(is_first, 12.0, 9.0)
+    in_range = (target_min <= distance_mm) & (distance_mm <= target_max)
+    violations, warnings = [], []
+    for i in matches.ordered_indices():
+        order = matches.order[i]
+        arrow_type = ("первая" if order == 0 else f"{order + 1}-я").capitalize()
+        if not in_range[i]:
+            violations.append(f"{arrow_type} стрелка {i + 1}: расстояние {distance_mm[i]:.1f} мм "
+                              f"вне диапазона {target_min[i]}-{target_max[i]} мм")
+        else:
+            warnings.append(f"{arrow_type} стрелка {i + 1}: расстояние {distance_mm[i]:.1f} мм - норма")
+    return violations, warnings
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_arrow_heads_match_legacy(seed):
+    detections = _random_detections(seed)
+    violations, _, _, _ = process_arrow_heads(None, detections=detections, render=False)
+    assert violations == _legacy_arrow_heads(detections)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_text_matches_legacy(seed):
+    detections = _random_detections(seed)
+    violations, _, _, _, _ = process_text(None, detections=detections, render=False)
+    assert violations == _legacy_text(detections)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_arrow_distances_match_legacy(seed):
+    detections = _random_detections(seed)
+    violations, _, text, _ = process_arrow_distances(None, detections=detections, render=False)
+    legacy_violations, legacy_warnings = _legacy_arrow_distances(detections)
+    assert violations == legacy_violations
+    for line in legacy_warnings:
+        assert line in text
+
+
+@pytest.mark.parametrize('margins, expected', [
+    ((20.0, 5.0, 5.0, 5.0), []),
+    ((20.5, 4.5, 5.6, 5.0), []),
+    ((18.0, 5.0, 6.0, 4.0), [
+        "Слева: 18.00 мм (отклонение 2.00 мм, требуется 20 мм ±0.6 мм)",
+        "Справа: 6.00 мм (отклонение 1.00 мм, требуется 5 мм ±0.6 мм)",
+        "Снизу: 4.00 мм (отклонение 1.00 мм, требуется 5 мм ±0.6 мм)",
+    ]),
+])
+def test_frame_messages_match_legacy(margins, expected):
+    evaluation = evaluate(DetectionTable.from_frame(margins, (0, 0, 100, 100)), FRAME_RULES)
+    errors = [evaluation.message(rule.id, row) for rule in FRAME_RULES for row in evaluation.bad_rows(rule.id)]
+    assert errors == expected
+
+
+def test_no_detections():
+    detections = Detections(np.zeros((0, 4)), np.zeros(0))
+    assert process_arrow_heads(None, detections=detections, render=False)[2] == "Ошибок нет"
+    assert process_text(None, detections=detections, render=False)[3] == "Ошибок нет"
+    assert process_arrow_distances(None, detections=detections, render=False)[2] == "Стрелки не обнаружены"
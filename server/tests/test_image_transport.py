@@ -0,0 +1,69 @@
+import io
+
+import pytest
+from PIL import Image
+
+from image_transport import ResultImageStore, clamp_quality, encode_image, negotiate_format, normalize_format
+
+
+def _image(size=(400, 200), color=(200, 30, 30)):
+    return Image.new('RGB', size, color)
+
+
+def test_normalize_format():
+    assert normalize_format('JPG') == 'jpeg'
+    assert normalize_format('webp') == 'webp'
+    assert normalize_format('gif') is None
+    assert normalize_format('') is None
+
+
+@pytest.mark.parametrize('requested, accept, expected', [
+    ('png', 'image/webp,*/*', 'png'),
+    (None, 'image/avif,image/webp,*/*', 'webp'),
+    ('bmp', 'text/html', 'jpeg'),
+    (None, None, 'jpeg'),
+])
+def test_negotiate_format(requested, accept, expected):
+    assert negotiate_format(requested, accept, default='jpeg') == expected
+
+
+@pytest.mark.parametrize('fmt, quality, expected', [
+    ('jpeg', 0, 1), ('jpeg', 250, 100), ('webp', 70, 70), ('png', 50, 9), ('png', -3, 0), ('jpeg', None, None),
+])
+def test_clamp_quality(fmt, quality, expected):
+    assert clamp_quality(fmt, quality) == expected
+
+
+@pytest.mark.parametrize('fmt', ['png', 'jpeg', 'webp'])
+def test_encode_image_format_and_preview(fmt):
+    data, mimetype = encode_image(_image(), fmt, max_side=100)
+    assert mimetype == f'image/{fmt}'
+    with Image.open(io.BytesIO(data)) as decoded:
+        assert decoded.format.lower() == fmt
+        assert decoded.size == (100, 50)
+
+
+def test_encode_image_out_of_range_quality_same_as_clamped():
+    image = _image()
+    assert encode_image(image, 'jpeg', quality=1000)[0] == encode_image(image, 'jpeg', quality=100)[0]
+    assert encode_image(image, 'png', quality=42)[0] == encode_image(image, 'png', quality=9)[0]
+
+
+def test_encode_image_keeps_source_and_converts_rgba_for_jpeg():
+    image = Image.new('RGBA', (300, 300), (0, 0, 0, 128))
+    data, _ = encode_image(image, 'jpeg', max_side=30)
+    assert image.size == (300, 300)
+    with Image.open(io.BytesIO(data)) as decoded:
+        assert decoded.mode == 'RGB'
+
+
+def test_result_image_store_evicts_by_bytes():
+    store = ResultImageStore(max_bytes=2 * 100 * 100 * 3)
+    for result_id in ('a', 'b'):
+        store.put(result_id, _image((100, 100)))
+    store.get('a')  # 'a' свежее 'b'
+    store.put('c', _image((100, 100)))
+    assert 'a' in store and 'c' in store and 'b' not in store
+    # Единственное изображение больше предела все равно хранится
+    store.put('big', _image((300, 300)))
+    assert 'big' in store and len(store._items) == 1
@@ -0,0 +1,176 @@
+import numpy as np
+import pytest
+
+from fake_model import BoxModel, blank_page, draw_box
+from incremental import (IncrementalDetector, SessionVersions, changed_cells, changed_regions, frame_offset,
+                         to_gray, _centers_inside)
+
+CELL = 64
+
+
+def _found(detections):
+    return sorted((tuple(box), cls) for box, cls in zip(detections.boxes.tolist(), detections.classes.tolist()))
+
+
+def _page(boxes, width=1024, height=768, shift=(0, 0)):
+    page = blank_page(width, height)
+    dx, dy = shift
+    for (x0, y0, x1, y1), cls_id in boxes:
+        draw_box(page, (x0 + dx, y0 + dy, x1 + dx, y1 + dy), cls_id)
+    return page
+
+
+BASE = [((100, 100, 140, 120), 0), ((400, 300, 460, 330), 1), ((800, 600, 900, 640), 2)]
+FRAME = (10.0, 10.0, 1014.0, 758.0)
+
+
+def _previous(model, page, frame_box=FRAME, **kwargs):
+    detector = IncrementalDetector(model, **kwargs)
+    detector(page, frame_box)
+    return detector.version('r0', 'k0')
+
+
+# Сравнение версий
+
+def test_frame_offset():
+    assert frame_offset((10, 10, 110, 210), (15, 7, 115, 207)) == (5, -3)
+    # Другой размер рамки - другой масштаб скана
+    assert frame_offset((10, 10, 110, 210), (10, 10, 130, 210)) is None
+
+
+def test_changed_cells_marks_only_touched_cells():
+    before = to_gray(_page(BASE))
+    after = to_gray(_page(BASE + [((300, 200, 310, 210), 0)]))
+    cells = changed_cells(before, after, (0, 0), CELL)
+    assert cells.shape == (12, 16)
+    assert np.argwhere(cells).tolist() == [[3, 4]]
+    assert not changed_cells(before, before, (0, 0), CELL).any()
+
+
+def test_changed_cells_follow_offset():
+    before = to_gray(_page(BASE))
+    after = to_gray(_page(BASE, shift=(20, 10)))
+    # Сдвиг учтен: ни одна ячейка не изменилась
+    assert not changed_cells(before, after, (20, 10), CELL).any()
+    # Без сдвига меняются все ячейки с объектами
+    assert changed_cells(before, after, (0, 0), CELL).sum() >= 3
+
+
+def test_changed_cells_new_strip_compared_with_blank():
+    before = to_gray(_page([]))
+    # Полоса слева появилась только после сдвига: объект в ней - изменение
+    after = to_gray(_page([((2, 300, 12, 320), 0)]))
+    cells = changed_cells(before, after, (30, 0), CELL)
+    assert np.argwhere(cells).tolist() == [[4, 0]]
+
+
+def test_changed_cells_ignore_noise_below_ratio():
+    before = to_gray(_page([]))
+    after = before.copy()
+    after[5, 5] = 0  # один пиксель на ячейку 64x64 - ниже доли MIN_CHANGED_RATIO
+    assert not changed_cells(before, after, (0, 0), CELL).any()
+
+
+def test_changed_regions_merge_equal_runs_only():
+    cells = np.zeros((4, 5), dtype=bool)
+    cells[0, 1:3] = True
+    cells[1, 1:3] = True
+    cells[2, 1:4] = True  # Г-образная область: третья строка шире
+    cells[3, 4] = True
+    regions = changed_regions(cells, 10, 50, 35)
+    assert regions == [(10, 0, 30, 20), (10, 20, 40, 30), (40, 30, 50, 35)]
+
+
+def test_changed_regions_clip_to_page():
+    cells = np.ones((2, 2), dtype=bool)
+    assert changed_regions(cells, 64, 100, 70) == [(0, 0, 100, 70)]
+
+
+def test_centers_inside():
+    boxes = np.array([[0, 0, 10, 10], [20, 20, 40, 40], [95, 0, 110, 10]], dtype=np.float32)
+    assert _centers_inside(boxes, [(0, 0, 30, 30), (100, 0, 200, 50)]).tolist() == [True, False, True]
+    assert _centers_inside(boxes, []).tolist() == [False, False, False]
+
+
+def test_session_versions_evict_by_bytes():
+    model = BoxModel()
+    version = _previous(model, _page(BASE))
+    versions = SessionVersions(max_bytes=int(version.nbytes * 2.5))
+    for session in ('a', 'b', 'c'):
+        versions.put(session, version)
+    assert versions.get('a') is None
+    assert versions.get('c') is version
+    assert versions.stats()['sessions'] == 2
+
+
+# Инкрементальная детекция
+
+def test_incremental_matches_full_detection():
+    model = BoxModel()
+    previous = _previous(model, _page(BASE))
+    revised = BASE[:2] + [((810, 600, 880, 650), 2), ((300, 500, 330, 520), 0), ((600, 100, 640, 130), 1)]
+    page = _page(revised)
+
+    model.calls.clear()
+    detector = IncrementalDetector(model, previous, cell_size=CELL)
+    detections, report = detector(page, FRAME)
+
+    assert _found(detections) == sorted(revised)
+    assert report['mode'] == 'incremental'
+    assert report['reused_detections'] == 2
+    assert report['new_detections'] == 3
+    # Все области - по одному вызову модели на размер входа
+    regions = len(report['recomputed_regions'])
+    assert regions >= 3
+    assert sum(count for count, _ in model.calls) == regions
+    assert len(model.calls) == len({imgsz for _, imgsz in model.calls}) < regions
+
+
+def test_incremental_follows_frame_shift():
+    model = BoxModel()
+    previous = _previous(model, _page(BASE))
+    shift = (16, 8)
+    page = _page(BASE + [((500, 500, 520, 510), 0)], shift=shift)
+    frame = tuple(v + shift[i % 2] for i, v in enumerate(FRAME))
+
+    detections, report = IncrementalDetector(model, previous, cell_size=CELL)(page, frame)
+    expected = [((x0 + 16, y0 + 8, x1 + 16, y1 + 8), cls)
+                for (x0, y0, x1, y1), cls in BASE + [((500, 500, 520, 510), 0)]]
+    assert _found(detections) == sorted(expected)
+    assert report['offset'] == [16, 8]
+    assert report['reused_detections'] == 3
+
+
+def test_incremental_passes_cancel():
+    model = BoxModel()
+    previous = _previous(model, _page(BASE))
+    cancel = object()
+    model.cancels.clear()
+    IncrementalDetector(model, previous, cell_size=CELL)(_page(BASE[:2]), FRAME, cancel=cancel)
+    assert model.cancels and all(c is cancel for c in model.cancels)
+
+
+@pytest.mark.parametrize('kwargs, reason', [
+    ({'max_regions': 3}, 'областей'),
+    ({'max_changed': 0.01}, 'листа'),
+])
+def test_fallback_to_full_pass(kwargs, reason):
+    model = BoxModel()
+    previous = _previous(model, _page(BASE))
+    # Разрозненные мелкие правки по всему листу
+    scattered = BASE + [((x, y, x + 8, y + 8), 0) for x in range(40, 1000, 150) for y in (40, 700)]
+    page = _page(scattered)
+
+    detections, report = IncrementalDetector(model, previous, cell_size=CELL, **kwargs)(page, FRAME)
+    assert report['mode'] == 'full'
+    assert reason in report['incremental']['fallback']
+    assert _found(detections) == sorted(scattered)
+
+
+def test_fallback_on_new_settings_and_missing_frame():
+    model = BoxModel()
+    previous = _previous(model, _page(BASE))
+    _, report = IncrementalDetector(model, previous, tiling={'tile_size': 512, 'overlap': 0.2})(_page(BASE), FRAME)
+    assert report['incremental']['fallback'] == 'изменился режим детекции'
+    _, report = IncrementalDetector(model, previous)(_page(BASE), None)
+    assert report['incremental']['fallback'] == 'рамка не найдена'
@@ -0,0 +1,165 @@
+import numpy as np
+import pytest
+
+import inference_backends
+from inference_backends import letterbox, nms, preprocess, _ExportedModel, LETTERBOX_FILL, MAX_DETECTIONS
+
+
+class ArrayModel(_ExportedModel):
+    """Экспортированная модель-заглушка: выход по батчу задает функция output(batch)"""
+
+    def __init__(self, output, **kwargs):
+        super().__init__(**kwargs)
+        self.output = output
+        self.batches = []
+
+    def _load(self):
+        pass
+
+    def _infer(self, batch):
+        self.batches.append(batch.shape)
+        return self.output(batch)
+
+
+def _reference_nms(boxes, classes, conf, iou):
+    """Жадный NMS по классам: самый уверенный бокс гасит пересекающиеся сильнее iou"""
+    keep = []
+    for cls_id in np.unique(classes):
+        idx = np.flatnonzero(classes == cls_id)
+        idx = idx[np.argsort(-conf[idx], kind='stable')]
+        while len(idx):
+            best, rest = idx[0], idx[1:]
+            keep.append(best)
+            b, r = boxes[best], boxes[rest]
+            iw = np.clip(np.minimum(b[2], r[:, 2]) - np.maximum(b[0], r[:, 0]), 0, None)
+            ih = np.clip(np.minimum(b[3], r[:, 3]) - np.maximum(b[1], r[:, 1]), 0, None)
+            inter = iw * ih
+            union = (b[2] - b[0]) * (b[3] - b[1]) + (r[:, 2] - r[:, 0]) * (r[:, 3] - r[:, 1]) - inter
+            idx = rest[inter / union <= iou]
+    keep = np.array(keep, dtype=np.int64)
+    return keep[np.argsort(-conf[keep], kind='stable')]
+
+
+def _clustered(seed, n_objects=40, per_object=8):
+    """Кандидаты как у детектора: несколько сдвинутых боксов вокруг каждого объекта"""
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform(50, 600, (n_objects, 2))
+    sizes = rng.uniform(10, 60, (n_objects, 2))
+    boxes = []
+    for center, size in zip(centers, sizes):
+        jitter = rng.normal(0, size / 8, (per_object, 2))
+        scale = rng.uniform(0.8, 1.2, (per_object, 2))
+        c, s = center + jitter, size * scale
+        boxes.append(np.concatenate([c - s / 2, c + s / 2], axis=1))
+    boxes = np.concatenate(boxes).astype(np.float32)
+    classes = rng.integers(0, 3, len(boxes))
+    conf = rng.permutation(len(boxes)).astype(np.float32) / len(boxes) + 0.01
+    return boxes, classes, conf
+
+
+# Letterbox и вход модели
+
+def test_letterbox_keeps_aspect_and_centers():
+    image = np.zeros((100, 200, 3), dtype=np.uint8)
+    square, ratio, (left, top) = letterbox(image, 64)
+    assert square.shape == (64, 64, 3)
+    assert ratio == pytest.approx(0.32)
+    assert (left, top) == (0, 16)
+    assert (square[:16] == LETTERBOX_FILL).all() and (square[48:] == LETTERBOX_FILL).all()
+    assert (square[16:48] == 0).all()
+
+
+def test_preprocess_layout():
+    images = [np.full((30, 40, 3), (10, 20, 30), dtype=np.uint8), np.zeros((50, 20, 3), dtype=np.uint8)]
+    batch, metas = preprocess(images, 32)
+    assert batch.shape == (2, 3, 32, 32)
+    assert batch.dtype == np.float32 and batch.flags['C_CONTIGUOUS']
+    # BGR-массив разворачивается в RGB, значения 0..1
+    assert batch[0, :, 16, 16].tolist() == pytest.approx([30 / 255, 20 / 255, 10 / 255])
+    assert [meta[2] for meta in metas] == [(30, 40), (50, 20)]
+
+
+# NMS
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('iou', [0.45, 0.7])
+def test_nms_matches_greedy_reference(seed, iou):
+    boxes, classes, conf = _clustered(seed)
+    assert nms(boxes, classes, conf, iou).tolist() == _reference_nms(boxes, classes, conf, iou).tolist()
+
+
+def test_nms_classes_independent():
+    boxes = np.array([[0, 0, 10, 10], [0, 0, 10, 10], [1, 1, 10, 10]], dtype=np.float32)
+    classes = np.array([0, 1, 0])
+    conf = np.array([0.5, 0.9, 0.8], dtype=np.float32)
+    assert nms(boxes, classes, conf, 0.5).tolist() == [1, 2]
+
+
+def test_nms_empty():
+    assert nms(np.empty((0, 4), dtype=np.float32), np.empty(0), np.empty(0, dtype=np.float32), 0.5).size == 0
+
+
+# Декодирование выхода
+
+def _prediction(square_boxes, classes, conf, n_classes=3, anchors=64):
+    """Выход YOLO одного изображения: (4 + классы, якоря), xywh в координатах квадрата"""
+    prediction = np.zeros((4 + n_classes, anchors), dtype=np.float32)
+    for i, (box, cls_id, score) in enumerate(zip(square_boxes, classes, conf)):
+        x0, y0, x1, y1 = box
+        prediction[:4, i] = [(x0 + x1) / 2, (y0 + y1) / 2, x1 - x0, y1 - y0]
+        prediction[4 + cls_id, i] = score
+    return prediction
+
+
+def test_predict_maps_boxes_back_to_image():
+    # 200x100 → квадрат 64: масштаб 0.32, сдвиг по y 16
+    image = np.zeros((100, 200, 3), dtype=np.uint8)
+    boxes = np.array([[20, 10, 60, 40], [100, 50, 150, 90]], dtype=np.float32)
+    square = boxes * 0.32 + np.array([0, 16, 0, 16], dtype=np.float32)
+    prediction = _prediction(square, [1, 2], [0.9, 0.6])
+    model = ArrayModel(lambda batch: np.stack([prediction] * len(batch)))
+
+    (result,) = model.predict(image, imgsz=64)
+    assert result.boxes.xyxy == pytest.approx(boxes, abs=1e-3)
+    assert result.boxes.cls.tolist() == [1, 2]
+    assert result.boxes.conf.tolist() == pytest.approx([0.9, 0.6])
+    assert set(result.speed) == {'preprocess', 'inference', 'postprocess'}
+
+
+def test_predict_accepts_transposed_output_and_threshold():
+    image = np.zeros((64, 64, 3), dtype=np.uint8)
+    prediction = _prediction([[0, 0, 10, 10], [20, 20, 30, 30]], [0, 0], [0.9, 0.1])
+    model = ArrayModel(lambda batch: np.stack([prediction.T] * len(batch)), conf=0.25)
+    (result,) = model.predict(image, imgsz=64)
+    # Ниже порога уверенности бокс отбрасывается еще до NMS
+    assert result.boxes.xyxy.tolist() == [[0, 0, 10, 10]]
+
+
+def test_predict_caps_candidates_and_detections(monkeypatch):
+    anchors = 400
+    rng = np.random.default_rng(0)
+    xy = rng.uniform(0, 600, (anchors, 2))
+    boxes = np.concatenate([xy, xy + 4], axis=1)  # мелкие, не пересекаются
+    conf = np.linspace(0.3, 0.99, anchors)
+    prediction = _prediction(boxes, [0] * anchors, conf, anchors=anchors)
+    model = ArrayModel(lambda batch: np.stack([prediction] * len(batch)))
+
+    monkeypatch.setattr(inference_backends, 'MAX_NMS', 50)
+    (result,) = model.predict(np.zeros((640, 640, 3), dtype=np.uint8), imgsz=640)
+    # В NMS попали только 50 самых уверенных
+    assert len(result.boxes.conf) == 50
+    assert result.boxes.conf.min() == pytest.approx(conf[-50])
+
+    monkeypatch.setattr(inference_backends, 'MAX_NMS', 30000)
+    (result,) = model.predict(np.zeros((640, 640, 3), dtype=np.uint8), imgsz=640)
+    assert len(result.boxes.conf) == min(anchors, MAX_DETECTIONS)
+
+
+def test_fixed_batch_and_imgsz():
+    prediction = _prediction([], [], [])
+    model = ArrayModel(lambda batch: np.stack([prediction] * len(batch)))
+    model.fixed_batch, model.fixed_imgsz = 2, 32
+    results = model.predict([np.zeros((10, 10, 3), dtype=np.uint8)] * 5, imgsz=640)
+    assert len(results) == 5
+    # Остаток дополняется до фиксированного батча
+    assert model.batches == [(2, 3, 32, 32)] * 3
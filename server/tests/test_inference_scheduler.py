@@ -0,0 +1,78 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from inference_scheduler import InferenceScheduler
+from stage_graph import Cancelled
+
+
+class RecordingModel:
+    """Модель-заглушка: запоминает размеры батчей и imgsz"""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+
+    def predict(self, images, imgsz=640):
+        self.calls.append((len(images), imgsz))
+        time.sleep(self.delay)
+        return [(int(image[0, 0]), imgsz) for image in images]
+
+
+def _image(value):
+    return np.full((4, 4), value, dtype=np.uint8)
+
+
+def test_scheduler_batches_concurrent_requests():
+    model = RecordingModel()
+    scheduler = InferenceScheduler(model, max_batch_size=8, max_wait_ms=200)
+    results = [None] * 4
+
+    def request(i):
+        results[i] = scheduler.predict(_image(i))[0]
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    scheduler.close()
+
+    assert results == [(i, 640) for i in range(4)]
+    assert sum(size for size, _ in model.calls) == 4
+    assert len(model.calls) < 4
+
+
+def test_scheduler_respects_max_batch_size():
+    model = RecordingModel()
+    scheduler = InferenceScheduler(model, max_batch_size=3, max_wait_ms=50)
+    results = scheduler.predict([_image(i) for i in range(7)])
+    scheduler.close()
+    assert [value for value, _ in results] == list(range(7))
+    assert max(size for size, _ in model.calls) <= 3
+
+
+def test_scheduler_does_not_mix_imgsz():
+    model = RecordingModel()
+    scheduler = InferenceScheduler(model, max_batch_size=8, max_wait_ms=100)
+    futures = [scheduler.submit(_image(i), imgsz=640 if i % 2 else 256) for i in range(6)]
+    results = [future.result() for future in futures]
+    scheduler.close()
+    assert results == [(i, 640 if i % 2 else 256) for i in range(6)]
+    assert sorted(model.calls) == [(3, 256), (3, 640)]
+
+
+def test_scheduler_predict_cancel():
+    model = RecordingModel(delay=0.3)
+    scheduler = InferenceScheduler(model, max_batch_size=1, max_wait_ms=0)
+    cancel = threading.Event()
+    threading.Timer(0.1, cancel.set).start()
+    started = time.monotonic()
+    with pytest.raises(Cancelled):
+        scheduler.predict([_image(i) for i in range(4)], cancel=cancel)
+    assert time.monotonic() - started < 0.3
+    scheduler.close()
+    # Изображения, еще не взятые в батч, сняты с очереди
+    assert len(model.calls) == 1
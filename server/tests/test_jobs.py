@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pytest
+
+from jobs import JobManager, QueueFullError, CANCELLED, DONE, FAILED
+from stage_graph import Cancelled
+
+
+@pytest.fixture
+def manager():
+    manager = JobManager(max_workers=1, max_pending=2)
+    yield manager
+    manager.shutdown(timeout=5)
+
+
+def _blocker():
+    release = threading.Event()
+
+    def fn(job):
+        release.wait(5)
+        return 'busy'
+    return fn, release
+
+
+def test_job_result(manager):
+    job = manager.submit(lambda job, x: x * 2, 21)
+    assert job.wait(5)
+    assert job.status == DONE
+    assert job.result == 42
+    assert manager.get(job.id) is job
+
+
+def test_job_error(manager):
+    def broken(job):
+        raise RuntimeError("сбой")
+
+    job = manager.submit(broken)
+    assert job.wait(5)
+    assert job.status == FAILED
+    assert job.error == "сбой"
+
+
+def test_cancel_queued_job_never_runs(manager):
+    busy, release = _blocker()
+    manager.submit(busy)
+    ran = []
+    queued = manager.submit(lambda job: ran.append(True))
+    callbacks = []
+    queued.add_done_callback(lambda job: callbacks.append(job.status))
+
+    assert queued.cancel()
+    assert queued.status == CANCELLED
+    assert callbacks == [CANCELLED]
+    release.set()
+    time.sleep(0.2)
+    assert ran == []
+
+
+def test_cancel_running_job(manager):
+    started = threading.Event()
+
+    def stages(job):
+        started.set()
+        while not job.cancel_event.wait(0.01):
+            pass
+        raise Cancelled("Проверка отменена")
+
+    job = manager.submit(stages)
+    assert started.wait(5)
+    assert job.cancel()
+    assert job.wait(5)
+    assert job.status == CANCELLED
+    # Повторная отмена завершенной задачи ничего не меняет
+    assert not job.cancel()
+
+
+def test_queue_full(manager):
+    busy, release = _blocker()
+    manager.submit(busy)
+    manager.submit(busy)
+    with pytest.raises(QueueFullError):
+        manager.submit(busy)
+    release.set()
+
+
+def test_submit_wait_gets_freed_slot(manager):
+    busy, release = _blocker()
+    manager.submit(busy)
+    manager.submit(busy)
+    threading.Timer(0.1, release.set).start()
+    job = manager.submit_wait(5, lambda job: 'ok')
+    assert job.wait(5)
+    assert job.result == 'ok'
+
+
+def test_submit_wait_times_out(manager):
+    busy, release = _blocker()
+    manager.submit(busy)
+    manager.submit(busy)
+    started = time.monotonic()
+    with pytest.raises(QueueFullError):
+        manager.submit_wait(0.1, lambda job: 'ok')
+    assert time.monotonic() - started < 1.0
+    release.set()
+
+
+def test_close_refuses_new_jobs_and_keeps_running(manager):
+    busy, release = _blocker()
+    job = manager.submit(busy)
+    manager.close()
+    with pytest.raises(QueueFullError, match='останавливается'):
+        manager.submit(lambda job: 'ok')
+    # close не ждет: принятая задача дорабатывает
+    assert not job.finished
+    release.set()
+    assert job.wait(5) and job.result == 'busy'
+
+
+def test_close_wakes_submit_wait(manager):
+    busy, release = _blocker()
+    manager.submit(busy)
+    manager.submit(busy)
+    threading.Timer(0.1, manager.close).start()
+    started = time.monotonic()
+    with pytest.raises(QueueFullError):
+        manager.submit_wait(5, lambda job: 'ok')
+    assert time.monotonic() - started < 1.0
+    release.set()
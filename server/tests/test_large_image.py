@@ -0,0 +1,70 @@
+import io
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+import large_image
+from large_image import open_image, ImageTooLarge, LargeImage
+
+
+def _file(mode, size=(301, 203), fmt='PNG'):
+    rng = np.random.default_rng(0)
+    w, h = size
+    pixels = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+    image = Image.fromarray(pixels).convert(mode)
+    buffer = io.BytesIO()
+    image.save(buffer, fmt)
+    buffer.seek(0)
+    return buffer, image.convert('RGB')
+
+
+def test_small_image_decoded_whole():
+    file, expected = _file('RGB')
+    image_np = open_image(file, large_pixels=10 ** 6)
+    assert isinstance(image_np, np.ndarray)
+    assert not image_np.flags.writeable
+    assert np.array_equal(image_np, np.asarray(expected))
+
+
+def test_too_large_checked_by_header():
+    file, _ = _file('L')
+    with pytest.raises(ImageTooLarge):
+        open_image(file, max_pixels=301 * 203 - 1)
+    # Предел включительный
+    file.seek(0)
+    assert open_image(file, max_pixels=301 * 203).shape == (203, 301, 3)
+
+
+def test_broken_file():
+    with pytest.raises(Exception, match='Ошибка чтения изображения'):
+        open_image(io.BytesIO(b'not an image'))
+
+
+@pytest.mark.parametrize('mode', ['RGB', 'L', '1'])
+def test_large_image_matches_whole_decode(mode, monkeypatch):
+    # Мелкие полосы: на листе их несколько, последняя неполная
+    monkeypatch.setattr(large_image, 'BAND_PIXELS', 301 * 20)
+    file, expected = _file(mode)
+    image = open_image(file, large_pixels=1000, work_max_side=64)
+
+    assert isinstance(image, LargeImage)
+    assert image.factor == 5
+    assert image.shape == (203, 301, 3)
+    assert not image.full.flags.writeable and not image.preview.flags.writeable
+    assert np.array_equal(image.full, np.asarray(expected))
+    # Уменьшение по полосам совпадает с уменьшением всей страницы
+    assert np.array_equal(image.preview, np.asarray(expected.reduce(5)))
+    assert image.report() == {'width': 301, 'height': 203, 'factor': 5, 'work_width': 61, 'work_height': 41}
+
+
+def test_gray_strips_convert_only_slice():
+    file, expected = _file('RGB')
+    image = open_image(file, large_pixels=1000, work_max_side=100)
+    strips = image.gray_strips()
+    assert strips.shape == (203, 301)
+    reference = cv2.cvtColor(np.asarray(expected), cv2.COLOR_RGB2GRAY)
+    assert np.array_equal(strips[50:70], reference[50:70])
+    assert np.array_equal(strips[:, 10:20], reference[:, 10:20])
+    assert strips[300:310].shape == (0, 301)
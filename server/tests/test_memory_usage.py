@@ -0,0 +1,65 @@
+import time
+
+import numpy as np
+
+from memory_usage import ProcessRSSMonitor, current_rss_bytes
+from metrics import StageTimings
+
+INTERVAL = 0.01
+GROWTH = 64 * 2 ** 20
+
+
+def _wait_stopped(monitor):
+    for _ in range(100):
+        if monitor._thread is None:
+            return
+        time.sleep(INTERVAL)
+
+
+def test_window_sees_process_peak():
+    monitor = ProcessRSSMonitor(INTERVAL)
+    window = monitor.window()
+    block = np.ones(GROWTH, dtype=np.uint8)  # страницы заняты записью
+    time.sleep(INTERVAL * 10)
+    del block
+    window.close()
+    assert window.peak_delta_bytes >= GROWTH * 0.8
+    assert window.peak_bytes >= window.start_bytes
+
+
+def test_one_thread_for_all_windows():
+    monitor = ProcessRSSMonitor(INTERVAL)
+    windows = [monitor.window()]
+    thread = monitor._thread
+    windows += [monitor.window() for _ in range(4)]
+    assert monitor.active_windows == 5
+    assert thread.is_alive() and monitor._thread is thread
+    for window in windows:
+        window.close()
+    assert monitor.active_windows == 0
+    # Без открытых окон поток завершается
+    _wait_stopped(monitor)
+    assert monitor._thread is None
+
+
+def test_suspended_window_not_sampled():
+    monitor = ProcessRSSMonitor(INTERVAL)
+    window = monitor.window(suspended=True)
+    assert monitor.active_windows == 0
+    window.close()
+    assert window.peak_bytes == window.start_bytes
+    window.resume()
+    window.resume()
+    assert monitor.active_windows == 1
+    window.pause()
+    assert monitor.active_windows == 0
+
+
+def test_stage_timings_labels_process_memory():
+    monitor = ProcessRSSMonitor(INTERVAL)
+    timings = StageTimings(rss_monitor=monitor)
+    memory = timings.close()
+    assert set(memory) == {'process_peak_rss_mb', 'process_rss_growth_mb'}
+    assert memory['process_peak_rss_mb'] >= current_rss_bytes() / 2 ** 20 * 0.5
+    assert timings.close() == {}
+    assert StageTimings().close() == {}
@@ -0,0 +1,120 @@
+"""Поиск рамки от грубого к точному дает ту же рамку, что и прежний поиск в полном разрешении"""
+import io
+import os
+import threading
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from large_image import open_image
+from process_borders import find_frame, check_borders, FRAME_OK_TEXT, A3_WIDTH_MM, A3_HEIGHT_MM
+from stage_graph import Cancelled
+
+SAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'application', 'image')
+
+
+def _legacy_find_frame(rgb):
+    """Прежний поиск: самый большой четырехугольник среди всех контуров полного разрешения"""
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    edges = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150)
+    contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    max_area = 0
+    best_rect = None
+    for cnt in contours:
+        approx = cv2.approxPolyDP(cnt, 0.01 * cv2.arcLength(cnt, True), True)
+        if len(approx) == 4:
+            area = cv2.contourArea(approx)
+            if area > max_area:
+                max_area = area
+                best_rect = approx
+    if best_rect is None:
+        raise ValueError("Рамка не найдена")
+    return cv2.boundingRect(best_rect)
+
+
+def _sheet(dpi, margins_mm=(20, 5, 5, 5), seed=0):
+    """Лист A3 с рамкой по полям (слева, сверху, справа, снизу) и мелкими элементами чертежа"""
+    mm = dpi / 25.4
+    w, h = round(A3_WIDTH_MM * mm), round(A3_HEIGHT_MM * mm)
+    page = np.full((h, w, 3), 255, dtype=np.uint8)
+    left, top, right, bottom = margins_mm
+    x0, y0 = round(left * mm), round(top * mm)
+    x1, y1 = w - round(right * mm), h - round(bottom * mm)
+    thickness = max(2, round(0.7 * mm))
+    cv2.rectangle(page, (x0, y0), (x1 - 1, y1 - 1), (0, 0, 0), thickness)
+    # Отрезки и мелкие прямоугольники внутри рамки - как текст и штриховка
+    rng = np.random.default_rng(seed)
+    for _ in range(40):
+        cx, cy = rng.integers(x0 + 50, x1 - 200), rng.integers(y0 + 50, y1 - 200)
+        cv2.rectangle(page, (int(cx), int(cy)), (int(cx + rng.integers(10, 150)), int(cy + rng.integers(10, 80))),
+                      (0, 0, 0), 1)
+    page.flags.writeable = False
+    return page
+
+
+def _samples():
+    names = sorted(os.listdir(SAMPLES_DIR))
+    return [name for name in names if name.lower().endswith(('.png', '.jpg'))]
+
+
+@pytest.mark.parametrize('name', _samples())
+def test_samples_match_legacy(name):
+    with Image.open(os.path.join(SAMPLES_DIR, name)) as image:
+        rgb = np.asarray(image.convert('RGB'))
+    try:
+        expected = _legacy_find_frame(rgb)
+    except ValueError:
+        with pytest.raises(ValueError):
+            find_frame(rgb)
+        return
+    assert find_frame(rgb) == tuple(expected)
+
+
+def _edges_of(frame):
+    x, y, w, h = frame
+    return np.array([x, y, x + w, y + h])
+
+
+@pytest.mark.parametrize('dpi', [150, 300, 600])
+def test_large_sheet_finds_outer_frame_edge(dpi):
+    page = _sheet(dpi)
+    # Рамка - самый внешний темный контур листа
+    rows, cols = np.nonzero(page[..., 0] < 128)
+    outer = np.array([cols.min(), rows.min(), cols.max() + 1, rows.max() + 1])
+    found = _edges_of(find_frame(page))
+    assert np.abs(found - outer).max() <= 2
+    if dpi <= 300:
+        # Прежний поиск дает ту же рамку с той же точностью
+        assert np.abs(_edges_of(_legacy_find_frame(page)) - outer).max() <= 2
+
+
+def test_large_image_matches_full_array():
+    page = _sheet(300, seed=1)
+    buffer = io.BytesIO()
+    Image.fromarray(page).save(buffer, 'PNG')
+    buffer.seek(0)
+    large = open_image(buffer, max_pixels=0, large_pixels=1, work_max_side=1500)
+    assert large.factor > 1
+    assert np.abs(np.subtract(find_frame(large), find_frame(page))).max() <= 2
+
+
+def test_check_borders_on_gost_margins():
+    _, text, _ = check_borders(_sheet(150))
+    assert text == FRAME_OK_TEXT
+
+    _, text, _ = check_borders(_sheet(150, margins_mm=(10, 5, 5, 5)))
+    assert text != FRAME_OK_TEXT
+
+
+def test_no_frame():
+    with pytest.raises(ValueError):
+        find_frame(np.full((600, 400, 3), 255, dtype=np.uint8))
+
+
+def test_cancel():
+    cancel = threading.Event()
+    cancel.set()
+    with pytest.raises(Cancelled):
+        find_frame(_sheet(150), cancel=cancel)
@@ -0,0 +1,190 @@
+import io
+import threading
+import time
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from annotations import AnnotationLayer
+from result_store import ResultStore, IMAGE, ORIGINAL, OVERLAY, thumbnail_kind
+
+
+def _report(total=0):
+    return {'summary': {'total_violations': total}}
+
+
+def _noise(seed, side=64):
+    # Шум почти не сжимается: размер блобов предсказуем
+    pixels = np.random.default_rng(seed).integers(0, 256, (side, side, 3), dtype=np.uint8)
+    pixels.flags.writeable = False
+    return pixels
+
+
+def _submit(store, result_id, session_id='s', seed=0, filename=None):
+    pixels = _noise(seed)
+    return store.submit(result_id, session_id, f"text {result_id}", _report(seed), {'text': seed},
+                        image=Image.fromarray(pixels), pixels=pixels, filename=filename)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ResultStore(str(tmp_path), thumbnail_sizes=(32, 16))
+    yield store
+    store.close(timeout=5)
+
+
+def test_saved_result_and_blobs(store):
+    assert _submit(store, 'r1', filename='a.png')
+    result = store.get('r1')
+    assert result['text'] == 'text r1'
+    assert result['width'] == result['height'] == 64
+    # Листы наборов приходят без файла: исходник не хранится
+    assert set(result['blobs']) == {IMAGE, thumbnail_kind(32), thumbnail_kind(16)}
+    with Image.open(store.blob('r1', thumbnail_kind(16))[0]) as thumb:
+        assert max(thumb.size) == 16
+    assert store.get('missing') is None
+
+
+def test_staged_original_is_moved_into_blobs(store):
+    buffer = io.BytesIO()
+    Image.fromarray(_noise(1)).save(buffer, 'PNG')
+    buffer.seek(0)
+    staged = store.stage(buffer)
+    pixels = _noise(1)
+    store.submit('r1', 's', 'text', _report(), {}, image=Image.fromarray(pixels), pixels=pixels, original=staged)
+    path, mimetype, _ = store.blob('r1', ORIGINAL)
+    assert mimetype == 'image/png'
+    with open(path, 'rb') as f:
+        assert f.read() == buffer.getvalue()
+
+
+def test_pending_result_is_visible_to_other_instance(tmp_path):
+    writer = ResultStore(str(tmp_path))
+    reader = ResultStore(str(tmp_path))
+    release = threading.Event()
+    encode = writer._encode
+
+    def slow_encode(*args):
+        release.wait(5)
+        return encode(*args)
+
+    writer._encode = slow_encode
+    _submit(writer, 'r1')
+    found = []
+    thread = threading.Thread(target=lambda: found.append(reader.get('r1')))
+    thread.start()
+    time.sleep(0.2)
+    # Запись еще идет: читатель ждет ее, а не отвечает "нет результата"
+    assert thread.is_alive()
+    assert reader.stats()['pending'] == 1
+    release.set()
+    thread.join(5)
+    assert found[0]['result_id'] == 'r1'
+    assert reader.stats()['pending'] == 0
+    writer.close(timeout=5)
+    reader.close(timeout=5)
+
+
+def test_repeat_check_adds_history_only(store):
+    _submit(store, 'r1', filename='a.png')
+    _submit(store, 'r1', filename='b.png')
+    items, _ = store.history('s')
+    assert [item['filename'] for item in items] == ['b.png', 'a.png']
+    stats = store.stats()
+    assert stats['results'] == 1
+    assert stats['history'] == 2
+
+
+def test_history_pagination(store):
+    for i in range(5):
+        _submit(store, f'r{i}', seed=i, filename=f'{i}.png')
+    _submit(store, 'other', session_id='другая')
+
+    pages = []
+    cursor = None
+    while True:
+        items, cursor = store.history('s', limit=2, before=cursor)
+        pages.append([item['filename'] for item in items])
+        if cursor is None:
+            break
+    assert pages == [['4.png', '3.png'], ['2.png', '1.png'], ['0.png']]
+    first = store.history('s', limit=1)[0][0]
+    assert first['has_image'] and not first['has_original'] and not first['has_overlay']
+    assert first['thumbnail_sizes'] == [16, 32]
+
+
+def test_evicts_least_recently_seen(tmp_path):
+    probe = ResultStore(str(tmp_path / 'probe'), thumbnail_sizes=())
+    _submit(probe, 'r', seed=0)
+    probe.close(timeout=5)
+    one_result = probe.stats()['bytes']
+    assert one_result > 0
+
+    store = ResultStore(str(tmp_path / 'store'), thumbnail_sizes=(), max_bytes=int(one_result * 2.5))
+    _submit(store, 'r0', seed=0)
+    _submit(store, 'r1', seed=1)
+    # Повторная проверка r0 делает его свежее r1
+    _submit(store, 'r0', seed=0)
+    _submit(store, 'r2', seed=2)
+    store.close(timeout=5)
+
+    assert store.get('r1') is None
+    assert store.get('r0') is not None
+    assert store.get('r2') is not None
+    assert store.stats()['bytes'] <= one_result * 2.5
+    assert 'r1' not in {item['result_id'] for item in store.history('s', limit=10)[0]}
+
+
+def test_evicts_by_age(tmp_path):
+    store = ResultStore(str(tmp_path), thumbnail_sizes=(), max_age_s=0.2)
+    _submit(store, 'old', seed=0)
+    store.get('old')
+    time.sleep(0.3)
+    _submit(store, 'new', seed=1)
+    store.close(timeout=5)
+    assert store.get('old') is None
+    assert store.get('new') is not None
+    assert store.stats()['results'] == 1
+
+
+def test_overlay_result_is_stored_as_layer(store):
+    layer = AnnotationLayer()
+    layer.rect((1.25, 2, 30, 40), (255, 0, 0), kind='frame', message='рамка')
+    layer.text((5, 5), 'подпись', (0, 0, 255))
+    pixels = _noise(3)
+    store.submit('r1', 's', 'text', _report(), {}, image=layer, pixels=pixels)
+
+    # Ни картинки, ни миниатюр: их рисуют при первом запросе
+    assert set(store.get('r1')['blobs']) == {OVERLAY}
+    restored = store.layer('r1')
+    assert restored.items == layer.items
+    assert np.array_equal(np.asarray(restored.rasterize(pixels)), np.asarray(layer.rasterize(pixels)))
+    assert store.history('s')[0][0]['has_overlay']
+    assert store.layer('missing') is None
+
+
+def test_full_queue_drops_record(tmp_path):
+    store = ResultStore(str(tmp_path), thumbnail_sizes=(), max_pending=1)
+    release = threading.Event()
+    encode = store._encode
+
+    def slow_encode(*args):
+        release.wait(5)
+        return encode(*args)
+
+    store._encode = slow_encode
+    assert _submit(store, 'r0', seed=0)
+    time.sleep(0.1)
+    assert _submit(store, 'r1', seed=1)
+    started = time.monotonic()
+    # Поток записи занят, очередь полна: проверка не ждет
+    assert not _submit(store, 'r2', seed=2)
+    assert time.monotonic() - started < 1.0
+    assert store.stats()['pending'] == 2
+    release.set()
+    store.close(timeout=5)
+
+    stats = store.stats()
+    assert (stats['saved'], stats['dropped'], stats['pending']) == (2, 1, 0)
+    assert store.get('r2') is None
@@ -0,0 +1,163 @@
+import threading
+
+import numpy as np
+import pytest
+
+from detections import Detections, detect
+from fake_model import BoxModel, blank_page, draw_box
+from shadow import ShadowEvaluator, match_boxes, _agreement
+
+
+def _boxes(*boxes):
+    return np.array(boxes, dtype=np.float32).reshape(-1, 4)
+
+
+# Сопоставление боксов
+
+def test_match_boxes_one_pair_per_box():
+    a = _boxes([0, 0, 10, 10], [100, 100, 110, 110])
+    b = _boxes([0, 0, 10, 10], [1, 0, 11, 10], [100, 100, 110, 110])
+    assert match_boxes(a, b) == 2
+    assert match_boxes(b, a) == 2
+    # Два одинаковых бокса основной модели - одна пара на один бокс кандидата
+    assert match_boxes(_boxes([0, 0, 10, 10], [0, 0, 10, 10]), _boxes([0, 0, 10, 10])) == 1
+
+
+def test_match_boxes_prefers_higher_iou():
+    # b[0] пересекается с обоими, но лучше со вторым; первый достается b[1]
+    a = _boxes([0, 0, 10, 10], [2, 0, 12, 10])
+    b = _boxes([2, 0, 12, 10], [0, 0, 10, 10])
+    assert match_boxes(a, b) == 2
+
+
+def test_match_boxes_threshold_and_empty():
+    a, b = _boxes([0, 0, 10, 10]), _boxes([5, 0, 15, 10])  # IoU 1/3
+    assert match_boxes(a, b, 0.5) == 0
+    assert match_boxes(a, b, 0.3) == 1
+    assert match_boxes(a, _boxes()) == 0
+    assert match_boxes(_boxes(), _boxes()) == 0
+
+
+@pytest.mark.parametrize('args, expected', [
+    ((4, 5, 4), (0.8, 1.0)),
+    ((4, 2, 2), (1.0, 0.5)),
+    ((0, 0, 0), (1.0, 1.0)),
+    ((3, 0, 0), (0.0, 0.0)),
+    ((0, 2, 0), (0.0, 0.0)),  # лишние боксы при пустой основной - расхождение
+])
+def test_agreement(args, expected):
+    result = _agreement(*args)
+    assert (result['precision'], result['recall']) == expected
+    p, r = expected
+    assert result['f1'] == pytest.approx(2 * p * r / (p + r) if p + r else 0.0, abs=1e-4)
+
+
+# Фоновая проверка кандидата
+
+class Samples:
+    """on_sample с ожиданием n образцов"""
+
+    def __init__(self):
+        self.results = []
+        self._cond = threading.Condition()
+
+    def __call__(self, result, seconds):
+        with self._cond:
+            self.results.append((result, seconds))
+            self._cond.notify_all()
+
+    def wait(self, n, timeout=5):
+        with self._cond:
+            assert self._cond.wait_for(lambda: len(self.results) >= n, timeout)
+        return self.results
+
+
+def _page():
+    page = blank_page(640, 480)
+    for box, cls_id in [((20, 20, 60, 40), 0), ((100, 100, 180, 130), 1), ((300, 300, 340, 320), 2),
+                        ((400, 50, 420, 70), 2)]:
+        draw_box(page, box, cls_id)
+    return page
+
+
+def test_candidate_agreement_stats():
+    page = _page()
+    full = detect(page, BoxModel())
+    # Основная модель пропустила один текстовый бокс
+    keep = np.arange(len(full)) != len(full) - 1
+    primary = Detections(full.boxes[keep], full.classes[keep])
+    samples = Samples()
+    shadow = ShadowEvaluator(BoxModel(), sample_rate=1.0, on_sample=samples)
+    try:
+        assert shadow.submit(page, primary, primary_ms=12.0)
+        (result, seconds), = samples.wait(1)
+        assert result == 'evaluated' and seconds >= 0
+        stats = shadow.stats()
+    finally:
+        shadow.close()
+
+    assert (stats['sampled'], stats['evaluated'], stats['dropped'], stats['errors']) == (1, 1, 0, 0)
+    detections = stats['detections']
+    assert (detections['primary'], detections['candidate'], detections['matched']) == (3, 4, 3)
+    assert detections['recall'] == 1.0 and detections['precision'] == 0.75
+    assert detections['by_class']['text'] == _agreement(1, 2, 1)
+    assert detections['by_class']['arrow'] == _agreement(1, 1, 1)
+    assert stats['latency_ms']['primary'] == {'mean': 12.0, 'p50': 12.0, 'p95': 12.0}
+
+
+def test_sample_rate_zero_skips():
+    shadow = ShadowEvaluator(BoxModel(), sample_rate=0.0)
+    try:
+        assert not shadow.submit(_page(), detect(_page(), BoxModel()))
+        assert shadow.stats()['sampled'] == 0
+    finally:
+        shadow.close()
+
+
+class BlockingModel(BoxModel):
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def predict(self, source, imgsz=640, cancel=None):
+        self.started.set()
+        assert self.release.wait(5)
+        return super().predict(source, imgsz, cancel)
+
+
+def test_full_queue_drops_without_waiting():
+    model = BlockingModel()
+    samples = Samples()
+    shadow = ShadowEvaluator(model, sample_rate=1.0, max_pending=1, on_sample=samples)
+    page = _page()
+    primary = detect(page, BoxModel())
+    try:
+        assert shadow.submit(page, primary)
+        assert model.started.wait(5)
+        assert shadow.submit(page, primary)  # ждет в очереди
+        assert not shadow.submit(page, primary)
+        assert samples.results == [('dropped', None)]
+        model.release.set()
+        samples.wait(3)
+        stats = shadow.stats()
+    finally:
+        model.release.set()
+        shadow.close()
+    assert (stats['sampled'], stats['dropped'], stats['evaluated']) == (3, 1, 2)
+
+
+class BrokenModel(BoxModel):
+    def predict(self, source, imgsz=640, cancel=None):
+        raise RuntimeError('нет модели')
+
+
+def test_candidate_error_counted():
+    samples = Samples()
+    shadow = ShadowEvaluator(BrokenModel(), sample_rate=1.0, on_sample=samples)
+    try:
+        shadow.submit(_page(), detect(_page(), BoxModel()))
+        assert samples.wait(1) == [('error', None)]
+        assert shadow.stats()['errors'] == 1
+    finally:
+        shadow.close()
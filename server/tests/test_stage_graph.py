@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+from stage_graph import Cancelled, Stage, StageFailed, StageGraph
+
+
+@pytest.fixture
+def graph():
+    return StageGraph(max_workers=4)
+
+
+def _sleep(seconds, value=None):
+    def fn(results):
+        time.sleep(seconds)
+        return value
+    return fn
+
+
+def test_dependencies_get_results(graph):
+    results = graph.run([
+        Stage('a', lambda r: 1),
+        Stage('b', lambda r: 2),
+        Stage('c', lambda r: r['a'] + r['b'], deps=('a', 'b')),
+    ])
+    assert results == {'a': 1, 'b': 2, 'c': 3}
+
+
+def test_independent_stages_run_in_parallel(graph):
+    started = time.monotonic()
+    graph.run([Stage('a', _sleep(0.3)), Stage('b', _sleep(0.3))])
+    assert time.monotonic() - started < 0.5
+
+
+def test_fallback_replaces_failed_stage(graph):
+    def broken(results):
+        raise RuntimeError("нет рамки")
+
+    results = graph.run([
+        Stage('a', broken, fallback=lambda error: f"fallback: {error}"),
+        Stage('b', lambda r: r['a'], deps=('a',)),
+    ])
+    assert results['b'] == "fallback: нет рамки"
+
+
+def test_failure_without_fallback_is_fatal(graph):
+    def broken(results):
+        raise RuntimeError("сбой")
+
+    ran = []
+    with pytest.raises(StageFailed) as info:
+        graph.run([Stage('a', broken), Stage('b', lambda r: ran.append('b'), deps=('a',))])
+    assert info.value.stage == 'a'
+    assert ran == []
+
+
+def test_timeout(graph):
+    started = time.monotonic()
+    with pytest.raises(StageFailed) as info:
+        graph.run([Stage('a', _sleep(1.0), timeout=0.1)])
+    assert info.value.stage == 'a'
+    assert time.monotonic() - started < 0.5
+
+
+def test_timeout_with_fallback(graph):
+    results = graph.run([Stage('a', _sleep(1.0), timeout=0.1, fallback=lambda error: 'fallback')])
+    assert results == {'a': 'fallback'}
+
+
+def test_timeout_counts_wait_in_pool():
+    # Единственный поток занят этапом a: b ждет его, и это время входит в срок b
+    graph = StageGraph(max_workers=1)
+    results = graph.run([
+        Stage('a', _sleep(0.4, 'a')),
+        Stage('b', _sleep(0.01, 'b'), timeout=0.2, fallback=lambda error: 'timeout'),
+    ])
+    assert results == {'a': 'a', 'b': 'timeout'}
+
+
+def test_cancel_stops_pending_stages(graph):
+    cancel = threading.Event()
+    threading.Timer(0.1, cancel.set).start()
+    ran = []
+    started = time.monotonic()
+    with pytest.raises(Cancelled):
+        graph.run([Stage('a', _sleep(0.5)), Stage('b', lambda r: ran.append('b'), deps=('a',))], cancel=cancel)
+    assert time.monotonic() - started < 0.4
+    time.sleep(0.5)
+    assert ran == []
+
+
+def test_cancelled_stage_is_not_replaced_by_fallback(graph):
+    cancel = threading.Event()
+
+    def notices_cancel(results):
+        cancel.set()
+        raise Cancelled("Проверка отменена")
+
+    with pytest.raises(Cancelled):
+        graph.run([Stage('a', notices_cancel, fallback=lambda error: 'fallback')], cancel=cancel)
+
+
+def test_unresolvable_dependencies(graph):
+    with pytest.raises(ValueError):
+        graph.run([Stage('a', lambda r: 1, deps=('missing',))])
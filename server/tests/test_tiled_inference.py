@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from fake_model import BoxModel, blank_page, draw_box
+from tiled_inference import make_tiles, merge_boxes, detect_tiled
+
+
+def _arrays(boxes, classes=None, confidences=None):
+    boxes = np.asarray(boxes, dtype=np.float32)
+    classes = np.zeros(len(boxes), dtype=np.int64) if classes is None else np.asarray(classes, dtype=np.int64)
+    if confidences is None:
+        confidences = np.linspace(0.9, 0.5, len(boxes))
+    return boxes, classes, np.asarray(confidences, dtype=np.float32)
+
+
+# Плитки
+
+def test_tiles_cover_page_with_full_size_tiles():
+    tiles = make_tiles(2000, 1200, 1024, 0.2)
+    assert {(x1 - x0, y1 - y0) for x0, y0, x1, y1 in tiles} == {(1024, 1024)}
+    covered = np.zeros((1200, 2000), dtype=bool)
+    for x0, y0, x1, y1 in tiles:
+        covered[y0:y1, x0:x1] = True
+    assert covered.all()
+    # Последняя плитка ряда сдвинута к краю страницы
+    assert max(x1 for _, _, x1, _ in tiles) == 2000
+    assert max(y1 for _, _, _, y1 in tiles) == 1200
+
+
+def test_small_page_is_one_tile():
+    assert make_tiles(500, 300, 1024, 0.2) == [(0, 0, 500, 300)]
+
+
+def test_tiles_reject_bad_overlap():
+    with pytest.raises(ValueError):
+        make_tiles(2000, 2000, 1024, 1.0)
+
+
+# Склейка на стыках
+
+TILES = [(0, 0, 1024, 1024), (819, 0, 1843, 1024)]
+
+
+def test_seam_duplicate_keeps_most_confident():
+    boxes, classes, conf = _arrays([[900, 100, 950, 150], [901, 101, 951, 151]], confidences=[0.6, 0.8])
+    merged, merged_classes, merged_conf = merge_boxes(boxes, classes, conf, sources=np.array([0, 1]), tiles=TILES)
+    assert merged.tolist() == [[901, 101, 951, 151]]
+    assert merged_conf.tolist() == pytest.approx([0.8])
+
+
+def test_seam_duplicate_wbf_averages_by_confidence():
+    boxes, classes, conf = _arrays([[900, 100, 950, 150], [904, 100, 954, 150]], confidences=[0.25, 0.75])
+    merged, _, merged_conf = merge_boxes(boxes, classes, conf, method='wbf',
+                                         sources=np.array([0, 1]), tiles=TILES)
+    assert merged.tolist() == [[pytest.approx(903), 100, pytest.approx(953), 150]]
+    assert merged_conf.tolist() == pytest.approx([0.5])
+
+
+def test_same_tile_neighbours_are_not_merged():
+    # Мелкий бокс внутри крупного (IoS = 1): модель уже развела их своим NMS
+    boxes, classes, conf = _arrays([[100, 100, 400, 400], [150, 150, 200, 200]])
+    merged, _, _ = merge_boxes(boxes, classes, conf, sources=np.array([0, 0]), tiles=TILES)
+    assert len(merged) == 2
+
+
+def test_overlap_outside_seam_band_is_not_merged():
+    # Пересечение левее полосы перекрытия плиток (x < 819)
+    boxes, classes, conf = _arrays([[700, 100, 800, 200], [705, 105, 805, 205]])
+    merged, _, _ = merge_boxes(boxes, classes, conf, sources=np.array([0, 1]), tiles=TILES)
+    assert len(merged) == 2
+
+
+def test_one_box_per_tile_in_cluster():
+    # Два бокса одной плитки у стыка и один с соседней: с соседней склеивается только лучший по перекрытию
+    boxes, classes, conf = _arrays([[900, 100, 950, 150], [900, 100, 950, 150], [900, 120, 950, 150]],
+                                   confidences=[0.9, 0.8, 0.7])
+    merged, _, merged_conf = merge_boxes(boxes, classes, conf, sources=np.array([0, 1, 1]), tiles=TILES)
+    assert merged.tolist() == [[900, 100, 950, 150], [900, 120, 950, 150]]
+    assert merged_conf.tolist() == pytest.approx([0.9, 0.7])
+
+
+def test_classes_are_merged_separately():
+    boxes, classes, conf = _arrays([[900, 100, 950, 150], [900, 100, 950, 150]], classes=[0, 1])
+    merged, merged_classes, _ = merge_boxes(boxes, classes, conf, sources=np.array([0, 1]), tiles=TILES)
+    assert sorted(merged_classes.tolist()) == [0, 1]
+
+
+def test_without_sources_plain_nms():
+    boxes, classes, conf = _arrays([[100, 100, 400, 400], [150, 150, 200, 200]])
+    merged, _, _ = merge_boxes(boxes, classes, conf)
+    assert merged.tolist() == [[100, 100, 400, 400]]
+
+
+# Нарезанный инференс
+
+def test_detect_tiled_page_coordinates():
+    page = blank_page(2000, 1200)
+    drawn = [
+        ((100, 100, 160, 130), 0),
+        ((900, 100, 950, 150), 1),     # в перекрытии двух плиток
+        ((1500, 1100, 1600, 1150), 2),
+        ((1700, 600, 1750, 640), 0),
+    ]
+    for box, cls_id in drawn:
+        draw_box(page, box, cls_id)
+    model = BoxModel()
+
+    detections, report = detect_tiled(page, model, tile_size=1024, overlap=0.2)
+
+    found = sorted((tuple(box), cls) for box, cls in zip(detections.boxes.tolist(), detections.classes.tolist()))
+    assert found == sorted(drawn)
+    # Все плитки - одним вызовом, батчи делит планировщик
+    assert model.calls == [(report['tiles'], 1024)]
+    assert report['tiles'] == 6
+    assert report['merged_detections'] == 4
+    assert report['raw_detections'] > report['merged_detections']
+    assert len(report['tile_timings']) == report['tiles']
+    assert 'parallelism' not in report
+
+
+def test_detect_tiled_passes_cancel():
+    model = BoxModel()
+    cancel = object()
+    detect_tiled(blank_page(1200, 800), model, tile_size=1024, cancel=cancel)
+    assert model.cancels == [cancel]
@@ -0,0 +1,174 @@
+import time
+
+import numpy as np
+
+from detections import Detections
+
+
+def make_tiles(width, height, tile_size, overlap):
+    """
+    Перекрывающиеся плитки (x0, y0, x1, y1), покрывающие всю страницу.
+    Последняя плитка в ряду сдвигается назад, чтобы все плитки были полного размера.
+    """
+    if not 0 <= overlap < 1:
+        raise ValueError("overlap должен быть в диапазоне [0, 1)")
+    step = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        positions = list(range(0, length - tile_size, step))
+        positions.append(length - tile_size)
+        return positions
+
+    return [
+        (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+        for y0 in starts(height)
+        for x0 in starts(width)
+    ]
+
+
+def _overlap_matrix(box, boxes, metric):
+    """IoU или IoS (пересечение к меньшей площади) одного бокса со списком"""
+    ix0 = np.maximum(box[0], boxes[:, 0])
+    iy0 = np.maximum(box[1], boxes[:, 1])
+    ix1 = np.minimum(box[2], boxes[:, 2])
+    iy1 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(ix1 - ix0, 0, None) * np.clip(iy1 - iy0, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    if metric == 'ios':
+        denom = np.minimum(area, areas)
+    else:
+        denom = area + areas - inter
+    return inter / np.maximum(denom, 1e-6)
+
+
+def _seam_pairs(box, boxes, source, sources, tiles):
+    """
+    Какие боксы могут быть дублем box с соседней плитки: найдены на другой плитке
+    и пересекаются с box внутри полосы перекрытия этих двух плиток.
+    """
+    tile = tiles[source]
+    other = tiles[sources]
+    band = np.stack([np.maximum(tile[0], other[:, 0]), np.maximum(tile[1], other[:, 1]),
+                     np.minimum(tile[2], other[:, 2]), np.minimum(tile[3], other[:, 3])], axis=1)
+    inter = np.stack([np.maximum(box[0], boxes[:, 0]), np.maximum(box[1], boxes[:, 1]),
+                      np.minimum(box[2], boxes[:, 2]), np.minimum(box[3], boxes[:, 3])], axis=1)
+    eps = 1.0
+    return ((sources != source)
+            & (inter[:, 0] >= band[:, 0] - eps) & (inter[:, 1] >= band[:, 1] - eps)
+            & (inter[:, 2] <= band[:, 2] + eps) & (inter[:, 3] <= band[:, 3] + eps))
+
+
+def merge_boxes(boxes, classes, confidences, method='nms', threshold=0.5, metric='ios',
+                sources=None, tiles=None):
+    """
+    Склейка дублей на стыках плиток (отдельно по каждому классу).
+    method='nms' - оставляем самый уверенный бокс,
+    method='wbf' - усредняем координаты с весами по уверенности.
+    sources - номер плитки каждого бокса, tiles - плитки (x0, y0, x1, y1):
+    тогда склеиваются только боксы с разных плиток, пересекающиеся в полосе
+    их перекрытия, и не больше одного бокса с каждой плитки. Боксы одной
+    плитки модель уже развела своим NMS, и соседние объекты не поглощаются.
+    """
+    seams = sources is not None
+    if seams:
+        tiles = np.asarray(tiles, dtype=np.float32).reshape(-1, 4)
+    keep_boxes, keep_classes, keep_conf = [], [], []
+    for cls_id in np.unique(classes):
+        mask = classes == cls_id
+        order = np.argsort(-confidences[mask])
+        cls_boxes = boxes[mask][order]
+        cls_conf = confidences[mask][order]
+        cls_sources = sources[mask][order] if seams else None
+
+        used = np.zeros(len(cls_boxes), dtype=bool)
+        for i in range(len(cls_boxes)):
+            if used[i]:
+                continue
+            overlap = _overlap_matrix(cls_boxes[i], cls_boxes, metric)
+            cluster = (~used) & (overlap >= threshold)
+            if seams:
+                cluster &= _seam_pairs(cls_boxes[i], cls_boxes, cls_sources[i], cls_sources, tiles)
+                # С каждой плитки - лучший по перекрытию кандидат
+                for source in np.unique(cls_sources[cluster]):
+                    same = cluster & (cls_sources == source)
+                    best = np.argmax(np.where(same, overlap, -1.0))
+                    cluster[same] = False
+                    cluster[best] = True
+            cluster[i] = True
+            used |= cluster
+
+            if method == 'wbf':
+                weights = cls_conf[cluster]
+                box = (cls_boxes[cluster] * weights[:, None]).sum(axis=0) / weights.sum()
+                conf = weights.mean()
+            else:
+                box = cls_boxes[i]
+                conf = cls_conf[i]
+
+            keep_boxes.append(box)
+            keep_classes.append(cls_id)
+            keep_conf.append(conf)
+
+    return (np.array(keep_boxes, dtype=np.float32).reshape(-1, 4),
+            np.array(keep_classes, dtype=np.int64),
+            np.array(keep_conf, dtype=np.float32))
+
+
+def detect_tiled(image: np.ndarray, model, tile_size=1024, overlap=0.2,
+                 merge='nms', merge_threshold=0.5, cancel=None):
+    """
+    Нарезанный инференс в родном разрешении.
+    Все плитки уходят в модель одним вызовом: InferenceScheduler сам делит их
+    на батчи (INFERENCE_MAX_BATCH_SIZE) вместе с изображениями других запросов.
+    Боксы переводятся в координаты страницы и склеиваются на стыках.
+    cancel - флаг отмены для ожидания в InferenceScheduler (см. detections.detect).
+    Возвращает Detections и отчет с таймингами по плиткам.
+    """
+    started = time.perf_counter()
+    h, w = image.shape[:2]
+    tiles = make_tiles(w, h, tile_size, overlap)
+    crops = [image[y0:y1, x0:x1] for x0, y0, x1, y1 in tiles]
+
+    predict_started = time.perf_counter()
+    kwargs = {'cancel': cancel} if cancel is not None else {}
+    results = model.predict(crops, imgsz=tile_size, **kwargs)
+    predict_ms = (time.perf_counter() - predict_started) * 1000.0
+
+    all_boxes, all_classes, all_conf, all_sources = [], [], [], []
+    tile_timings = []
+    for i, result in enumerate(results):
+        x0, y0, x1, y1 = tiles[i]
+        tile_det = Detections.from_results([result])
+        all_boxes.append(tile_det.boxes + np.array([x0, y0, x0, y0], dtype=np.float32))
+        all_classes.append(tile_det.classes)
+        all_conf.append(tile_det.confidences)
+        all_sources.append(np.full(len(tile_det), i, dtype=np.int64))
+
+        # ultralytics отдает время по каждому изображению, иначе делим общее время
+        speed = getattr(result, 'speed', None)
+        tile_timings.append({
+            'tile': [x0, y0, x1, y1],
+            'detections': len(tile_det),
+            'inference_ms': round(float(speed['inference']) if speed else predict_ms / len(tiles), 2),
+        })
+
+    boxes, classes, confidences = merge_boxes(
+        np.concatenate(all_boxes), np.concatenate(all_classes), np.concatenate(all_conf),
+        method=merge, threshold=merge_threshold, sources=np.concatenate(all_sources), tiles=tiles)
+    raw_count = sum(len(c) for c in all_classes)
+
+    report = {
+        'mode': 'tiled',
+        'tile_size': tile_size,
+        'overlap': overlap,
+        'merge': merge,
+        'tiles': len(tiles),
+        'raw_detections': raw_count,
+        'merged_detections': len(boxes),
+        'tile_timings': tile_timings,
+        'total_ms': round((time.perf_counter() - started) * 1000.0, 2),
+    }
+    return Detections(boxes, classes, confidences), report